@@ -2,37 +2,224 @@ import zmq
 import threading
 import time
 import json
+import itertools
 import os
+import queue
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import journal
+import config
+import formato
+import idempotencia
+import metricas
 
 SALONES_DISPONIBLES_ORIGINALES = 380
 LABORATORIOS_DISPONIBLES_ORIGINALES = 60
 
+DTI_BIND = config.endpoint("DTI_PRIMARIO", bind=True)
+# Modo del servidor: "rep" (una solicitud a la vez) o "router" (muchas en vuelo)
+DTI_MODO = os.environ.get("DTI_MODO", "rep")
+DTI_HILOS = int(os.environ.get("DTI_HILOS", "16"))
+# Modo router: tope de solicitudes aceptadas sin responder; al llegar a él se deja de leer el socket
+DTI_EN_VUELO = int(os.environ.get("DTI_EN_VUELO", str(4 * DTI_HILOS)))
+# Retardo simulado de servicio por solicitud, en segundos (antes: time.sleep(1) fijo)
+DTI_RETARDO = float(os.environ.get("DTI_RETARDO", "0"))
+# Cada cuántos segundos el compactador regenera los archivos por semestre
+DTI_COMPACTAR_S = float(os.environ.get("DTI_COMPACTAR_S", "5"))
+# Si es 1, se responde solo cuando los eventos de la solicitud están en disco
+DTI_JOURNAL_ESPERA = os.environ.get("DTI_JOURNAL_ESPERA", "1") == "1"
+# Si es 1, al arrancar se reconstruye el estado desde snapshot + diario; si es 0, se parte de cero
+DTI_RECUPERAR = os.environ.get("DTI_RECUPERAR", "1") == "1"
+SNAPSHOT_FILE = "resultados/snapshot.json"
+# Rol en la replicación: el primario publica cada lote asignado en DTI_REPLICA y el respaldo lo aplica
+DTI_ROL = os.environ.get("DTI_ROL") or (
+    "respaldo" if DTI_BIND == config.endpoint("DTI_RESPALDO", bind=True) else "primario")
+# Si es 0, el respaldo no sigue al primario (parte de su propio estado, como antes)
+DTI_REPLICACION = os.environ.get("DTI_REPLICACION", "1") == "1"
+DTI_REPLICA = config.endpoint("DTI_REPLICA", bind=DTI_ROL == "primario")
+# Cada cuánto el primario publica un latido con su última secuencia (para detectar huecos en reposo)
+DTI_REPLICA_LATIDO_MS = int(os.environ.get("DTI_REPLICA_LATIDO_MS", "1000"))
+
 disponibilidad_por_semestre = {}
 lock = threading.Lock()
 resultados_asignacion = {}
 estado_asignaciones = {}
+semestres_pendientes = set()    # semestres con cambios aún no compactados
+historial_listo = threading.Event()   # resultados anteriores al snapshot ya cargados
+
+# Estado de la replicación. En el primario `seq` numera los lotes publicados; en el respaldo es el último
+# aplicado. `epoca` cambia en cada arranque del primario, así el respaldo nota un reinicio aunque `seq`
+# vuelva a empezar. `propios` cuenta los lotes que el respaldo asignó él mismo (durante un failover).
+replica = {"epoca": uuid.uuid4().hex[:12] if DTI_ROL == "primario" else None,
+           "seq": 0, "propios": 0, "divergido": False, "promovido": False}
+_replica_cola = queue.SimpleQueue()     # (seq, t, eventos) hacia el hilo publicador
+_retraso_replica = metricas.Histograma()
+
+# Idempotencia: ids de lote ya aplicados (se reconstruyen desde el diario y llegan con la réplica) y, para los
+# más recientes, la respuesta completa, con la que un repetido se contesta sin tomar el `lock`.
+_aplicadas = idempotencia.CacheLRU()
+_respuestas = idempotencia.CacheLRU(idempotencia.IDEMPOTENCIA_RESPUESTAS)
 
 # Función: cargar_estado_asignaciones
 # Parámetros: Ninguno
 #
 # Funcionalidad:
-# Esta función se encarga de cargar el estado de las asignaciones desde un archivo JSON. Si el archivo no existe,
-# crea un nuevo archivo y borra los datos anteriores. También limpia los diccionarios que mantienen el estado 
-# de las asignaciones y la disponibilidad de los recursos.
+# Reconstruye el estado del DTI al arrancar. Primero carga el snapshot (contadores por semestre, ids de lote
+# ya aplicados y posición del diario) y reaplica solo la cola del diario posterior a él; con eso el DTI ya
+# puede asignar sin duplicar salones ni lotes. Después, en un hilo aparte, carga desde el diario el historial
+# de resultados anterior al snapshot; las solicitudes no lo esperan.
+# Con DTI_RECUPERAR=0 se conserva el comportamiento original: se borra el estado y se trunca el diario.
 #
 # Uso de recursos:
-# - Maneja archivos JSON para almacenar y cargar el estado de las asignaciones.
-# - Limpia los diccionarios globales para reiniciar el estado.
+# - Lee `snapshot.json` y `journal.jsonl`; mide e imprime el tiempo hasta quedar listo.
+# - Limpia los diccionarios globales antes de reconstruirlos.
 
 def cargar_estado_asignaciones():
-    global estado_asignaciones
-    archivo_estado = "resultados/estado_asignaciones.json"
-    if os.path.exists(archivo_estado):
-        with open(archivo_estado, "w", encoding="utf-8") as f:
-            json.dump({}, f, ensure_ascii=False, indent=4)
-    estado_asignaciones = {}
+    t0 = time.perf_counter()
+    estado_asignaciones.clear()
     disponibilidad_por_semestre.clear()
     resultados_asignacion.clear()
+    historial_listo.clear()
+
+    if not DTI_RECUPERAR:
+        archivo_estado = "resultados/estado_asignaciones.json"
+        if os.path.exists(archivo_estado):
+            with open(archivo_estado, "w", encoding="utf-8") as f:
+                json.dump({}, f, ensure_ascii=False, indent=4)
+        journal.abrir(truncar=True)
+        historial_listo.set()
+        return
+
+    journal.reparar()
+    desde = 0
+    if os.path.exists(SNAPSHOT_FILE):
+        with open(SNAPSHOT_FILE, "r", encoding="utf-8") as f:
+            snapshot = json.load(f)
+        estado_asignaciones.update(snapshot["estado_asignaciones"])
+        disponibilidad_por_semestre.update(snapshot["disponibilidad_por_semestre"])
+        desde = snapshot["posicion"]
+        for solicitud in snapshot.get("solicitudes", []):
+            _aplicadas.guardar(solicitud)   # sus resultados llegan con el historial
+
+    eventos = 0
+    for evento in journal.leer(desde=desde):
+        _reaplicar(evento, contadores=True)
+        eventos += 1
+
+    journal.abrir()
+    listo_ms = (time.perf_counter() - t0) * 1000
+    print(f"[DTI] Estado recuperado en {listo_ms:.1f} ms "
+          f"({len(disponibilidad_por_semestre)} semestres, {eventos} eventos del diario)")
+
+    threading.Thread(target=_cargar_historial, args=(desde,), daemon=True).start()
+    return listo_ms
+
+# Función: _reaplicar
+# Parámetros:
+#   - evento (dict): Resultado de un programa tal como quedó en el diario (incluye "semestre" y, si el lote
+#     lo traía, su "id").
+#   - contadores (bool): Si es True también descuenta la disponibilidad y suma lo solicitado.
+#
+# Funcionalidad:
+# Vuelve a aplicar un evento del diario sobre el estado en memoria y recuerda el id de su lote como ya
+# aplicado. El llamador debe tener el `lock` si hay otros hilos activos.
+def _reaplicar(evento, contadores):
+    semestre = evento.pop("semestre")
+    solicitud = evento.pop("id", None)
+    if solicitud:
+        _recordar(solicitud, evento)
+    if contadores:
+        if semestre not in estado_asignaciones:
+            estado_asignaciones[semestre] = {
+                'salones_disponibles': SALONES_DISPONIBLES_ORIGINALES,
+                'laboratorios_disponibles': LABORATORIOS_DISPONIBLES_ORIGINALES,
+                'salones_solicitados': 0,
+                'laboratorios_solicitados': 0
+            }
+            disponibilidad_por_semestre[semestre] = {
+                'salones': SALONES_DISPONIBLES_ORIGINALES,
+                'laboratorios': LABORATORIOS_DISPONIBLES_ORIGINALES
+            }
+        disponibles = disponibilidad_por_semestre[semestre]
+        estado = estado_asignaciones[semestre]
+        disponibles['salones'] -= evento['salones_asignados']
+        disponibles['laboratorios'] -= evento['laboratorios_asignados']
+        estado['salones_solicitados'] += evento['salones_solicitados']
+        estado['laboratorios_solicitados'] += evento['laboratorios_solicitados']
+        estado['salones_disponibles'] = max(disponibles['salones'], 0)
+        estado['laboratorios_disponibles'] = max(disponibles['laboratorios'], 0)
+
+    clave = f"{evento['facultad']}_{semestre}"
+    resultados_asignacion.setdefault(clave, []).append(evento)
+
+# Función: _recordar
+# Parámetros:
+#   - solicitud (str): Id del lote al que pertenece `evento`.
+#   - evento (dict): Resultado de un programa del lote, el mismo objeto que queda en `resultados_asignacion`.
+#
+# Funcionalidad:
+# Marca el lote como aplicado y le suma el resultado, para que un repetido se conteste con los resultados del
+# original aunque su respuesta ya no esté en `_respuestas`.
+def _recordar(solicitud, evento):
+    lote = _aplicadas.obtener(solicitud)
+    if not isinstance(lote, list):        # nuevo, o solo el id (snapshot de réplica)
+        lote = []
+        _aplicadas.guardar(solicitud, lote)
+    lote.append(evento)
+
+# Función: _cargar_historial
+# Parámetros:
+#   - hasta (int): Posición del diario donde empieza la cola ya reaplicada.
+#
+# Funcionalidad:
+# Carga en segundo plano los resultados anteriores al snapshot (sin tocar contadores, que ya vienen del
+# snapshot) y los antepone a los resultados de la cola: primero los que el diario ya traspasó a su historial
+# y luego los que aún quedan en el diario antes de `hasta`. Sus ids entran en `_aplicadas` como los más
+# viejos, sin desplazar a los de la cola (a los que ya venían en el snapshot solo se les completan los
+# resultados). Al terminar marca `historial_listo`.
+def _cargar_historial(hasta):
+    t0 = time.perf_counter()
+    previos = {}
+    lotes = {}          # id → resultados, en el orden del diario
+    desde = journal.fin_historial()
+    for evento in itertools.chain(journal.leer_historial(),
+                                  journal.leer(desde=desde, hasta=hasta)):
+        semestre = evento.pop("semestre")
+        solicitud = evento.pop("id", None)
+        if solicitud:
+            lotes.setdefault(solicitud, []).append(evento)
+        previos.setdefault(f"{evento['facultad']}_{semestre}", []).append(evento)
+
+    with lock:
+        _aplicadas.agregar_antiguos(lotes.items())
+        for clave, items in previos.items():
+            resultados_asignacion[clave] = items + resultados_asignacion.get(clave, [])
+    historial_listo.set()
+    print(f"[DTI] Historial cargado en {(time.perf_counter() - t0) * 1000:.1f} ms")
+
+# Función: guardar_snapshot
+# Parámetros: Ninguno
+#
+# Funcionalidad:
+# Guarda los contadores por semestre y los ids de lote ya aplicados junto con la posición del diario que
+# reflejan; así, tras un reinicio, un reintento se reconoce sin esperar al historial. Se escribe solo cuando
+# esa parte del diario ya está en disco, así el snapshot nunca va por delante del diario. Con el snapshot
+# ya escrito, el diario pasa a su historial todo lo anterior a esa posición y se queda solo con la cola.
+def guardar_snapshot():
+    with lock:
+        seq, posicion = journal.posicion()
+        snapshot = {
+            "posicion": posicion,
+            "estado_asignaciones": {sem: dict(est) for sem, est in estado_asignaciones.items()},
+            "disponibilidad_por_semestre": {sem: dict(d) for sem, d in disponibilidad_por_semestre.items()},
+            "solicitudes": _aplicadas.claves(),
+        }
+    if not journal.esperar(seq):
+        print("[DTI] El diario no confirmó a tiempo; se omite este snapshot")
+        return
+    os.makedirs("resultados", exist_ok=True)
+    _escribir_json(SNAPSHOT_FILE, snapshot)
+    journal.truncar(snapshot["posicion"])
 
     # Función: guardar_estado_asignaciones
 # Parámetros: Ninguno
@@ -47,13 +234,26 @@ def cargar_estado_asignaciones():
 
 def guardar_estado_asignaciones():
     with lock:
-        archivo_estado = "resultados/estado_asignaciones.json"
-        os.makedirs("resultados", exist_ok=True)
-        with open(archivo_estado, "w", encoding="utf-8") as f:
-            json.dump(estado_asignaciones, f, ensure_ascii=False, indent=4)
+        copia = {sem: dict(est) for sem, est in estado_asignaciones.items()}
+    archivo_estado = "resultados/estado_asignaciones.json"
+    os.makedirs("resultados", exist_ok=True)
+    _escribir_json(archivo_estado, copia)
 
+# Función: _escribir_json
+# Parámetros:
+#   - ruta (str): Archivo destino.
+#   - datos: Objeto serializable a JSON.
+#
+# Funcionalidad:
+# Escribe en un archivo temporal y lo renombra, para que nadie lea nunca un archivo a medio escribir.
+def _escribir_json(ruta, datos):
+    temporal = ruta + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False, indent=4)
+    os.replace(temporal, ruta)
 
-# Función: procesar_programa
+
+# Función: _asignar_programa
 # Parámetros:
 #   - programa (dict): Diccionario que contiene información sobre un programa (nombre, salones, laboratorios solicitados).
 #   - facultad (str): Nombre de la facultad que solicita los recursos.
@@ -65,73 +265,320 @@ def guardar_estado_asignaciones():
 # disponibles, se muestra un mensaje de error. Los resultados de la asignación se almacenan en un diccionario global.
 #
 # Uso de recursos:
+# - El llamador DEBE tener tomado el `lock`; aquí no se adquiere.
+# - Utiliza un diccionario global para almacenar y actualizar el estado de las asignaciones y la disponibilidad de recursos.
+
+def _asignar_programa(programa, facultad, semestre):
+    if semestre not in estado_asignaciones:
+        estado_asignaciones[semestre] = {
+            'salones_disponibles': SALONES_DISPONIBLES_ORIGINALES,
+            'laboratorios_disponibles': LABORATORIOS_DISPONIBLES_ORIGINALES,
+            'salones_solicitados': 0,
+            'laboratorios_solicitados': 0
+        }
+        disponibilidad_por_semestre[semestre] = {
+            'salones': SALONES_DISPONIBLES_ORIGINALES,
+            'laboratorios': LABORATORIOS_DISPONIBLES_ORIGINALES
+        }
+
+    disponibles = disponibilidad_por_semestre[semestre]
+    estado = estado_asignaciones[semestre]
+
+    estado['salones_solicitados'] += programa['salones']
+    estado['laboratorios_solicitados'] += programa['laboratorios']
+
+    resultado = {
+        "facultad": facultad,
+        "programa": programa['nombre'],
+        "salones_solicitados": programa['salones'],
+        "laboratorios_solicitados": programa['laboratorios'],
+        "salones_asignados": 0,
+        "laboratorios_asignados": 0
+    }
+
+    salones_usados_como_labs = 0
+
+    if disponibles['laboratorios'] >= programa['laboratorios']:
+        disponibles['laboratorios'] -= programa['laboratorios']
+        resultado["laboratorios_asignados"] = programa['laboratorios']
+        print(f"[DTI] {programa['nombre']} ({facultad}) recibió {programa['laboratorios']} laboratorios.")
+    elif disponibles['salones'] >= programa['laboratorios']:
+        disponibles['salones'] -= programa['laboratorios']
+        resultado["salones_asignados"] += programa['laboratorios']
+        salones_usados_como_labs = programa['laboratorios']
+        print(f"[DTI] {programa['nombre']} ({facultad}) recibió {programa['laboratorios']} salones como laboratorios.")
+    else:
+        print(f"[DTI] {programa['nombre']} ({facultad}) no recibió laboratorios ni salones como sustituto.")
+
+    if disponibles['salones'] >= programa['salones']:
+        disponibles['salones'] -= programa['salones']
+        resultado["salones_asignados"] += programa['salones']
+        print(f"[DTI] {programa['nombre']} ({facultad}) recibió {programa['salones']} salones.")
+    else:
+        print(f"[DTI] {programa['nombre']} ({facultad}) no recibió salones.")
+
+    if salones_usados_como_labs > 0:
+        resultado["salones_como_laboratorios"] = salones_usados_como_labs
+
+    clave = f"{facultad}_{semestre}"
+    if clave not in resultados_asignacion:
+        resultados_asignacion[clave] = []
+    resultados_asignacion[clave].append(resultado)
+
+    estado['salones_disponibles'] = max(disponibles['salones'], 0)
+    estado['laboratorios_disponibles'] = max(disponibles['laboratorios'], 0)
+    semestres_pendientes.add(semestre)
+
+    return resultado
+
+# Función: procesar_programa
+# Parámetros:
+#   - programa (dict), facultad (str), semestre (str): ver `_asignar_programa`.
+#
+# Funcionalidad:
+# Camino original de un hilo por programa: toma el `lock`, asigna un único programa y luego espera
+# `DTI_RETARDO` segundos para simular el tiempo de servicio. Se conserva para comparar con `procesar_lote`.
+#
+# Uso de recursos:
 # - Utiliza un `lock` para garantizar que el acceso a los recursos compartidos (estado de asignaciones y disponibilidad) 
 #   sea seguro cuando se procesan múltiples solicitudes en paralelo.
-# - Utiliza un diccionario global para almacenar y actualizar el estado de las asignaciones y la disponibilidad de recursos.
-# - Usa `time.sleep(1)` al final para simular un retraso en la asignación de recursos
 
 def procesar_programa(programa, facultad, semestre):
     with lock:
-        if semestre not in estado_asignaciones:
-            estado_asignaciones[semestre] = {
-                'salones_disponibles': SALONES_DISPONIBLES_ORIGINALES,
-                'laboratorios_disponibles': LABORATORIOS_DISPONIBLES_ORIGINALES,
-                'salones_solicitados': 0,
-                'laboratorios_solicitados': 0
-            }
-            disponibilidad_por_semestre[semestre] = {
-                'salones': SALONES_DISPONIBLES_ORIGINALES,
-                'laboratorios': LABORATORIOS_DISPONIBLES_ORIGINALES
-            }
-
-        disponibles = disponibilidad_por_semestre[semestre]
-        estado = estado_asignaciones[semestre]
+        _asignar_programa(programa, facultad, semestre)
 
-        estado['salones_solicitados'] += programa['salones']
-        estado['laboratorios_solicitados'] += programa['laboratorios']
+    if DTI_RETARDO:
+        time.sleep(DTI_RETARDO)
 
-        resultado = {
-            "facultad": facultad,
-            "programa": programa['nombre'],
-            "salones_solicitados": programa['salones'],
-            "laboratorios_solicitados": programa['laboratorios'],
-            "salones_asignados": 0,
-            "laboratorios_asignados": 0
-        }
+# Función: procesar_lote
+# Parámetros:
+#   - programas (list): Lista de programas de una misma solicitud.
+#   - facultad (str): Nombre de la facultad que solicita los recursos.
+#   - semestre (str): El semestre en el que se solicita la asignación de recursos.
+#   - solicitud (str): Id de idempotencia del lote, o None.
+#
+# Funcionalidad:
+# Núcleo de asignación por lotes: aplica todos los programas de la solicitud en una sola pasada, en el
+# orden recibido, tomando el `lock` una única vez. Los resultados se anexan al diario en el mismo orden.
+# El retardo simulado `DTI_RETARDO` se aplica una vez por solicitud, fuera del `lock`.
+# Si el id ya se aplicó (un reintento que llega mientras el original aún no responde, o un lote que ya vino
+# por la réplica) no se asigna nada. Devuelve el número de secuencia del diario, para poder esperar a que
+# esté en disco, y los resultados del lote (los del original si es un repetido; None si de ese original solo
+# se conoce el id, p. ej. uno anterior al snapshot mientras el historial aún se carga).
+#
+# Uso de recursos:
+# - Una sola adquisición del `lock` por solicitud; no crea hilos.
 
-        salones_usados_como_labs = 0
-
-        if disponibles['laboratorios'] >= programa['laboratorios']:
-            disponibles['laboratorios'] -= programa['laboratorios']
-            resultado["laboratorios_asignados"] = programa['laboratorios']
-            print(f"[DTI] {programa['nombre']} ({facultad}) recibió {programa['laboratorios']} laboratorios.")
-        elif disponibles['salones'] >= programa['laboratorios']:
-            disponibles['salones'] -= programa['laboratorios']
-            resultado["salones_asignados"] += programa['laboratorios']
-            salones_usados_como_labs = programa['laboratorios']
-            print(f"[DTI] {programa['nombre']} ({facultad}) recibió {programa['laboratorios']} salones como laboratorios.")
+def procesar_lote(programas, facultad, semestre, solicitud=None):
+    with lock:
+        previos = _aplicadas.obtener(solicitud) if solicitud else None
+        if previos is not None:
+            print(f"[DTI] Solicitud {solicitud} repetida: no se vuelve a asignar")
+            # el original ya está en el diario hasta aquí
+            return journal.posicion()[0], previos if isinstance(previos, list) else None
+        resultados = [_asignar_programa(programa, facultad, semestre) for programa in programas]
+        if solicitud:
+            _aplicadas.guardar(solicitud, resultados)
+        eventos = [{**r, "semestre": semestre, **({"id": solicitud} if solicitud else {})}
+                   for r in resultados]
+        seq = journal.registrar(eventos)
+        if DTI_ROL == "primario":
+            # bajo el `lock`: los lotes se publican en el mismo orden en que se aplicaron
+            replica["seq"] += 1
+            _replica_cola.put((replica["seq"], time.time(), eventos))
         else:
-            print(f"[DTI] {programa['nombre']} ({facultad}) no recibió laboratorios ni salones como sustituto.")
+            replica["propios"] += 1
 
-        if disponibles['salones'] >= programa['salones']:
-            disponibles['salones'] -= programa['salones']
-            resultado["salones_asignados"] += programa['salones']
-            print(f"[DTI] {programa['nombre']} ({facultad}) recibió {programa['salones']} salones.")
-        else:
-            print(f"[DTI] {programa['nombre']} ({facultad}) no recibió salones.")
+    if DTI_RETARDO:
+        time.sleep(DTI_RETARDO)
+    return seq, resultados
 
-        if salones_usados_como_labs > 0:
-            resultado["salones_como_laboratorios"] = salones_usados_como_labs
+# Función: publicar_replica
+# Parámetros: Ninguno
+#
+# Funcionalidad:
+# Hilo del primario que publica en DTI_REPLICA, en orden, cada lote que `procesar_lote` deja en la cola:
+# [b"rep", {"epoca", "seq", "t", "eventos"}]. Los eventos son los mismos que van al diario. Si no hay lotes
+# durante DTI_REPLICA_LATIDO_MS publica un latido sin eventos con la última secuencia, con el que el
+# respaldo detecta lotes perdidos aunque no llegue ninguno nuevo.
+#
+# Uso de recursos:
+# - Un socket PUB propio de este hilo (los sockets de ZeroMQ no se comparten entre hilos).
+# - Un suscriptor lento o caído no frena al primario: el PUB descarta al llenarse su cola.
+def publicar_replica():
+    context = zmq.Context.instance()
+    pub = context.socket(zmq.PUB)
+    pub.setsockopt(zmq.LINGER, 0)
+    pub.bind(DTI_REPLICA)
+    print(f"[DTI] Publicando la réplica en {DTI_REPLICA} (época {replica['epoca']})")
+
+    ultimo = replica["seq"]     # el latido anuncia lo ya publicado, no lo que aún está en la cola
+    while True:
+        try:
+            ultimo, t, eventos = _replica_cola.get(timeout=DTI_REPLICA_LATIDO_MS / 1000)
+            mensaje = {"epoca": replica["epoca"], "seq": ultimo, "t": t, "eventos": eventos}
+        except queue.Empty:
+            mensaje = {"epoca": replica["epoca"], "seq": ultimo, "t": time.time()}
+        pub.send_multipart([b"rep", json.dumps(mensaje, ensure_ascii=False).encode("utf-8")])
+
+# Función: snapshot_replica
+# Parámetros: Ninguno
+#
+# Funcionalidad:
+# Copia completa del estado del primario junto con la secuencia de réplica que refleja, tomada bajo el
+# `lock` para que ambas coincidan. El respaldo la pide al arrancar o al detectar un hueco, y después
+# aplica solo los lotes con secuencia mayor. Mientras el historial se carga contesta un error (el respaldo
+# reintenta) en lugar de bloquear el bucle que también atiende solicitudes y pings.
+def snapshot_replica():
+    if not historial_listo.is_set():
+        raise RuntimeError("el historial aún se está cargando")
+    with lock:
+        return {
+            "epoca": replica["epoca"],
+            "seq": replica["seq"],
+            "estado_asignaciones": {sem: dict(est) for sem, est in estado_asignaciones.items()},
+            "disponibilidad_por_semestre": {sem: dict(d) for sem, d in disponibilidad_por_semestre.items()},
+            "resultados_asignacion": {clave: [dict(r) for r in items]
+                                      for clave, items in resultados_asignacion.items()},
+            "solicitudes": _aplicadas.claves(),
+        }
 
-        clave = f"{facultad}_{semestre}"
-        if clave not in resultados_asignacion:
-            resultados_asignacion[clave] = []
-        resultados_asignacion[clave].append(resultado)
+# Función: _pedir_snapshot
+# Parámetros:
+#   - timeout_ms (int): Espera máxima de la respuesta del primario.
+#
+# Funcionalidad:
+# Pide `snapshot_replica` al primario por su endpoint normal (un REQ nuevo por intento, como el
+# health-check). Devuelve el diccionario o None si el primario no contesta o contesta un error.
+def _pedir_snapshot(timeout_ms=5000):
+    context = zmq.Context.instance()
+    socket = context.socket(zmq.REQ)
+    socket.setsockopt(zmq.LINGER, 0)
+    socket.setsockopt(zmq.RCVTIMEO, timeout_ms)
+    socket.setsockopt(zmq.SNDTIMEO, timeout_ms)
+    try:
+        socket.connect(config.endpoint("DTI_PRIMARIO"))
+        socket.send(json.dumps({"replica": "snapshot"}).encode("utf-8"))
+        snapshot = json.loads(socket.recv())
+        return None if snapshot.get("status") == "error" else snapshot
+    except zmq.ZMQError:
+        return None
+    finally:
+        socket.close()
 
-        estado['salones_disponibles'] = max(disponibles['salones'], 0)
-        estado['laboratorios_disponibles'] = max(disponibles['laboratorios'], 0)
+# Función: _aplicar_snapshot
+# Parámetros:
+#   - snapshot (dict): Respuesta de `snapshot_replica`.
+#
+# Funcionalidad:
+# Reemplaza el estado en memoria del respaldo por el del primario (también los ids de lote ya aplicados) y
+# marca todos los semestres como pendientes, para que el `compactador` escriba enseguida el snapshot local y
+# los archivos de resumen.
+def _aplicar_snapshot(snapshot):
+    with lock:
+        estado_asignaciones.clear()
+        estado_asignaciones.update(snapshot["estado_asignaciones"])
+        disponibilidad_por_semestre.clear()
+        disponibilidad_por_semestre.update(snapshot["disponibilidad_por_semestre"])
+        resultados_asignacion.clear()
+        resultados_asignacion.update(snapshot["resultados_asignacion"])
+        semestres_pendientes.update(disponibilidad_por_semestre)
+        replica["epoca"] = snapshot["epoca"]
+        replica["seq"] = snapshot["seq"]
+        replica["propios"] = 0
+    for solicitud in snapshot.get("solicitudes", []):
+        _aplicadas.guardar(solicitud)
+
+# Función: seguir_primario
+# Parámetros: Ninguno
+#
+# Funcionalidad:
+# Hilo del respaldo que mantiene su estado igual al del primario (espera activa, "warm standby"). Se
+# suscribe a DTI_REPLICA antes de pedir el snapshot, así ningún lote posterior se pierde: los que ya
+# estaban en el snapshot (secuencia menor o igual) se descartan y el resto se aplica con `_reaplicar`, se
+# anexa al diario local y se mide su retraso (ahora − instante de publicación). Si falta una secuencia o
+# cambia la época (el primario reinició) vuelve a pedir el snapshot, salvo que el respaldo ya haya
+# asignado lotes propios: esos no existen en el primario, así que deja de seguirlo y lo avisa en lugar de
+# descartarlos. Tras `promover` también deja de seguirlo. Un lote cuyo id el respaldo ya aplicó (la facultad
+# se lo reenvió antes de que llegara por la réplica) no se vuelve a aplicar.
+#
+# Uso de recursos:
+# - Un socket SUB propio de este hilo; toma el `lock` una vez por lote replicado.
+# - Con METRICAS_DIR anexa el retraso de cada lote a `replicacion-{pid}.rep` (lo lee bench_e2e.py).
+def seguir_primario():
+    historial_listo.wait()
+    context = zmq.Context.instance()
+    sub = context.socket(zmq.SUB)
+    sub.setsockopt(zmq.SUBSCRIBE, b"rep")
+    sub.connect(DTI_REPLICA)
+    print(f"[DTI] Siguiendo al primario en {DTI_REPLICA}")
+
+    sincronizado = False
+    while True:
+        if not sincronizado:
+            snapshot = _pedir_snapshot()
+            if snapshot is None:
+                print("[DTI] El primario no entregó su estado; se reintenta")
+                time.sleep(1)
+                continue
+            _aplicar_snapshot(snapshot)
+            sincronizado = True
+            print(f"[DTI] Réplica sincronizada: época {snapshot['epoca']}, secuencia {snapshot['seq']}")
+
+        mensaje = json.loads(sub.recv_multipart()[1])
+        eventos = mensaje.get("eventos")
+        with lock:
+            if replica["divergido"] or replica["promovido"]:
+                continue
+            hueco = (mensaje["epoca"] != replica["epoca"]
+                     or mensaje["seq"] > replica["seq"] + (1 if eventos else 0))
+            if hueco and replica["propios"]:
+                replica["divergido"] = True
+                print(f"[DTI] El primario cambió o se perdieron lotes, y este respaldo ya asignó "
+                      f"{replica['propios']} lotes propios: deja de seguirlo")
+                continue
+            if hueco:
+                sincronizado = False
+                continue
+            if not eventos or mensaje["seq"] <= replica["seq"]:
+                continue
+            replica["seq"] = mensaje["seq"]
+            solicitud = eventos[0].get("id")
+            if solicitud and not _aplicadas.agregar_si_falta(solicitud):
+                continue                  # este respaldo ya lo asignó: la facultad lo reenvió aquí
+            for evento in eventos:
+                semestres_pendientes.add(evento["semestre"])
+                _reaplicar(dict(evento), contadores=True)
+            journal.registrar(eventos)
+            retraso = max(0.0, time.time() - mensaje["t"])
+            _retraso_replica.registrar(retraso)
+        metricas.registrar_latencia("replicacion", retraso, len(eventos), extension="rep")
+
+# Función: promover
+# Parámetros: Ninguno
+#
+# Funcionalidad:
+# La llama el HealthChecker al elegir este DTI como activo. Un respaldo promovido deja de aplicar el flujo
+# del primario: si el primario reaparece (p. ej. tras quedar colgado) puede terminar lotes que las facultades
+# ya abandonaron y reenviaron aquí, y aplicarlos otra vez los contaría dos veces. En el primario no hace nada.
+def promover():
+    with lock:
+        if DTI_ROL == "respaldo" and not replica["promovido"]:
+            replica["promovido"] = True
+            print(f"[DTI] Promovido a DTI activo en la secuencia {replica['seq']} "
+                  f"del primario; deja de seguirlo")
 
-    time.sleep(1)
+# Función: estado_replica
+# Parámetros: Ninguno
+#
+# Funcionalidad:
+# Rol, época, secuencia y disponibilidad actuales, más el retraso medido en el respaldo. Sirve para
+# comprobar que primario y respaldo coinciden (ver bench_e2e.py).
+def estado_replica():
+    with lock:
+        return {**replica, "rol": DTI_ROL,
+                "disponibilidad_por_semestre": {sem: dict(d) for sem, d in disponibilidad_por_semestre.items()},
+                "retraso": _retraso_replica.resumen()}
 
 # Función: guardar_resultados_global
 # Parámetros: Ninguno
@@ -139,6 +586,8 @@ def procesar_programa(programa, facultad, semestre):
 # Funcionalidad:
 # Esta función guarda los resultados de las asignaciones de recursos en archivos JSON separados por semestre.
 # Agrupa los resultados por semestre y los guarda en la carpeta de resultados, con un archivo por cada semestre.
+# Solo reescribe los semestres que cambiaron desde la última llamada; la copia se toma bajo el `lock` y la
+# escritura se hace fuera de él.
 #
 # Uso de recursos:
 # - Utiliza el módulo `json` para guardar los resultados de las asignaciones en archivos.
@@ -146,110 +595,278 @@ def procesar_programa(programa, facultad, semestre):
 
 def guardar_resultados_global():
     with lock:
+        pendientes = set(semestres_pendientes)
+        semestres_pendientes.clear()
         resultados_por_semestre = {}
         for clave, datos in resultados_asignacion.items():
             facultad, semestre = clave.rsplit("_", 1)
+            if semestre not in pendientes:
+                continue
             if semestre not in resultados_por_semestre:
                 resultados_por_semestre[semestre] = []
             resultados_por_semestre[semestre].extend([
                 {**r, "facultad": facultad} for r in datos
             ])
 
-        os.makedirs("resultados", exist_ok=True)
-        for semestre, datos in resultados_por_semestre.items():
-            with open(f"resultados/asignacion_completa_{semestre}.json", "w", encoding="utf-8") as f:
-                json.dump(datos, f, ensure_ascii=False, indent=4)
+    os.makedirs("resultados", exist_ok=True)
+    for semestre, datos in resultados_por_semestre.items():
+        _escribir_json(f"resultados/asignacion_completa_{semestre}.json", datos)
+
+# Función: compactador
+# Parámetros: Ninguno
+#
+# Funcionalidad:
+# Hilo en segundo plano que cada `DTI_COMPACTAR_S` segundos convierte lo acumulado en el diario en los
+# archivos de resumen (`asignacion_completa_{semestre}.json` y `estado_asignaciones.json`) y en el
+# snapshot de recuperación. Así la persistencia por solicitud es solo el anexado al diario y no depende
+# del tamaño de la historia, y al reiniciar solo hay que reaplicar la cola posterior al snapshot.
+#
+# Uso de recursos:
+# - Se ejecuta como hilo daemon; solo escribe si hubo cambios.
+def compactador():
+    historial_listo.wait()      # no escribir resúmenes con el historial a medio cargar
+    while True:
+        time.sleep(DTI_COMPACTAR_S)
+        with lock:
+            hay_cambios = bool(semestres_pendientes)
+        if hay_cambios:
+            guardar_snapshot()
+            guardar_resultados_global()
+            guardar_estado_asignaciones()
+
+# Función: atender_solicitud
+# Parámetros:
+#   - mensaje (dict): Solicitud ya decodificada (ping, consulta de réplica o facultad/semestre/programas
+#     con un "id" opcional).
+#
+# Funcionalidad:
+# Procesa una solicitud completa: asigna todos sus programas con `procesar_lote`, espera (si
+# DTI_JOURNAL_ESPERA) a que sus eventos estén en el diario y devuelve el diccionario de respuesta.
+# Un id repetido cuya respuesta sigue en `_respuestas` se contesta desde ahí, sin `lock` ni diario.
+# Tras un reinicio no espera al historial: mientras se carga, la respuesta trae los resultados ya cargados,
+# con los del lote siempre al final.
+# La usan tanto el modo REP como el modo ROUTER.
+#
+# Uso de recursos:
+# - Utiliza un `lock` para proteger el acceso a los datos compartidos entre los hilos.
+# - Los archivos por semestre los regenera el `compactador`, no cada solicitud.
+def atender_solicitud(mensaje):
+    if "ping" in mensaje:
+        return {"pong": True}
+    if "replica" in mensaje:
+        if mensaje["replica"] == "snapshot":
+            return snapshot_replica()
+        if mensaje["replica"] == "promover":
+            promover()
+        return estado_replica()
+
+    solicitud = mensaje.get("id")
+    if solicitud:
+        respuesta = _respuestas.obtener(solicitud)
+        if respuesta is not None:
+            print(f"[DTI] Solicitud {solicitud} repetida: se responde desde la caché")
+            return respuesta
+
+    programas = mensaje["programas"]
+    facultad = mensaje["facultad"]
+    semestre = mensaje["semestre"]
+
+    print(f"[DTI] Solicitud recibida para {facultad} - {semestre}:")
+    for programa in programas:
+        print(f"  - Programa: {programa['nombre']}, Salones: {programa['salones']}, Labs: {programa['laboratorios']}")
+
+    seq, del_lote = procesar_lote(programas, facultad, semestre, solicitud)
+
+    clave = f"{facultad}_{semestre}"
+    with lock:
+        # los resultados de este lote van al final (ver lotes.resultados_del_lote), aunque otro lote de la
+        # misma facultad y semestre se haya asignado después; de un repetido sin resultados, ninguno
+        if del_lote is None:
+            historial = []
+        else:
+            propios = {id(r) for r in del_lote}
+            historial = [r for r in resultados_asignacion.get(clave, []) if id(r) not in propios] + del_lote
+        resultados_programas = [
+            {
+                "programa": r["programa"],
+                "salones_solicitados": r["salones_solicitados"],
+                "laboratorios_solicitados": r["laboratorios_solicitados"],
+                "salones_asignados": r["salones_asignados"],
+                "laboratorios_asignados": r["laboratorios_asignados"],
+                "salones_como_laboratorios": r.get("salones_como_laboratorios", 0)
+            }
+            for r in historial
+        ]
+        estado = {
+            "salones_disponibles": disponibilidad_por_semestre[semestre]["salones"],
+            "laboratorios_disponibles": disponibilidad_por_semestre[semestre]["laboratorios"]
+        }
+
+    if DTI_JOURNAL_ESPERA and not journal.esperar(seq):
+        raise RuntimeError("el diario no confirmó la escritura a tiempo")
+
+    respuesta = {"resultado": resultados_programas, "estado": estado}
+    if solicitud:
+        _respuestas.guardar(solicitud, respuesta)
+    return respuesta
+
+# Función: atender_bytes
+# Parámetros:
+#   - datos (bytes): Solicitud tal como llegó, en JSON o en el formato compacto de `formato.py`.
+#
+# Funcionalidad:
+# Decodifica la solicitud, la atiende con `atender_solicitud` y codifica la respuesta en el mismo formato en
+# que llegó. Si la versión del formato no se conoce contesta un error JSON marcado "no_soportado", con el que
+# el cliente reintenta en JSON. Cualquier otro error (p. ej. un mensaje sin "programas") se contesta también
+# con un error JSON, para que el bucle REP siga atendiendo.
+#
+# Uso de recursos:
+# - Solo CPU; los errores siempre se devuelven en JSON.
+def atender_bytes(datos):
+    try:
+        return formato.responder(datos, atender_solicitud(formato.decodificar(datos)))
+    except formato.FormatoNoSoportado as e:
+        return formato.error(str(e), no_soportado=True)
+    except Exception as e:
+        print(f"[DTI] Error procesando solicitud: {e}")
+        return formato.error(str(e))
 
 # Función: manejar_dti
 # Parámetros: Ninguno
 #
 # Funcionalidad:
-# Esta función maneja las solicitudes entrantes del servidor DTI. Escucha las solicitudes y las procesa de manera
-# concurrente, creando un hilo por cada programa y manejando la asignación de recursos. Después de procesar la
-# solicitud, guarda los resultados y responde al cliente con los resultados completos de la asignación de recursos.
+# Esta función maneja las solicitudes entrantes del servidor DTI con un socket REP: cada solicitud se
+# procesa por completo con `atender_solicitud` antes de leer la siguiente.
 #
 # Uso de recursos:
 # - Utiliza ZeroMQ para escuchar solicitudes de los clientes y enviar respuestas.
-# - Crea un hilo por cada programa que necesita procesar la asignación de recursos.
-# - Utiliza un `lock` para proteger el acceso a los datos compartidos entre los hilos.
 def manejar_dti():
     context = zmq.Context()
     socket = context.socket(zmq.REP)
-    socket.bind("tcp://10.43.103.197:5556")
+    socket.bind(DTI_BIND)
 
-    print("[DTI] Servidor DTI iniciado, escuchando en el puerto 5556...")
+    print(f"[DTI] Servidor DTI iniciado, escuchando en {DTI_BIND}...")
 
     try:
         while True:
-            mensaje = socket.recv_json()
+            socket.send(atender_bytes(socket.recv()))
 
-            if "ping" in mensaje:
-                socket.send_json({"pong": True})
-                continue
+    except Exception as e:             # del socket: los de cada solicitud ya se contestaron
+        print(f"[DTI] Error general en el servidor: {e}")
 
-            programas = mensaje["programas"]
-            facultad = mensaje["facultad"]
-            semestre = mensaje["semestre"]
-
-            print(f"[DTI] Solicitud recibida para {facultad} - {semestre}:")
-            for programa in programas:
-                print(f"  - Programa: {programa['nombre']}, Salones: {programa['salones']}, Labs: {programa['laboratorios']}")
-
-            hilos = []
-            for programa in programas:
-                hilo = threading.Thread(target=procesar_programa, args=(programa, facultad, semestre))
-                hilo.start()
-                hilos.append(hilo)
-
-            for hilo in hilos:
-                hilo.join()
-
-            clave = f"{facultad}_{semestre}"
-            resultados_programas = [
-                {
-                    "programa": r["programa"],
-                    "salones_solicitados": r["salones_solicitados"],
-                    "laboratorios_solicitados": r["laboratorios_solicitados"],
-                    "salones_asignados": r["salones_asignados"],
-                    "laboratorios_asignados": r["laboratorios_asignados"],
-                    "salones_como_laboratorios": r.get("salones_como_laboratorios", 0)
-                }
-                for r in resultados_asignacion.get(clave, [])
-            ]
+    finally:
+        socket.close()
+        context.term()
 
-            guardar_resultados_global()
-            guardar_estado_asignaciones()
+# Función: manejar_dti_router
+# Parámetros:
+#   - hilos (int): Número máximo de solicitudes que se procesan a la vez.
+#
+# Funcionalidad:
+# Servidor concurrente con un socket ROUTER: cada solicitud recibida se entrega a un pool de hilos y el
+# bucle principal sigue leyendo. Cuando una solicitud termina, su respuesta vuelve al hilo principal por
+# `inproc://` y se envía al cliente correcto usando su identidad, sin importar el orden de llegada.
+# Un mensaje que no se puede decodificar o no es una solicitud válida se contesta con un error y el bucle
+# sigue. Con DTI_EN_VUELO solicitudes sin responder se deja de leer el socket hasta que alguna termine: las
+# siguientes esperan en la cola de ZeroMQ en lugar de acumularse en el pool.
+#
+# Uso de recursos:
+# - Un socket ROUTER (clientes) y un PULL inproc (respuestas), atendidos con un `zmq.Poller`.
+# - Un `ThreadPoolExecutor` con `hilos` hilos; cada hilo usa su propio socket PUSH inproc,
+#   ya que los sockets de ZeroMQ no se comparten entre hilos.
+def manejar_dti_router(hilos=DTI_HILOS):
+    context = zmq.Context()
+    socket = context.socket(zmq.ROUTER)
+    socket.bind(DTI_BIND)
+
+    respuestas = context.socket(zmq.PULL)
+    respuestas.bind("inproc://dti-respuestas")
+
+    local = threading.local()
+
+    def responder(envoltura, respuesta):
+        if not hasattr(local, "push"):
+            local.push = context.socket(zmq.PUSH)
+            local.push.setsockopt(zmq.LINGER, 0)
+            local.push.connect("inproc://dti-respuestas")
+        local.push.send_multipart(envoltura + [respuesta])
+
+    def tarea(envoltura, cuerpo, mensaje):
+        try:
+            respuesta = formato.responder(cuerpo, atender_solicitud(mensaje))
+        except Exception as e:
+            print(f"[DTI] Error procesando solicitud: {e}")
+            respuesta = formato.error(str(e))
+        responder(envoltura, respuesta)
+
+    pool = ThreadPoolExecutor(max_workers=hilos)
+    poller = zmq.Poller()
+    poller.register(socket, zmq.POLLIN)
+    poller.register(respuestas, zmq.POLLIN)
 
-            socket.send_json({
-                "resultado": resultados_programas,
-                "estado": {
-                    "salones_disponibles": disponibilidad_por_semestre[semestre]["salones"],
-                    "laboratorios_disponibles": disponibilidad_por_semestre[semestre]["laboratorios"]
-                }
-            })
+    print(f"[DTI] Servidor DTI (ROUTER, {hilos} hilos) escuchando en {DTI_BIND}...")
+
+    en_vuelo = 0                # solo lo toca este hilo
+    try:
+        while True:
+            poller.register(socket, zmq.POLLIN if en_vuelo < DTI_EN_VUELO else 0)
+            eventos = dict(poller.poll())
+
+            if socket in eventos:
+                frames = socket.recv_multipart()
+                envoltura, cuerpo = frames[:-1], frames[-1]   # [identidad, b""] + json o compacto
+                try:
+                    mensaje = formato.decodificar(cuerpo)
+                    if not isinstance(mensaje, dict):
+                        raise ValueError("la solicitud no es un objeto")
+                except formato.FormatoNoSoportado as e:
+                    socket.send_multipart(envoltura + [formato.error(str(e), no_soportado=True)])
+                    continue
+                except Exception as e:         # p. ej. un marco compacto truncado (struct.error)
+                    socket.send_multipart(envoltura + [formato.error(str(e))])
+                    continue
+
+                if "ping" in mensaje:          # el health-check no espera turno
+                    socket.send_multipart(envoltura + [b'{"pong": true}'])
+                else:
+                    pool.submit(tarea, envoltura, cuerpo, mensaje)
+                    en_vuelo += 1
+
+            if respuestas in eventos:
+                socket.send_multipart(respuestas.recv_multipart())
+                en_vuelo -= 1
 
     except Exception as e:
         print(f"[DTI] Error general en el servidor: {e}")
-        socket.send_json({"status": "error", "mensaje": str(e)})
 
     finally:
-        socket.close()
-        context.term()
+        pool.shutdown(wait=False)
+        context.destroy(linger=0)
 
 # Función: iniciar_dti
 # Parámetros: Ninguno
 #
 # Funcionalidad:
 # Esta función inicializa el servidor DTI, cargando el estado de las asignaciones y luego lanzando el servidor 
-# en un hilo separado para que pueda escuchar solicitudes concurrentes.
+# en un hilo separado para que pueda escuchar solicitudes concurrentes. Con DTI_MODO=router se usa el
+# servidor ROUTER concurrente en lugar del bucle REP.
 #
 # Uso de recursos:
 # - Llama a `cargar_estado_asignaciones` para inicializar el estado de las asignaciones.
-# - Lanza el servidor DTI en un hilo separado usando `threading.Thread`.
+# - Lanza el `compactador`, la replicación (`publicar_replica` en el primario, `seguir_primario` en el
+#   respaldo) y el servidor DTI en hilos separados usando `threading.Thread`.
 def iniciar_dti():
     cargar_estado_asignaciones()
-    dti_thread = threading.Thread(target=manejar_dti)
+    threading.Thread(target=compactador, daemon=True).start()
+    if DTI_REPLICACION:
+        replicacion = publicar_replica if DTI_ROL == "primario" else seguir_primario
+        threading.Thread(target=replicacion, daemon=True).start()
+    objetivo = manejar_dti_router if DTI_MODO == "router" else manejar_dti
+    dti_thread = threading.Thread(target=objetivo)
     dti_thread.start()
+    # Mantener vivo el hilo principal: si termina, el intérprete entra en
+    # apagado y el ThreadPoolExecutor del modo ROUTER deja de aceptar tareas.
+    dti_thread.join()
 
 if __name__ == "__main__":
     iniciar_dti()
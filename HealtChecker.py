@@ -1,23 +1,154 @@
+#!/usr/bin/env python3
+"""
+Vigila al DTI primario y al respaldo (v1) y publica cuál está activo.
+
+Cada HEALTH_DTI_INTERVALO_MS se envía un ping a los dos DTI a la vez; un
+ping sin respuesta en HEALTH_DTI_TIMEOUT_MS cuenta como fallo y su socket
+REQ se cierra y se crea otro (patrón "lazy pirate": un REQ sin respuesta
+no puede volver a enviar). Tras HEALTH_DTI_FALLOS fallos seguidos del
+activo, si el otro contesta, se lo promueve: en cada latido se le envía
+{"replica": "promover"} (deja de seguir al primario; la respuesta es su
+estado de réplica) hasta que ese estado diga "promovido", y solo entonces
+se lo anuncia como activo. Así nunca se anuncia un respaldo que sigue
+aplicando el flujo del primario. No se vuelve atrás aunque el anterior
+reaparezca, porque ya no tiene las asignaciones nuevas.
+
+   • REP        recibe "activo" → responde el endpoint del DTI activo
+   • PUB        [b"dti", {"activo", "version", "conmutacion_ms"}] en cada
+                cambio y, como recordatorio, en cada latido
+
+El tiempo de conmutación (última respuesta del activo anterior → anuncio
+del nuevo) se imprime y, con METRICAS_DIR, se anexa a failover-{pid}.fo.
+"""
+
+import json, os, threading, time
 import zmq
-import time
+import config
+import metricas
+
+DTI = [config.endpoint("DTI_PRIMARIO"), config.endpoint("DTI_RESPALDO")]
+
+HEALTH_DTI_INTERVALO_MS = int(os.environ.get("HEALTH_DTI_INTERVALO_MS", "200"))
+HEALTH_DTI_TIMEOUT_MS   = int(os.environ.get("HEALTH_DTI_TIMEOUT_MS", "250"))
+# Fallos seguidos del activo antes de promover al otro
+HEALTH_DTI_FALLOS       = int(os.environ.get("HEALTH_DTI_FALLOS", "3"))
+
+HEALTH_DTI_BIND     = config.endpoint("HEALTH_DTI", bind=True)
+HEALTH_DTI_PUB_BIND = config.endpoint("HEALTH_DTI_PUB", bind=True)
+
+_PING     = json.dumps({"ping": True}).encode("utf-8")
+_PROMOVER = json.dumps({"replica": "promover"}).encode("utf-8")
+
+# --- estado en caché ---------------------------------------------------------
+# (endpoint activo, version, ms de la última conmutación); se reemplaza la tupla entera
+activo = (DTI[0], 0, None)
+
+
+class Sonda:
+    """REQ hacia un DTI que se recrea tras cada mensaje sin respuesta (lazy pirate)."""
+    def __init__(self, ctx, endpoint, mensaje=_PING):
+        self.ctx      = ctx
+        self.endpoint = endpoint
+        self.mensaje  = mensaje
+        self.sock     = None
+        self.fallos   = 0
+        self.ultimo_ok = None       # nunca ha contestado: no se lo da por caído al arrancar
+
+    def enviar(self):
+        if self.sock is None:
+            self.sock = self.ctx.socket(zmq.REQ)
+            self.sock.setsockopt(zmq.LINGER, 0)
+            self.sock.connect(self.endpoint)
+        self.sock.send(self.mensaje)
+
+    def recibir(self) -> bytes:
+        datos = self.sock.recv()
+        self.fallos = 0
+        self.ultimo_ok = time.monotonic()
+        return datos
+
+    def fallo(self):
+        self.fallos += 1
+        self.cerrar()
+
+    def cerrar(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+def _promovido(datos: bytes) -> bool:
+    """¿La respuesta a «promover» (DTI.estado_replica) confirma que ya no sigue al primario?"""
+    try:
+        estado = json.loads(datos)
+    except ValueError:
+        return False
+    # el primario no sigue a nadie: para él «promover» no cambia nada
+    return bool(estado.get("promovido")) or estado.get("rol") == "primario"
+
+def heartbeat(ctx, pub, intervalo_ms: int = HEALTH_DTI_INTERVALO_MS,
+              timeout_ms: int = HEALTH_DTI_TIMEOUT_MS, fallos: int = HEALTH_DTI_FALLOS):
+    """Sondea los dos DTI, promueve al otro si el activo cae, actualiza `activo` y lo publica."""
+    global activo
+    sondas = {ep: Sonda(ctx, ep) for ep in DTI}
+    promocion = None        # Sonda con «promover» hacia el candidato, hasta que confirme
+    caido_desde = None      # última respuesta del activo que se está reemplazando
+    while True:
+        inicio = time.monotonic()
+        poller = zmq.Poller()
+        enviadas = list(sondas.values()) + ([promocion] if promocion else [])
+        for sonda in enviadas:
+            sonda.enviar()
+            poller.register(sonda.sock, zmq.POLLIN)
+
+        esperando = {s.sock: s for s in enviadas}
+        respuestas = {}
+        limite = inicio + timeout_ms / 1000
+        while esperando and time.monotonic() < limite:
+            for sock, _ in poller.poll(max(0, int((limite - time.monotonic()) * 1000))):
+                sonda = esperando.pop(sock)
+                respuestas[sonda] = sonda.recibir()
+        for sonda in esperando.values():
+            sonda.fallo()
+
+        actual, version, conmutacion = activo
+        otro = next(ep for ep in DTI if ep != actual)
+        if promocion is None:
+            if (sondas[actual].ultimo_ok is not None and sondas[actual].fallos >= fallos
+                    and sondas[otro].ultimo_ok is not None and sondas[otro].fallos == 0):
+                print(f"[HealthChecker] {actual} no responde: se promueve {otro}", flush=True)
+                promocion = Sonda(ctx, otro, _PROMOVER)
+                caido_desde = sondas[actual].ultimo_ok
+        elif promocion in respuestas and _promovido(respuestas[promocion]):
+            # confirmado: recién ahora se anuncia (una promoción sin confirmar se reenvía en el próximo latido)
+            conmutacion = (time.monotonic() - caido_desde) * 1000
+            activo = (promocion.endpoint, version + 1, conmutacion)
+            print(f"[HealthChecker] DTI activo → {promocion.endpoint} "
+                  f"(versión {version + 1}, conmutación en {conmutacion:.0f} ms)", flush=True)
+            metricas.registrar_latencia("failover", conmutacion / 1000, extension="fo")
+            promocion.cerrar()
+            promocion = None
+        pub.send_multipart([b"dti", json.dumps(
+            {"activo": activo[0], "version": activo[1], "conmutacion_ms": activo[2]}).encode("utf-8")])
+
+        time.sleep(max(0.0, intervalo_ms / 1000 - (time.monotonic() - inicio)))
 
-def health_check():
-    context = zmq.Context()
-    socket = context.socket(zmq.REQ)
-    socket.connect("tcp://10.43.103.197:5556") 
+# --- bucle REP ---------------------------------------------------------------
+def health_check(bind: str = None, pub_bind: str = None):
+    bind     = bind or HEALTH_DTI_BIND
+    pub_bind = pub_bind or HEALTH_DTI_PUB_BIND
+    ctx  = zmq.Context()
+    rep  = ctx.socket(zmq.REP)
+    rep.bind(bind)
+    pub  = ctx.socket(zmq.PUB)
+    pub.bind(pub_bind)
+    threading.Thread(target=heartbeat, args=(ctx, pub), daemon=True).start()
+    print(f"[HealthChecker] Vigilando {DTI[0]} y {DTI[1]}; atiende en {bind}, "
+          f"publica en {pub_bind}", flush=True)
 
     while True:
-        try:
-            socket.send_json({"ping": True})
-            mensaje = socket.recv_json()
-            if mensaje.get("pong") == True:
-                print("[HealthChecker] Servidor DTI está vivo")
-            else:
-                print("[HealthChecker] Respuesta inesperada:", mensaje)
-        except Exception as e:
-            print("[HealthChecker] Error conectando al servidor:", e)
-
-        time.sleep(5)  # cada 5 segundos
+        rep.recv()                        # «activo»
+        rep.send_string(activo[0])        # estado en caché: sin ping por consulta
 
 if __name__ == "__main__":
-    health_check()
\ No newline at end of file
+    health_check()
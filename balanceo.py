@@ -0,0 +1,239 @@
+"""
+Broker ROUTER-ROUTER con balanceo LRU (el worker libre que más lleva
+esperando recibe la siguiente solicitud) y control de admisión.
+
+Con BROKER_MODO=lru el backend del broker es un ROUTER y cada worker
+(dti_worker, un socket REQ por broker) se anuncia con READY; su respuesta
+a una solicitud lo vuelve a marcar libre. Las solicitudes que llegan sin
+workers libres esperan en una cola del broker cuya profundidad se ve en
+el socket de estadísticas (telemetria.py). Con BROKER_MODO=proxy (por
+defecto) se mantiene el DEALER con reparto round-robin.
+
+Admisión: con BROKER_MAX_EN_VUELO y/o BROKER_MAX_POR_CLIENTE (> 0) el
+broker cuenta las solicitudes admitidas y aún sin respuesta (en cola o en
+un worker) y, pasado el límite, contesta de inmediato
+{"status": "ocupado", "reintentar_ms": …} en lugar de encolar. El cliente
+es la parte de la identidad anterior a "#" (facultades_broker usa
+"<facultad>#<id>"), así todas las solicitudes de una facultad suman juntas.
+
+Caídas y reinicios (LRU): un worker libre repite READY cada LATIDO_S como
+latido, y el broker olvida a los libres que pasan LATIDOS_PERDIDOS latidos
+sin dar señales; así, si el broker reinicia, el worker se vuelve a anunciar
+solo. El backend usa ROUTER_MANDATORY: si una solicitud va a un worker que
+ya se desconectó, el envío falla, el worker se olvida y la solicitud vuelve
+al frente de la cola en lugar de perderse.
+
+Mensajes:
+  worker → broker   [worker, b"", READY]            al conectar y, libre, cada LATIDO_S
+  broker → worker   [worker, b"", cliente, b"", solicitud]
+  worker → broker   [worker, b"", cliente, b"", respuesta]
+"""
+
+import collections, json, os, struct, time
+import zmq
+
+MODO  = os.environ.get("BROKER_MODO", "proxy")     # proxy | lru
+READY = b"READY"
+
+MAX_EN_VUELO    = int(os.environ.get("BROKER_MAX_EN_VUELO", "0"))      # 0 = sin límite
+MAX_POR_CLIENTE = int(os.environ.get("BROKER_MAX_POR_CLIENTE", "0"))   # 0 = sin límite
+REINTENTAR_MS   = int(os.environ.get("BROKER_REINTENTAR_MS", "100"))   # sugerencia al rechazar
+# Una solicitud admitida sin respuesta pasado este tiempo deja de contar (worker caído)
+EXPIRA_S        = float(os.environ.get("BROKER_EXPIRA_S", "60"))
+# Latido de los workers LRU libres; tras LATIDOS_PERDIDOS sin señales el broker los olvida
+LATIDO_S         = float(os.environ.get("BROKER_LATIDO_S", "1"))
+LATIDOS_PERDIDOS = 3
+
+def cliente_de(identidad: bytes) -> bytes:
+    return identidad.split(b"#", 1)[0]
+
+def crear(front, back, captura=None, control=None):
+    """Balanceador según BROKER_MODO y los límites; None si basta con zmq.proxy_steerable."""
+    if MODO == "lru":
+        return BalanceadorLRU(front, back, captura, control)
+    if MAX_EN_VUELO or MAX_POR_CLIENTE:
+        return ProxyConAdmision(front, back, captura, control)
+    return None
+
+
+class BalanceadorLRU:
+    def __init__(self, front, back, captura=None, control=None,
+                 max_en_vuelo=MAX_EN_VUELO, max_por_cliente=MAX_POR_CLIENTE):
+        self.front   = front
+        self.back    = back
+        self.captura = captura
+        self.control = control
+        self.libres  = collections.deque()   # identidades de workers libres, en orden LRU
+        self.cola    = collections.deque()   # solicitudes [cliente, b"", cuerpo] en espera
+        self.workers = set()
+        self.ocupados = set()                # workers con una solicitud sin responder
+        self.vistos  = {}                    # worker → última señal (READY o respuesta)
+        if back.type == zmq.ROUTER:
+            back.setsockopt(zmq.ROUTER_MANDATORY, 1)   # un worker que ya no está → error, no descarte
+        self.cola_max = 0
+        # mismo orden que STATISTICS de zmq_proxy_steerable
+        self.contadores = [0] * 8
+
+        self.max_en_vuelo    = max_en_vuelo
+        self.max_por_cliente = max_por_cliente
+        self.en_vuelo    = {}                      # identidad → (cliente, t de admisión)
+        self.por_cliente = collections.Counter()
+        self.rechazos    = 0
+        self._ocupado    = json.dumps({"status": "ocupado",
+                                       "reintentar_ms": REINTENTAR_MS}).encode("utf-8")
+
+    def _contar(self, frames, i):
+        self.contadores[i]     += len(frames)
+        self.contadores[i + 1] += sum(len(f) for f in frames)
+
+    def estado(self) -> dict:
+        """Profundidad de cola, workers y admisión (lo consulta la telemetría desde otro hilo)."""
+        return {
+            "cola": len(self.cola),
+            "cola_max": self.cola_max,
+            "workers": len(self.workers),
+            "workers_ocupados": len(self.ocupados),
+            "workers_libres": len(self.libres),
+            "en_vuelo": len(self.en_vuelo),
+            "max_en_vuelo": self.max_en_vuelo,
+            "max_por_cliente": self.max_por_cliente,
+            "rechazos": self.rechazos,
+        }
+
+    # ------------------------- admisión --------------------------- #
+    def _admitir(self, identidad) -> bool:
+        cliente = cliente_de(identidad)
+        if self.max_en_vuelo and len(self.en_vuelo) >= self.max_en_vuelo:
+            return False
+        if self.max_por_cliente and self.por_cliente[cliente] >= self.max_por_cliente:
+            return False
+        self.en_vuelo[identidad] = (cliente, time.monotonic())
+        self.por_cliente[cliente] += 1
+        return True
+
+    def _liberar(self, identidad):
+        entrada = self.en_vuelo.pop(identidad, None)
+        if entrada is not None:
+            cliente = entrada[0]
+            self.por_cliente[cliente] -= 1
+            if self.por_cliente[cliente] <= 0:
+                del self.por_cliente[cliente]
+
+    def _expirar(self):
+        ahora = time.monotonic()
+        limite = ahora - EXPIRA_S
+        for identidad, (_, t) in list(self.en_vuelo.items()):
+            if t < limite:
+                self._liberar(identidad)
+        # un libre sin latidos se cayó; uno ocupado puede tardar, pero no más que EXPIRA_S
+        for worker, t in list(self.vistos.items()):
+            plazo = EXPIRA_S if worker in self.ocupados else LATIDOS_PERDIDOS * LATIDO_S
+            if t < ahora - plazo:
+                self._olvidar(worker)
+
+    def _rechazar(self, frames):
+        self.rechazos += 1
+        respuesta = [frames[0], b"", self._ocupado]
+        self.front.send_multipart(respuesta)
+        self._contar(respuesta, 2)
+
+    def _responder(self, respuesta):
+        """[cliente, b"", respuesta] de un worker hacia el frontend."""
+        self.front.send_multipart(respuesta)
+        self._contar(respuesta, 2)
+        self._liberar(respuesta[0])
+        if self.captura is not None:
+            self.captura.send_multipart(respuesta)
+
+    # -------------------------- ruteo ----------------------------- #
+    def _de_back(self, frames):
+        worker = frames[0]
+        self.workers.add(worker)
+        self.vistos[worker] = time.monotonic()
+        if frames[2:] != [READY]:
+            self._responder(frames[2:])
+            self.ocupados.discard(worker)
+        elif worker in self.ocupados or worker in self.libres:
+            return                                    # latido: ya se lo tiene en cuenta
+        self.libres.append(worker)
+
+    def _olvidar(self, worker):
+        self.workers.discard(worker)
+        self.ocupados.discard(worker)
+        self.vistos.pop(worker, None)
+        if worker in self.libres:
+            self.libres.remove(worker)
+
+    def _despachar(self):
+        while self.libres and self.cola:
+            worker = self.libres.popleft()
+            mensaje = [worker, b""] + self.cola[0]
+            try:
+                self.back.send_multipart(mensaje)
+            except zmq.error.ZMQError as e:
+                if e.errno != zmq.EHOSTUNREACH:
+                    raise
+                self._olvidar(worker)                 # se desconectó: la solicitud sigue en la cola
+                continue
+            self.cola.popleft()
+            self.ocupados.add(worker)
+            self._contar(mensaje, 6)
+
+    def _eventos_back(self):
+        """Qué esperar del backend en el próximo poll (el LRU despacha al llegar READY o respuestas)."""
+        return zmq.POLLIN
+
+    def correr(self):
+        poller = zmq.Poller()
+        poller.register(self.front, zmq.POLLIN)
+        if self.control is not None:
+            poller.register(self.control, zmq.POLLIN)
+        proxima_expiracion = time.monotonic() + 1
+
+        while True:
+            poller.register(self.back, self._eventos_back())
+            eventos = dict(poller.poll(1000))
+
+            if eventos.get(self.back, 0) & zmq.POLLIN:
+                frames = self.back.recv_multipart()
+                self._contar(frames, 4)
+                self._de_back(frames)
+
+            if self.front in eventos:
+                frames = self.front.recv_multipart()
+                self._contar(frames, 0)
+                if self.captura is not None:
+                    self.captura.send_multipart(frames)
+                if self._admitir(frames[0]):
+                    self.cola.append(frames)
+                    self.cola_max = max(self.cola_max, len(self.cola))
+                else:
+                    self._rechazar(frames)
+
+            self._despachar()
+
+            if self.control is not None and self.control in eventos:
+                self.control.recv()                   # STATISTICS
+                self.control.send_multipart([struct.pack("=Q", v) for v in self.contadores])
+
+            if time.monotonic() >= proxima_expiracion:
+                self._expirar()
+                proxima_expiracion = time.monotonic() + 1
+
+
+class ProxyConAdmision(BalanceadorLRU):
+    """Reparto round-robin del DEALER de siempre, pero con los límites de admisión."""
+
+    def _de_back(self, frames):
+        self._responder(frames)                       # [cliente, b"", respuesta]
+
+    def _despachar(self):
+        # sin workers conectados (o con su HWM lleno) el DEALER bloquearía: queda en la cola
+        while self.cola and self.back.getsockopt(zmq.EVENTS) & zmq.POLLOUT:
+            mensaje = self.cola.popleft()
+            self.back.send_multipart(mensaje)
+            self._contar(mensaje, 6)
+
+    def _eventos_back(self):
+        # con cola, despertar en cuanto el DEALER vuelva a aceptar envíos
+        return zmq.POLLIN | zmq.POLLOUT if self.cola else zmq.POLLIN
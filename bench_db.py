@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Compara los backends de asignación de db.py bajo contención.
+Lanza N procesos que asignan lotes sobre el mismo semestre y mide
+solicitudes/s y que el saldo final sea consistente.
+Con --repetidas F cada lote lleva un id y una fracción F de las
+solicitudes reenvía el id anterior (un reintento): el saldo solo es
+consistente si esos repetidos no descuentan nada.
+
+    python bench_db.py --workers 8 --solicitudes 200 [--repetidas 0.2]
+"""
+
+import argparse, multiprocessing, os, random, time, uuid
+
+SALONES_ORIG = 380
+LABS_ORIG    = 60
+
+def _worker(backend, n, inicio, asignados, repetidas):
+    import db
+    db.BACKEND = backend
+    programas = [{"nombre": f"P{i}", "salones": 1, "laboratorios": 0}
+                 for i in range(3)]
+    rng = random.Random(os.getpid())
+    inicio.wait()
+    total, solicitud = 0, None
+    for _ in range(n):
+        if repetidas:
+            if solicitud is None or rng.random() >= repetidas:
+                solicitud = uuid.uuid4().hex
+            resultados, _, repetida = db.asignar_lote_unico(
+                solicitud, "bench", "Facultad Bench", programas, SALONES_ORIG, LABS_ORIG)
+            if repetida:
+                continue
+        else:
+            resultados, _ = db.asignar_lote("bench", "Facultad Bench", programas,
+                                            SALONES_ORIG, LABS_ORIG)
+        total += sum(r["salones_asignados"] for r in resultados)
+    with asignados.get_lock():
+        asignados.value += total
+
+def correr(backend, workers, solicitudes, repetidas=0.0):
+    import db
+    for f in (db.DB_FILE, db.DB_FILE + "-wal", db.DB_FILE + "-shm"):
+        if os.path.exists(f):
+            os.remove(f)
+    db.BACKEND = backend
+    db.inicializar_bd()
+
+    inicio    = multiprocessing.Event()
+    asignados = multiprocessing.Value("i", 0)
+    procs = [multiprocessing.Process(target=_worker,
+                                     args=(backend, solicitudes, inicio,
+                                           asignados, repetidas))
+             for _ in range(workers)]
+    for p in procs: p.start()
+    t0 = time.perf_counter()
+    inicio.set()
+    for p in procs: p.join()
+    dur = time.perf_counter() - t0
+
+    _, disp = db.asignar_lote("bench", "Facultad Bench", [],
+                              SALONES_ORIG, LABS_ORIG)
+    consistente = asignados.value + disp["salones"] == SALONES_ORIG
+
+    total = workers * solicitudes
+    print(f"[BENCH] {backend:<12} {workers} workers · {total} solicitudes "
+          f"en {dur:.2f}s → {total / dur:.0f} sol/s "
+          f"(saldo {'OK' if consistente else 'INCONSISTENTE'})")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--solicitudes", type=int, default=200)
+    ap.add_argument("--backend", choices=["filelock", "condicional", "ambos"],
+                    default="ambos")
+    ap.add_argument("--repetidas", type=float, default=0.0,
+                    help="fracción de solicitudes que repiten el id anterior")
+    args = ap.parse_args()
+
+    backends = (["filelock", "condicional"] if args.backend == "ambos"
+                else [args.backend])
+    for b in backends:
+        correr(b, args.workers, args.solicitudes, args.repetidas)
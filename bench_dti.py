@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Compara el núcleo por lotes de DTI (procesar_lote) contra el camino
+original de un hilo por programa (procesar_programa + join).
+
+    python bench_dti.py --solicitudes 2000 --programas 5 --retardo 0
+"""
+
+import argparse, contextlib, io, threading, time
+import DTI
+
+def _reiniciar():
+    DTI.estado_asignaciones.clear()
+    DTI.disponibilidad_por_semestre.clear()
+    DTI.resultados_asignacion.clear()
+
+def _hilo_por_programa(programas, facultad, semestre):
+    hilos = [threading.Thread(target=DTI.procesar_programa,
+                              args=(p, facultad, semestre))
+             for p in programas]
+    for h in hilos: h.start()
+    for h in hilos: h.join()
+
+def medir(nombre, funcion, solicitudes, programas):
+    _reiniciar()
+    lote = [{"nombre": f"P{i}", "salones": 1, "laboratorios": 1}
+            for i in range(programas)]
+    with contextlib.redirect_stdout(io.StringIO()):   # sin coste de consola
+        t0 = time.perf_counter()
+        for n in range(solicitudes):
+            funcion(lote, f"Facultad {n % 10}", "bench")
+        dur = time.perf_counter() - t0
+    print(f"[BENCH] {nombre:<18} {solicitudes} sol × {programas} prog "
+          f"en {dur:.3f}s → {solicitudes / dur:.0f} sol/s "
+          f"({dur / solicitudes * 1e6:.1f} µs/sol)")
+    return dur
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--solicitudes", type=int, default=2000)
+    ap.add_argument("--programas", type=int, default=5)
+    ap.add_argument("--retardo", type=float, default=0.0,
+                    help="DTI_RETARDO en segundos")
+    args = ap.parse_args()
+
+    DTI.DTI_RETARDO = args.retardo
+    hilos = medir("hilo-por-programa", _hilo_por_programa,
+                  args.solicitudes, args.programas)
+    lote  = medir("procesar_lote", DTI.procesar_lote,
+                  args.solicitudes, args.programas)
+    print(f"[BENCH] aceleración: {hilos / lote:.1f}×")
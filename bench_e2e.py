@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Benchmark extremo a extremo en una sola máquina.
+
+Levanta la topología elegida con lanzador.py (por tcp://127.0.0.1 o por
+ipc://, según --transporte), la alimenta con una carga fija
+generada con crearsolicitudes.generar_flujo y reporta en JSON:
+  • ingreso: latencia programas → facultad (ack) y throughput de envío
+  • extremo a extremo: latencia facultad → DTI → facultad y programas/s
+  • por componente: CPU (s y %) y RSS actual / pico, sumando sus procesos hijos
+  • en v1, replicación: retraso primario → respaldo y si ambos terminan con
+    la misma disponibilidad; y, si el HealtChecker conmutó, cuánto tardó
+
+  v1 / v2: ver lanzador.TOPOLOGIAS
+
+    python bench_e2e.py --topologia ambas --solicitudes 5000 --workers 4 --salida bench.json
+"""
+
+import argparse, asyncio, json, os, signal, sys, tempfile, threading, time
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+
+# ------------------------------------------------------------------
+_TICK = os.sysconf("SC_CLK_TCK")
+
+def _procesos():
+    """{pid: ppid} de todos los procesos visibles."""
+    padres = {}
+    for entrada in os.listdir("/proc"):
+        if entrada.isdigit():
+            try:
+                with open(f"/proc/{entrada}/stat") as f:
+                    campos = f.read().rsplit(")", 1)[1].split()
+                padres[int(entrada)] = int(campos[1])
+            except (OSError, IndexError):
+                pass
+    return padres
+
+def _uso(pid, padres):
+    """CPU (incluye hijos ya terminados) y RSS del árbol de procesos de `pid`."""
+    arbol, pendientes = [], [pid]
+    while pendientes:
+        p = pendientes.pop()
+        arbol.append(p)
+        pendientes.extend(h for h, pp in padres.items() if pp == p)
+
+    cpu, rss, pico = 0, 0, 0
+    for p in arbol:
+        try:
+            with open(f"/proc/{p}/stat") as f:
+                campos = f.read().rsplit(")", 1)[1].split()
+            cpu += sum(int(c) for c in campos[11:15])   # utime stime cutime cstime
+            with open(f"/proc/{p}/status") as f:
+                for linea in f:
+                    if linea.startswith("VmRSS:"):
+                        rss += int(linea.split()[1])
+                    elif linea.startswith("VmHWM:"):
+                        pico += int(linea.split()[1])
+        except OSError:
+            pass
+    return {"procesos": len(arbol), "cpu_s": cpu / _TICK,
+            "rss_mb": rss / 1024, "rss_pico_mb": pico / 1024}
+
+def _consultar_replica(endpoint, timeout_ms=2000):
+    """Estado de réplica de un DTI (ver DTI.estado_replica), o None si no contesta."""
+    import zmq
+    s = zmq.Context.instance().socket(zmq.REQ)
+    s.setsockopt(zmq.LINGER, 0)
+    s.setsockopt(zmq.RCVTIMEO, timeout_ms)
+    s.setsockopt(zmq.SNDTIMEO, timeout_ms)
+    try:
+        s.connect(endpoint)
+        s.send(json.dumps({"replica": "estado"}).encode("utf-8"))
+        return json.loads(s.recv())
+    except zmq.ZMQError:
+        return None
+    finally:
+        s.close()
+
+def _replicacion(directorio, espera=5.0):
+    """Espera a que el respaldo alcance al primario y compara sus disponibilidades."""
+    import config, metricas
+    limite = time.time() + espera
+    while True:
+        primario = _consultar_replica(config.endpoint("DTI_PRIMARIO"))
+        respaldo = _consultar_replica(config.endpoint("DTI_RESPALDO"))
+        al_dia = primario and respaldo and respaldo["seq"] >= primario["seq"]
+        if al_dia or time.time() > limite:
+            break
+        time.sleep(0.2)
+    histograma, _, _ = metricas.leer_latencias(directorio, extension="rep")
+    return {
+        "retraso": histograma.resumen(),
+        "seq_primario": primario and primario["seq"],
+        "seq_respaldo": respaldo and respaldo["seq"],
+        "propios_respaldo": respaldo and respaldo["propios"],
+        "consistente": bool(primario and respaldo) and (primario["disponibilidad_por_semestre"]
+                                                        == respaldo["disponibilidad_por_semestre"]),
+    }
+
+# ------------------------------------------------------------------
+def correr(nombre, args, carga):
+    import lanzador, metricas, programas
+
+    base = tempfile.mkdtemp(prefix=f"bench_{nombre}_")
+    os.makedirs(os.path.join(base, "metricas"))
+    env = {
+        "TRANSPORTE": args.transporte, "IPC_DIR": os.path.join(base, "ipc"),
+        "METRICAS_DIR": os.path.join(base, "metricas"),
+        "DTI_MODO": args.dti_modo, "DB_BACKEND": args.db_backend,
+        "WORKER_HILOS": str(args.hilos), "BROKER_MODO": args.broker_modo,
+        "WIRE_FORMATO": args.formato,
+        "FACULTAD_HEDGE": "1" if args.hedge else "0",
+        "DTI_REPLICACION": "0" if args.sin_replicacion else "1",
+        "IDEMPOTENCIA_BD": "0" if args.sin_idempotencia_bd else "1",
+    }
+    os.environ.update(env)          # programas.generar_carga usa la misma config.py
+    # --retardo-lento vuelve lento al primer worker para ver el efecto del balanceo
+    lentos = {"dti_worker_0": {"WORKER_RETARDO": str(args.retardo_lento)}} if args.retardo_lento else None
+    lanzados = lanzador.lanzar(nombre, base, args.workers, env, lentos)
+    time.sleep(args.arranque)
+
+    congelado = None
+    if args.congelar_primario is not None:
+        # el primer componente de la topología es el primario (dti en v1, broker en v2)
+        congelado = lanzados[0][1].pid
+        threading.Timer(args.congelar_primario, os.kill,
+                        (congelado, signal.SIGSTOP)).start()
+
+    t_inicio = time.time()
+    ingreso = asyncio.run(programas.generar_carga(
+        lambda: programas.leer_solicitudes(carga), tasa=args.tasa,
+        concurrencia=args.concurrencia, repeticiones=1, ventana=args.concurrencia))
+
+    # esperar a que todas las solicitudes completen el viaje hasta el DTI
+    limite = time.time() + args.espera
+    while True:
+        histograma, completados, ultimo = metricas.leer_latencias(os.path.join(base, "metricas"))
+        if completados >= ingreso["enviados"] or time.time() > limite:
+            break
+        time.sleep(0.2)
+    duracion = max((ultimo or time.time()) - t_inicio, 1e-9)
+
+    padres = _procesos()
+    componentes = {}
+    for etiqueta, p in lanzados:
+        uso = _uso(p.pid, padres)
+        uso["cpu_pct"] = 100 * uso["cpu_s"] / duracion
+        componentes[etiqueta] = uso
+
+    if congelado is not None:
+        os.kill(congelado, signal.SIGCONT)
+    replicacion = _replicacion(os.path.join(base, "metricas")) if nombre == "v1" else None
+    conmutaciones, _, _ = metricas.leer_latencias(os.path.join(base, "metricas"), extension="fo")
+    lanzador.detener(lanzados)
+
+    return {
+        "topologia": nombre,
+        "transporte": args.transporte,
+        "broker_modo": args.broker_modo,
+        "formato": args.formato,
+        "directorio": base,
+        "ingreso": ingreso,
+        "extremo_a_extremo": {
+            **histograma.resumen(),
+            "programas": completados,
+            "duracion_s": duracion,
+            "throughput_pps": completados / duracion,
+        },
+        "componentes": componentes,
+        **({"replicacion": replicacion} if replicacion else {}),
+        **({"failover": conmutaciones.resumen()} if conmutaciones.total else {}),
+    }
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--topologia", choices=["v1", "v2", "ambas"], default="ambas")
+    ap.add_argument("--transporte", choices=["local", "ipc"], default="local")
+    ap.add_argument("--solicitudes", type=int, default=5000)
+    ap.add_argument("--semestres", type=int, default=4)
+    ap.add_argument("--semilla", type=int, default=42)
+    ap.add_argument("--concurrencia", type=int, default=32)
+    ap.add_argument("--tasa", type=float, default=None, help="lazo abierto (sol/s)")
+    ap.add_argument("--workers", type=int, default=4, help="dti_worker en v2")
+    ap.add_argument("--hilos", type=int, default=1, help="WORKER_HILOS de cada dti_worker")
+    ap.add_argument("--broker-modo", default="proxy", choices=["proxy", "lru"])
+    ap.add_argument("--retardo-lento", type=float, default=0.0,
+                    help="segundos extra por solicitud en dti_worker_0 (v2)")
+    ap.add_argument("--congelar-primario", type=float, default=None,
+                    help="segundos tras el arranque para detener (SIGSTOP) el primario")
+    ap.add_argument("--hedge", action="store_true", help="FACULTAD_HEDGE=1 en v1")
+    ap.add_argument("--sin-replicacion", action="store_true",
+                    help="DTI_REPLICACION=0: el respaldo no sigue al primario (v1)")
+    ap.add_argument("--sin-idempotencia-bd", action="store_true",
+                    help="IDEMPOTENCIA_BD=0: los dti_worker no registran ids en recursos.db (v2)")
+    ap.add_argument("--formato", default="json", choices=["json", "compacto"],
+                    help="WIRE_FORMATO facultad → DTI")
+    ap.add_argument("--db-backend", default="filelock", choices=["filelock", "condicional"])
+    ap.add_argument("--dti-modo", default="router", choices=["rep", "router"])
+    ap.add_argument("--arranque", type=float, default=2.0, help="segundos de espera inicial")
+    ap.add_argument("--espera", type=float, default=60.0, help="máximo para completar")
+    ap.add_argument("--salida", default=None, help="archivo JSON (por defecto, stdout)")
+    args = ap.parse_args()
+
+    sys.path.insert(0, AQUI)
+    import crearsolicitudes
+    carga = os.path.join(tempfile.mkdtemp(prefix="bench_carga_"), "carga.jsonl")
+    crearsolicitudes.generar_flujo(carga, len(crearsolicitudes.facultades), 5, args.semestres,
+                                   args.solicitudes, semilla=args.semilla)
+
+    topologias = ["v1", "v2"] if args.topologia == "ambas" else [args.topologia]
+    reporte = {"parametros": vars(args),
+               "corridas": [correr(t, args, carga) for t in topologias]}
+
+    texto = json.dumps(reporte, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    print(texto)
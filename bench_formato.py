@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+"""
+Compara JSON con el formato compacto de formato.py para los mensajes del
+camino caliente: bytes por mensaje y µs para codificar y decodificar.
+Verifica además que cada mensaje vuelva idéntico tras el viaje.
+
+    python bench_formato.py --programas 10 200
+"""
+
+import argparse, random, time
+import formato
+
+def solicitud(n, rng):
+    return {"id": "9f1c2e4b7a3d4c8e9b0a1d2e3f4a5b6c",
+            "facultad": "Facultad de Ingeniería", "semestre": "2025-1",
+            "programas": [{"nombre": f"Programa {i} de Ingeniería",
+                           "salones": rng.randint(3, 8),
+                           "laboratorios": rng.randint(2, 4)} for i in range(n)]}
+
+def respuesta(n, rng):
+    resultados = []
+    for i in range(n):
+        r = {"programa": f"Programa {i} de Ingeniería", "facultad": "Facultad de Ingeniería",
+             "salones_solicitados": 7, "laboratorios_solicitados": 3,
+             "salones_asignados": rng.randint(0, 7), "laboratorios_asignados": rng.randint(0, 3)}
+        if i % 3 == 0:
+            r["salones_como_laboratorios"] = 3
+        resultados.append(r)
+    return {"resultado": resultados,
+            "estado": {"salones_disponibles": 120, "laboratorios_disponibles": 10}}
+
+def medir(funcion, arg, repeticiones):
+    t0 = time.perf_counter()
+    for _ in range(repeticiones):
+        funcion(arg)
+    return (time.perf_counter() - t0) / repeticiones * 1e6
+
+def correr(nombre, msg, repeticiones):
+    for f in ("json", "compacto"):
+        datos = formato.codificar(msg, f)
+        assert formato.decodificar(datos) == msg, f"{nombre}/{f}: el mensaje no vuelve igual"
+        cod = medir(lambda m: formato.codificar(m, f), msg, repeticiones)
+        dec = medir(formato.decodificar, datos, repeticiones)
+        print(f"[BENCH] {nombre:<15} {f:<9} {len(datos):7d} B  "
+              f"codificar {cod:7.1f} µs  decodificar {dec:7.1f} µs")
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--programas", type=int, nargs="+", default=[10, 200])
+    ap.add_argument("--repeticiones", type=int, default=2000)
+    args = ap.parse_args()
+
+    rng = random.Random(42)
+    for n in args.programas:
+        correr(f"solicitud({n})", solicitud(n, rng), args.repeticiones)
+        correr(f"respuesta({n})", respuesta(n, rng), args.repeticiones)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Mide cuánto tarda DTI en atender tras un reinicio con N asignaciones
+registradas: genera un diario de N eventos y un snapshot que cubre todos
+menos los últimos `--cola`, llama a cargar_estado_asignaciones() y cronometra
+hasta que la primera solicitud (con id) recibe respuesta.
+
+    python bench_recuperacion.py --eventos 1000000 --cola 5000
+"""
+
+import argparse, json, os, tempfile, time
+
+def generar(eventos, cola, semestres):
+    import DTI, journal
+    os.makedirs("resultados", exist_ok=True)
+    disp, estado = {}, {}
+    posicion = 0
+    with open(journal.JOURNAL_FILE, "wb") as f:
+        for i in range(eventos):
+            sem = f"2025-{i % semestres}"
+            ev = {"facultad": f"Facultad {i % 1000}", "programa": f"Programa {i}",
+                  "salones_solicitados": 1, "laboratorios_solicitados": 0,
+                  "salones_asignados": 0, "laboratorios_asignados": 0,
+                  "semestre": sem}
+            f.write((json.dumps(ev, ensure_ascii=False) + "\n").encode("utf-8"))
+            if i < eventos - cola:
+                d = disp.setdefault(sem, {"salones": DTI.SALONES_DISPONIBLES_ORIGINALES,
+                                          "laboratorios": DTI.LABORATORIOS_DISPONIBLES_ORIGINALES})
+                e = estado.setdefault(sem, {"salones_disponibles": d["salones"],
+                                            "laboratorios_disponibles": d["laboratorios"],
+                                            "salones_solicitados": 0,
+                                            "laboratorios_solicitados": 0})
+                e["salones_solicitados"] += 1
+                posicion = f.tell()
+    with open(DTI.SNAPSHOT_FILE, "w", encoding="utf-8") as f:
+        json.dump({"posicion": posicion, "estado_asignaciones": estado,
+                   "disponibilidad_por_semestre": disp}, f)
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--eventos", type=int, default=1_000_000)
+    ap.add_argument("--cola", type=int, default=5000,
+                    help="eventos posteriores al último snapshot")
+    ap.add_argument("--semestres", type=int, default=4)
+    ap.add_argument("--dir", default=None,
+                    help="directorio de trabajo (por defecto, uno temporal)")
+    args = ap.parse_args()
+
+    directorio = args.dir or tempfile.mkdtemp(prefix="dti_rec_")
+    os.makedirs(directorio, exist_ok=True)
+    os.chdir(directorio)
+    generar(args.eventos, args.cola, args.semestres)
+
+    import DTI
+    t0 = time.perf_counter()
+    listo_ms = DTI.cargar_estado_asignaciones()
+    DTI.atender_solicitud({"id": "bench-recuperacion", "facultad": "Facultad 0", "semestre": "2025-0",
+                           "programas": [{"nombre": "Programa bench", "salones": 1, "laboratorios": 0}]})
+    primera_ms = (time.perf_counter() - t0) * 1000
+    DTI.historial_listo.wait()
+    total = sum(len(v) for v in DTI.resultados_asignacion.values())
+    print(f"[BENCH] estado cargado: {listo_ms:.1f} ms · primera solicitud atendida: {primera_ms:.1f} ms · "
+          f"historial completo {(time.perf_counter() - t0) * 1000:.0f} ms · {total} resultados")
@@ -1,40 +1,28 @@
 #!/usr/bin/env python3
 import zmq, threading
+import balanceo
+import config
+import telemetria
 
-IP          = "10.43.96.74"
-FRONT_PORT  = 5555          # ROUTER  (clientes / facultades)
-BACK_PORT   = 5560          # DEALER  (DTI workers)
-HB_PORT     = 5570          # REP     (heartbeat)
+FRONT_EP = config.endpoint("BROKER_FRONT", bind=True)   # ROUTER  (clientes / facultades)
+BACK_EP  = config.endpoint("BROKER_BACK", bind=True)    # DEALER  (DTI workers)
+HB_EP    = config.endpoint("BROKER_HB", bind=True)      # REP     (heartbeat)
+STATS_EP = config.endpoint("BROKER_STATS", bind=True)   # REP     (estadísticas, ver telemetria.py)
 
 def broker():
     ctx = zmq.Context()
 
     # ---------- sockets principales ----------
     front = ctx.socket(zmq.ROUTER)
-    front.bind(f"tcp://{IP}:{FRONT_PORT}")
+    front.bind(FRONT_EP)
 
-    back  = ctx.socket(zmq.DEALER)
-    back.bind(f"tcp://{IP}:{BACK_PORT}")
-
-    # ---------- captura tráfico --------------
-    capture = ctx.socket(zmq.PUB)
-    capture.bind("inproc://capture")
+    # DEALER reparte round-robin; ROUTER para el balanceo LRU (ver balanceo.py)
+    back  = ctx.socket(zmq.ROUTER if balanceo.MODO == "lru" else zmq.DEALER)
+    back.bind(BACK_EP)
 
     # ---------- heartbeat REP ----------------
     hb = ctx.socket(zmq.REP)
-    hb.bind(f"tcp://{IP}:{HB_PORT}")
-
-    def capturador():
-        subs = ctx.socket(zmq.SUB)
-        subs.connect("inproc://capture")
-        subs.setsockopt(zmq.SUBSCRIBE, b"")
-        n = 1
-        while True:
-            frames = subs.recv_multipart()
-            if len(frames) >= 2:
-                origen = frames[0].hex()[:6]
-                print(f"[Primario] Solicitud #{n} de {origen}")
-                n += 1
+    hb.bind(HB_EP)
 
     def heartbeater():
         while True:
@@ -44,18 +32,26 @@ def broker():
             except zmq.ContextTerminated:
                 break
 
-    threading.Thread(target=capturador, daemon=True).start()
     threading.Thread(target=heartbeater, daemon=True).start()
 
-    print(f"[Primario] Proxy ROUTER⇆DEALER activo en {IP} "
-          f"(front:{FRONT_PORT} back:{BACK_PORT} HB:{HB_PORT})")
+    modo = "ROUTER⇆ROUTER (LRU)" if balanceo.MODO == "lru" else "ROUTER⇆DEALER"
+    print(f"[Primario] Proxy {modo} activo "
+          f"(front:{FRONT_EP} back:{BACK_EP} HB:{HB_EP} stats:{STATS_EP})")
 
     try:
-        zmq.proxy(front, back, capture)
+        # totales en libzmq; la captura cuenta los mensajes por cliente (ver telemetria.py)
+        tele = telemetria.Telemetria(ctx, "Primario", STATS_EP)
+        # LRU o límites de admisión → bucle en Python (balanceo.py); si no, proxy de libzmq
+        balanceador = balanceo.crear(front, back, tele.captura, tele.control)
+        if balanceador is not None:
+            tele.extra = balanceador.estado
+            balanceador.correr()
+        else:
+            zmq.proxy_steerable(front, back, tele.captura, tele.control)
     except zmq.ContextTerminated:
         pass
     finally:
-        front.close(); back.close(); capture.close(); hb.close(); ctx.term()
+        front.close(); back.close(); hb.close(); ctx.term()
 
 if __name__ == "__main__":
     broker()
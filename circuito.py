@@ -0,0 +1,143 @@
+"""
+Interruptor de circuito por endpoint, compartido por todos los emisores
+de la máquina de facultades (hilos y procesos hijos).
+
+El estado vive en memoria compartida de multiprocessing creada al importar
+el módulo que lo usa, antes de lanzar los procesos de cada facultad (igual
+que inicio_total / fin_total en facultades.py); así, cuando una solicitud
+descubre que un endpoint no responde, las demás lo saltan de inmediato.
+
+  cerrado      → se usa normalmente; CIRCUITO_FALLOS fallos seguidos lo abren
+  abierto      → se salta durante CIRCUITO_ESPERA_MS
+  semiabierto  → pasado ese tiempo, una sola solicitud lo prueba: si
+                 contesta se cierra, si falla vuelve a abrirse
+
+Además de los fallos propios, un circuito se puede abrir desde fuera
+(`abrir`, p. ej. cuando el health-service cambia de broker), y quien ya
+espera una respuesta puede consultar `abierto` para no agotar su timeout.
+"""
+
+import multiprocessing, os, random, time
+import zmq
+
+CIRCUITO_FALLOS    = int(os.environ.get("CIRCUITO_FALLOS", "2"))
+CIRCUITO_ESPERA_MS = int(os.environ.get("CIRCUITO_ESPERA_MS", "2000"))
+# Cada cuánto una solicitud en vuelo revisa si el circuito de su endpoint se abrió
+CIRCUITO_SONDEO_MS = int(os.environ.get("CIRCUITO_SONDEO_MS", "100"))
+# El abandono se dispersa al azar hasta este valor para no reconectar todas a la vez
+CIRCUITO_DISPERSION_MS = int(os.environ.get("CIRCUITO_DISPERSION_MS", "500"))
+
+CERRADO, ABIERTO, SEMIABIERTO = 0, 1, 2
+_NOMBRES = {CERRADO: "cerrado", ABIERTO: "abierto", SEMIABIERTO: "semiabierto"}
+_CAMPOS  = 3            # por endpoint: estado, fallos seguidos, instante de la próxima sonda
+
+
+class Interruptores:
+    def __init__(self, endpoints, fallos: int = CIRCUITO_FALLOS,
+                 espera_ms: int = CIRCUITO_ESPERA_MS):
+        self.indices = {ep: i for i, ep in enumerate(endpoints)}
+        self.fallos  = fallos
+        self.espera  = espera_ms / 1000
+        # un solo candado para todos: cada operación toca unos pocos dobles
+        self.datos   = multiprocessing.Array("d", _CAMPOS * len(self.indices))
+
+    def _base(self, endpoint):
+        return _CAMPOS * self.indices[endpoint]
+
+    def disponible(self, endpoint) -> bool:
+        """Solo consulta: cerrado, o con una sonda pendiente de enviar."""
+        if endpoint not in self.indices:
+            return True
+        b = self._base(endpoint)
+        with self.datos.get_lock():
+            return self.datos[b] == CERRADO or time.monotonic() >= self.datos[b + 2]
+
+    def permitir(self, endpoint) -> bool:
+        """
+        Se llama justo antes de usar `endpoint`: True si se puede. Si toca
+        sondearlo, esta llamada se queda con la sonda y las demás reciben False.
+        """
+        if endpoint not in self.indices:
+            return True
+        b = self._base(endpoint)
+        ahora = time.monotonic()
+        with self.datos.get_lock():
+            estado, _, instante = self.datos[b:b + _CAMPOS]
+            if estado == CERRADO:
+                return True
+            # abierto y vencido, o sonda que nunca informó: se deja pasar una sonda
+            if ahora >= instante:
+                self.datos[b]     = SEMIABIERTO
+                self.datos[b + 2] = ahora + self.espera
+                return True
+            return False
+
+    def candidatos(self, endpoints) -> list:
+        """Los endpoints disponibles, en orden; si ninguno lo es, todos (último recurso)."""
+        return [ep for ep in endpoints if self.disponible(ep)] or list(endpoints)
+
+    def exito(self, endpoint):
+        if endpoint not in self.indices:
+            return
+        b = self._base(endpoint)
+        with self.datos.get_lock():
+            if self.datos[b] != CERRADO:
+                print(f"[Circuito] {endpoint} responde: cerrado", flush=True)
+            self.datos[b] = CERRADO
+            self.datos[b + 1] = 0
+
+    def fallo(self, endpoint):
+        if endpoint not in self.indices:
+            return
+        b = self._base(endpoint)
+        with self.datos.get_lock():
+            self.datos[b + 1] += 1
+            if self.datos[b] == SEMIABIERTO or self.datos[b + 1] >= self.fallos:
+                if self.datos[b] != ABIERTO:
+                    print(f"[Circuito] {endpoint} no responde: abierto "
+                          f"{self.espera * 1000:.0f} ms", flush=True)
+                self.datos[b] = ABIERTO
+                self.datos[b + 2] = time.monotonic() + self.espera
+
+    def abrir(self, endpoint):
+        """Abre el circuito sin esperar fallos (p. ej. el health-service ya lo vio caído)."""
+        if endpoint not in self.indices:
+            return
+        b = self._base(endpoint)
+        with self.datos.get_lock():
+            if self.datos[b] != ABIERTO:
+                print(f"[Circuito] {endpoint} reportado caído: abierto "
+                      f"{self.espera * 1000:.0f} ms", flush=True)
+            self.datos[b] = ABIERTO
+            self.datos[b + 2] = time.monotonic() + self.espera
+
+    def abierto(self, endpoint) -> bool:
+        """Solo consulta (no deja pasar sondas): lo usan las solicitudes ya en vuelo."""
+        if endpoint not in self.indices:
+            return False
+        b = self._base(endpoint)
+        with self.datos.get_lock():
+            return self.datos[b] == ABIERTO and time.monotonic() < self.datos[b + 2]
+
+    def esperador(self, endpoint, timeout_ms: int):
+        """
+        `esperar` para formato.Negociacion.intercambiar: espera la respuesta en
+        tramos cortos y lanza zmq.Again al vencer `timeout_ms` o, si el circuito
+        de `endpoint` se abre y hay otro disponible, tras una espera al azar de
+        hasta CIRCUITO_DISPERSION_MS.
+        """
+        def esperar(sock):
+            limite = time.monotonic() + timeout_ms / 1000
+            while not sock.poll(CIRCUITO_SONDEO_MS):
+                ahora = time.monotonic()
+                if ahora >= limite:
+                    raise zmq.error.Again()
+                # sin otro disponible, este sigue siendo el mejor candidato
+                if self.abierto(endpoint) and any(not self.abierto(ep)
+                                                  for ep in self.indices if ep != endpoint):
+                    limite = min(limite, ahora + random.uniform(0, CIRCUITO_DISPERSION_MS / 1000))
+        return esperar
+
+    def estado(self) -> dict:
+        with self.datos.get_lock():
+            return {ep: _NOMBRES[int(self.datos[self._base(ep)])] for ep in self.indices}
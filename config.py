@@ -0,0 +1,68 @@
+"""
+Direcciones de todos los componentes en un solo lugar.
+
+TRANSPORTE elige cómo se arman:
+  • tcp   (por defecto) direcciones del despliegue en el laboratorio (10.43.x.x)
+  • local todo en tcp://127.0.0.1, con puertos que no chocan entre sí
+  • ipc   sockets ipc:// en IPC_DIR: una sola máquina, sin pila TCP
+Cualquier endpoint se puede fijar además con una variable de entorno de su
+nombre (p. ej. DTI_PRIMARIO=tcp://10.0.0.5:5556), que tiene prioridad.
+"""
+
+import os
+
+#  nombre               host laboratorio   puerto  puerto local
+ENDPOINTS = {
+    "DTI_PRIMARIO":     ("10.43.103.197",  5556,   5556),
+    "DTI_RESPALDO":     ("10.43.96.74",    5556,   5557),
+    "DTI_REPLICA":      ("10.43.103.197",  5590,   5590),
+    "BROKER_FRONT":     ("10.43.96.74",    5555,   5555),
+    "BROKER_BACK":      ("10.43.96.74",    5560,   5560),
+    "BROKER_HB":        ("10.43.96.74",    5570,   5570),
+    "BROKER_STATS":     ("10.43.96.74",    5580,   5580),
+    "BROKER_SEC_FRONT": ("10.43.103.30",   5556,   5558),
+    "BROKER_SEC_BACK":  ("10.43.103.30",   5561,   5561),
+    "BROKER_SEC_HB":    ("10.43.103.30",   5571,   5571),
+    "BROKER_SEC_STATS": ("10.43.103.30",   5581,   5581),
+    "HEALTH":           ("10.43.96.74",    6000,   6100),
+    "HEALTH_PUB":       ("10.43.96.74",    6001,   6101),
+    "HEALTH_DTI":       ("10.43.103.102",  6002,   6102),
+    "HEALTH_DTI_PUB":   ("10.43.103.102",  6003,   6103),
+}
+# Estos se publican en todas las interfaces en lugar de en su host
+COMODIN = {"HEALTH", "HEALTH_PUB", "HEALTH_DTI", "HEALTH_DTI_PUB"}
+
+FACULTADES_HOST = "10.43.103.102"
+
+def transporte() -> str:
+    return os.environ.get("TRANSPORTE", "tcp")
+
+def _ipc(nombre: str) -> str:
+    directorio = os.environ.get("IPC_DIR", "/tmp/gestion-aulas")
+    os.makedirs(directorio, exist_ok=True)
+    return f"ipc://{directorio}/{nombre.lower()}"
+
+def endpoint(nombre: str, bind: bool = False) -> str:
+    """Dirección de `nombre` para connect (o para bind si `bind`)."""
+    if nombre in os.environ:
+        return os.environ[nombre]
+    host, puerto, puerto_local = ENDPOINTS[nombre]
+    modo = transporte()
+    if modo == "ipc":
+        return _ipc(nombre)
+    if modo == "local":
+        return f"tcp://127.0.0.1:{puerto_local}"
+    if bind and nombre in COMODIN:
+        return f"tcp://*:{puerto}"
+    return f"tcp://{host}:{puerto}"
+
+def facultad(puerto: int, bind: bool = False) -> str:
+    """Dirección del socket REP de la facultad que atiende en `puerto`."""
+    modo = transporte()
+    if modo == "ipc":
+        return _ipc(f"facultad-{puerto}")
+    if modo == "local":
+        return f"tcp://127.0.0.1:{puerto}"
+    if bind:
+        return f"tcp://*:{puerto}"
+    return f"tcp://{os.environ.get('FACULTADES_HOST', FACULTADES_HOST)}:{puerto}"
@@ -1,5 +1,7 @@
 import random
 import json
+import argparse
+import bisect
 
 # Definir las facultades y los programas
 facultades = [
@@ -36,30 +38,102 @@ def generar_salones_y_laboratorios():
     salones = random.randint(7 - laboratorios, 10 - laboratorios)
     return salones, laboratorios
 
-# Generar el JSON
-semestre = "2025-1"
-facultades_info = []
-
-for facultad in facultades:
-    facultad_info = {"nombre": facultad, "programas": []}
-    for programa in programas_por_facultad[facultad]:
-        salones, laboratorios = generar_salones_y_laboratorios()
-        programa_info = {
-            "nombre": programa,
-            "salones": salones,
-            "laboratorios": laboratorios
-        }
-        facultad_info["programas"].append(programa_info)
-    facultades_info.append(facultad_info)
-
-# Crear el objeto final con el semestre y las facultades
-resultado = {
-    "semestre": semestre,
-    "facultades": facultades_info
-}
+# Generador escalable: flujo JSONL con una solicitud de programa por línea
+#   {"semestre": ..., "facultad": ..., "programa": {"nombre", "salones", "laboratorios"}}
+# La facultad y el programa de cada solicitud se eligen con distribución Zipf (pocas
+# facultades/programas concentran la mayor parte de la demanda). Se escribe línea a
+# línea, así que la memoria no depende del número de solicitudes.
+
+def nombre_facultad(i):
+    if i < len(facultades):
+        return facultades[i]
+    return f"Facultad {i + 1}"
+
+def nombre_programa(i, j):
+    if i < len(facultades) and j < len(programas_por_facultad[facultades[i]]):
+        return programas_por_facultad[facultades[i]][j]
+    return f"Programa {i + 1}-{j + 1}"
+
+def cdf_zipf(n, s):
+    """Distribución acumulada de Zipf(s) sobre los rangos 1..n (s=0 es uniforme)."""
+    pesos = [1 / (k ** s) for k in range(1, n + 1)]
+    total = sum(pesos)
+    acumulado, cdf = 0.0, []
+    for p in pesos:
+        acumulado += p / total
+        cdf.append(acumulado)
+    cdf[-1] = 1.0
+    return cdf
+
+def generar_flujo(salida, n_facultades, n_programas, n_semestres, n_solicitudes,
+                  zipf=1.1, semilla=None, anio=2025):
+    rng = random.Random(semilla)
+    cdf_fac = cdf_zipf(n_facultades, zipf)
+    cdf_prog = cdf_zipf(n_programas, zipf)
+    semestres = [f"{anio + k // 2}-{k % 2 + 1}" for k in range(n_semestres)]
+
+    with open(salida, "w", encoding="utf-8") as archivo:
+        for _ in range(n_solicitudes):
+            i = bisect.bisect_left(cdf_fac, rng.random())
+            j = bisect.bisect_left(cdf_prog, rng.random())
+            laboratorios = rng.randint(2, 4)
+            salones = rng.randint(7 - laboratorios, 10 - laboratorios)
+            registro = {
+                "semestre": semestres[rng.randrange(n_semestres)],
+                "facultad": nombre_facultad(i),
+                "programa": {
+                    "nombre": nombre_programa(i, j),
+                    "salones": salones,
+                    "laboratorios": laboratorios
+                }
+            }
+            archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+
+    print(f"El archivo {salida} ha sido generado ({n_solicitudes} solicitudes).")
+
+def generar_documento():
+    # Generar el JSON
+    semestre = "2025-1"
+    facultades_info = []
+
+    for facultad in facultades:
+        facultad_info = {"nombre": facultad, "programas": []}
+        for programa in programas_por_facultad[facultad]:
+            salones, laboratorios = generar_salones_y_laboratorios()
+            programa_info = {
+                "nombre": programa,
+                "salones": salones,
+                "laboratorios": laboratorios
+            }
+            facultad_info["programas"].append(programa_info)
+        facultades_info.append(facultad_info)
+
+    # Crear el objeto final con el semestre y las facultades
+    resultado = {
+        "semestre": semestre,
+        "facultades": facultades_info
+    }
+
+    # Guardar el JSON en un archivo llamado solicitudes.json sin codificación Unicode
+    with open("solicitudes.json", "w", encoding="utf-8") as archivo:
+        json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+
+    print("El archivo solicitudes.json ha sido generado.")
 
-# Guardar el JSON en un archivo llamado solicitudes.json sin codificación Unicode
-with open("solicitudes.json", "w", encoding="utf-8") as archivo:
-    json.dump(resultado, archivo, indent=2, ensure_ascii=False)
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description="Genera solicitudes.json (por defecto) o un flujo JSONL escalable.")
+    ap.add_argument("--jsonl", metavar="ARCHIVO", help="escribe un flujo JSONL en lugar de solicitudes.json")
+    ap.add_argument("--facultades", type=int, default=len(facultades))
+    ap.add_argument("--programas", type=int, default=5, help="programas por facultad")
+    ap.add_argument("--semestres", type=int, default=1)
+    ap.add_argument("--solicitudes", type=int, default=100_000)
+    ap.add_argument("--zipf", type=float, default=1.1, help="exponente Zipf (0 = uniforme)")
+    ap.add_argument("--semilla", type=int, default=None, help="hace la salida reproducible")
+    args = ap.parse_args()
 
-print("El archivo solicitudes.json ha sido generado.")
+    if args.jsonl:
+        generar_flujo(args.jsonl, args.facultades, args.programas, args.semestres,
+                      args.solicitudes, args.zipf, args.semilla)
+    else:
+        random.seed(args.semilla)
+        generar_documento()
@@ -1,26 +1,62 @@
+import itertools
+import json
+import os
 import sqlite3
+import time
 from filelock import FileLock
+from idempotencia import IDEMPOTENCIA_TTL_S
 
 DB_FILE  = "recursos.db"
 DB_LOCK  = "recursos.db.lock"
 
+# Backend de asignación:
+#   • "filelock"    → candado de archivo + lectura/escritura (comportamiento original)
+#   • "condicional" → UPDATE con guarda (… WHERE disponibles >= ?), sin FileLock;
+#                     la atomicidad la garantiza SQLite y el rowcount decide.
+BACKEND = os.environ.get("DB_BACKEND", "filelock")
+
+# Lotes ya aplicados (tabla `solicitudes`): id del cliente → resultados y saldo que se respondieron.
+# Cada SOLICITUDES_PURGA lotes nuevos se borran los de más de IDEMPOTENCIA_TTL_S segundos.
+SOLICITUDES_PURGA = 1000
+_insertadas = itertools.count(1)    # next() es atómico: lo comparten los hilos del worker
+
 # ------------------------------------------------------------------ #
 def _conn():
     conn = sqlite3.connect(DB_FILE, timeout=30, isolation_level=None)  # autocommit
     conn.execute("PRAGMA journal_mode=WAL")
     return conn
 
+def abrir_conexion():
+    """Conexión propia para quien quiera reutilizarla entre lotes (una por hilo)."""
+    return _conn()
+
+def _crear_tablas():
+    with _conn() as conn:
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS recursos (
+            semestre TEXT PRIMARY KEY,
+            salones_disponibles     INTEGER,
+            laboratorios_disponibles INTEGER
+          )
+        """)
+        conn.execute("""
+          CREATE TABLE IF NOT EXISTS solicitudes (
+            id        TEXT PRIMARY KEY,
+            respuesta TEXT,     -- JSON {resultados, disp}
+            t         REAL
+          ) WITHOUT ROWID
+        """)
+        # versiones anteriores del backend condicional reclamaban el id con respuesta NULL
+        # fuera de la transacción del lote; un reclamo así que quedó huérfano no protege nada
+        conn.execute("DELETE FROM solicitudes WHERE respuesta IS NULL")
+
 def inicializar_bd():
+    if BACKEND == "condicional":
+        _crear_tablas()             # CREATE IF NOT EXISTS ya es atómico
+        return
     # Adquirir candado solo el tiempo mínimo
     with FileLock(DB_LOCK):
-        with _conn() as conn:
-            conn.execute("""
-              CREATE TABLE IF NOT EXISTS recursos (
-                semestre TEXT PRIMARY KEY,
-                salones_disponibles     INTEGER,
-                laboratorios_disponibles INTEGER
-              )
-            """)
+        _crear_tablas()
 
 # ------------------------------------------------------------------ #
 def obtener_y_bloquear(semestre: str, sal_orig: int, lab_orig: int):
@@ -68,3 +104,209 @@ def guardar_y_desbloquear(lock, conn, semestre: str, nuevos: dict):
         conn.close()
         if lock:                    # evita dejar el candado tomado
             lock.release()
+
+# ------------------------------------------------------------------ #
+def asignar_programa(disp: dict, programa: dict, facu: str) -> dict:
+    """
+    Aplica la regla de asignación de UN programa sobre `disp` (se modifica
+    en sitio) y devuelve el dict resultado que viaja en la respuesta.
+    """
+    res = {
+        "facultad": facu,
+        "programa": programa["nombre"],
+        "salones_solicitados": programa["salones"],
+        "laboratorios_solicitados": programa["laboratorios"],
+        "salones_asignados": 0,
+        "laboratorios_asignados": 0,
+    }
+
+    # --- asignación de labs (o salones como sustituto) ---
+    if disp["laboratorios"] >= programa["laboratorios"]:
+        disp["laboratorios"] -= programa["laboratorios"]
+        res["laboratorios_asignados"] = programa["laboratorios"]
+    elif disp["salones"] >= programa["laboratorios"]:
+        disp["salones"] -= programa["laboratorios"]
+        res["salones_asignados"] += programa["laboratorios"]
+        res["salones_como_laboratorios"] = programa["laboratorios"]
+
+    # --- asignación de salones ---
+    if disp["salones"] >= programa["salones"]:
+        disp["salones"] -= programa["salones"]
+        res["salones_asignados"] += programa["salones"]
+
+    return res
+
+def asignar_lote(semestre: str, facu: str, programas: list,
+                 sal_orig: int, lab_orig: int, conn=None):
+    """
+    Asigna TODOS los `programas` de una solicitud según el BACKEND activo.
+    `conn` permite reutilizar una conexión propia (p. ej. una por hilo);
+    si es None se abre y se cierra una conexión para este lote.
+    Devuelve (lista_resultados, dict_disponibles_final).
+    """
+    resultados, disp, _ = asignar_lote_unico(None, semestre, facu, programas,
+                                             sal_orig, lab_orig, conn)
+    return resultados, disp
+
+def asignar_lote_unico(solicitud, semestre: str, facu: str, programas: list,
+                       sal_orig: int, lab_orig: int, conn=None):
+    """
+    Como asignar_lote, pero idempotente por `solicitud` (id del cliente):
+    si ese lote ya se aplicó devuelve los resultados y el saldo de entonces
+    sin descontar nada. Devuelve (resultados, disp, repetida).
+    """
+    propia = conn is None
+    if propia:
+        conn = _conn()
+    try:
+        if BACKEND == "condicional":
+            return _asignar_lote_condicional(conn, semestre, facu, programas,
+                                             sal_orig, lab_orig, solicitud)
+        return _asignar_lote_filelock(conn, semestre, facu, programas,
+                                      sal_orig, lab_orig, solicitud)
+    finally:
+        if propia:
+            conn.close()
+
+def _guardar_solicitud(conn, solicitud, resultados, disp):
+    """Registra el lote `solicitud`; de vez en cuando purga los vencidos."""
+    conn.execute(
+        "INSERT OR REPLACE INTO solicitudes VALUES (?, ?, ?)",
+        (solicitud, json.dumps({"resultados": resultados, "disp": disp}), time.time())
+    )
+    if next(_insertadas) % SOLICITUDES_PURGA == 0:
+        conn.execute("DELETE FROM solicitudes WHERE t < ?",
+                     (time.time() - IDEMPOTENCIA_TTL_S,))
+
+def _leer_solicitud(respuesta):
+    guardada = json.loads(respuesta)
+    return guardada["resultados"], guardada["disp"], True
+
+def _asignar_lote_filelock(conn, semestre, facu, programas, sal_orig, lab_orig,
+                           solicitud=None):
+    """
+    Lote completo en una única transacción (BEGIN IMMEDIATE) con el
+    candado de archivo tomado una sola vez. El id del lote se busca y se
+    registra dentro de la misma transacción: un repetido nunca descuenta.
+    """
+    with FileLock(DB_LOCK):
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if solicitud:
+                fila = conn.execute("SELECT respuesta FROM solicitudes WHERE id=?",
+                                    (solicitud,)).fetchone()
+                if fila:
+                    conn.execute("COMMIT")
+                    return _leer_solicitud(fila[0])
+            row = conn.execute(
+                "SELECT salones_disponibles, laboratorios_disponibles "
+                "FROM recursos WHERE semestre=?",
+                (semestre,)
+            ).fetchone()
+
+            if row is None:
+                conn.execute(
+                    "INSERT INTO recursos VALUES (?, ?, ?)",
+                    (semestre, sal_orig, lab_orig)
+                )
+                disp = {"salones": sal_orig, "laboratorios": lab_orig}
+            else:
+                disp = {"salones": row[0], "laboratorios": row[1]}
+
+            resultados = [asignar_programa(disp, p, facu) for p in programas]
+
+            conn.execute(
+                "UPDATE recursos "
+                "SET salones_disponibles=?, laboratorios_disponibles=? "
+                "WHERE semestre=?",
+                (disp["salones"], disp["laboratorios"], semestre)
+            )
+            if solicitud:
+                _guardar_solicitud(conn, solicitud, resultados, disp)
+            conn.execute("COMMIT")      # un solo fsync por lote
+        except Exception:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            raise
+
+    return resultados, disp, False
+
+# ------------------------------------------------------------------ #
+def _descontar(conn, columna: str, semestre: str, cantidad: int) -> bool:
+    """Decremento con guarda: True solo si había saldo suficiente."""
+    cur = conn.execute(
+        f"UPDATE recursos SET {columna} = {columna} - ? "
+        f"WHERE semestre=? AND {columna} >= ?",
+        (cantidad, semestre, cantidad)
+    )
+    return cur.rowcount == 1
+
+def _asignar_lote_condicional(conn, semestre, facu, programas,
+                              sal_orig, lab_orig, solicitud=None):
+    """
+    Variante sin FileLock: cada decremento es un UPDATE atómico con guarda
+    y el rowcount indica si la asignación procedió. Todo el lote va en una
+    transacción (BEGIN IMMEDIATE): un solo fsync, el saldo devuelto es el
+    que dejó este lote y si algo falla no queda ningún decremento a medias.
+    El id del lote se busca y se registra dentro de la misma transacción:
+    un repetido devuelve la respuesta guardada y nunca descuenta.
+    """
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        if solicitud:
+            fila = conn.execute("SELECT respuesta FROM solicitudes WHERE id=?",
+                                (solicitud,)).fetchone()
+            if fila:
+                conn.execute("COMMIT")
+                return _leer_solicitud(fila[0])
+        resultados, disp = _descontar_lote(conn, semestre, facu, programas,
+                                           sal_orig, lab_orig)
+        if solicitud:
+            _guardar_solicitud(conn, solicitud, resultados, disp)
+        conn.execute("COMMIT")          # un solo fsync por lote
+    except Exception:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    return resultados, disp, False
+
+def _descontar_lote(conn, semestre, facu, programas, sal_orig, lab_orig):
+    conn.execute(
+        "INSERT OR IGNORE INTO recursos VALUES (?, ?, ?)",
+        (semestre, sal_orig, lab_orig)
+    )
+
+    resultados = []
+    for programa in programas:
+        res = {
+            "facultad": facu,
+            "programa": programa["nombre"],
+            "salones_solicitados": programa["salones"],
+            "laboratorios_solicitados": programa["laboratorios"],
+            "salones_asignados": 0,
+            "laboratorios_asignados": 0,
+        }
+
+        # --- labs, o salones como sustituto ---
+        if _descontar(conn, "laboratorios_disponibles",
+                      semestre, programa["laboratorios"]):
+            res["laboratorios_asignados"] = programa["laboratorios"]
+        elif _descontar(conn, "salones_disponibles",
+                        semestre, programa["laboratorios"]):
+            res["salones_asignados"] += programa["laboratorios"]
+            res["salones_como_laboratorios"] = programa["laboratorios"]
+
+        # --- salones ---
+        if _descontar(conn, "salones_disponibles",
+                      semestre, programa["salones"]):
+            res["salones_asignados"] += programa["salones"]
+
+        resultados.append(res)
+
+    sal, lab = conn.execute(
+        "SELECT salones_disponibles, laboratorios_disponibles "
+        "FROM recursos WHERE semestre=?",
+        (semestre,)
+    ).fetchone()
+
+    return resultados, {"salones": sal, "laboratorios": lab}
@@ -2,13 +2,30 @@
 DTI-worker concurrente con candado de archivo.
 Cada worker comparte la disponibilidad usando la BD 'recursos.db'
 y un FileLock (recursos.db.lock) para asegurar atomicidad.
+Con DB_BACKEND=condicional se usan UPDATE con guarda y no hay FileLock.
+Con WORKER_HILOS=N (>1) un solo proceso atiende N solicitudes a la vez:
+un ROUTER conectado a los brokers reparte por inproc:// a N hilos REP,
+cada uno con su propia conexión a la BD.
+Con BROKER_MODO=lru cada hilo es un worker LRU independiente: un REQ por
+broker que anuncia READY y solo recibe trabajo cuando está libre
+(ver balanceo.py).
+Las solicitudes llegan en JSON o en el formato compacto (formato.py) y
+se contestan en el mismo formato en que llegaron.
+Un lote con "id" (idempotencia.py) se aplica una sola vez: un repetido se
+contesta desde la caché en memoria del proceso, sin candado ni BD; si otro
+worker tuvo el original, la tabla `solicitudes` de recursos.db lo detecta
+dentro de la misma transacción de la asignación (salvo IDEMPOTENCIA_BD=0).
 """
 
-import zmq, threading, time
+import os, uuid, zmq, threading, time
+import balanceo
+import config
+import formato
+import idempotencia
 from db import (
     inicializar_bd,
-    obtener_y_bloquear,      # NUEVO: devuelve lock, conn y dict disponibles
-    guardar_y_desbloquear    # NUEVO: actualiza BD y libera lock
+    abrir_conexion,
+    asignar_lote_unico       # asigna la lista completa en una transacción, una vez por id
 )
 
 
@@ -16,68 +33,103 @@ SALONES_ORIG = 380
 LABS_ORIG    = 60
 
 resultados_asignacion = {}          # solo para respuesta al cliente
+resultados_lock = threading.Lock()  # lo comparten los hilos del pool
+# respuestas recientes por id de lote, para contestar repetidos sin tocar la BD
+respuestas = idempotencia.CacheLRU(idempotencia.IDEMPOTENCIA_RESPUESTAS)
 
-PRIMARY_BACK   = "tcp://10.43.96.74:5560"
-SECONDARY_BACK = "tcp://10.43.103.30:5561"
+WORKER_HILOS = int(os.environ.get("WORKER_HILOS", "1"))
+POOL_EP      = "inproc://dti-workers"
+# Retardo simulado por solicitud, en segundos (para comparar workers de distinta velocidad)
+WORKER_RETARDO = float(os.environ.get("WORKER_RETARDO", "0"))
+
+PRIMARY_BACK   = config.endpoint("BROKER_BACK")
+SECONDARY_BACK = config.endpoint("BROKER_SEC_BACK")
 
 # ------------------------------------------------------------------
-def asignar_recursos(programa, facu, semestre):
-    """Realiza la asignación para UN programa dentro de la sección crítica."""
-    # 1️⃣ Tomar candado + leer fila
-    lock, conn, disp = obtener_y_bloquear(
-        semestre, SALONES_ORIG, LABS_ORIG
+def asignar_recursos(programas, facu, semestre, conn=None, solicitud=None):
+    """
+    Asigna TODOS los programas de la solicitud en una sola transacción
+    (un candado, una conexión, un commit). Devuelve (saldo final, resultados
+    para la respuesta): el historial de la facultad en el semestre con los
+    de este lote al final (ver lotes.resultados_del_lote).
+    Si `solicitud` ya se había aplicado devuelve el saldo y los resultados
+    de entonces, sin sumarlos otra vez al historial del proceso.
+    """
+    clave = f"{facu}_{semestre}"
+    if not idempotencia.IDEMPOTENCIA_BD:
+        solicitud = None                # solo la caché en memoria de atender
+    resultados, disp, repetida = asignar_lote_unico(
+        solicitud, semestre, facu, programas, SALONES_ORIG, LABS_ORIG, conn
     )
+    if repetida:
+        print(f"[DTI-W] Solicitud {solicitud} repetida: no se vuelve a asignar", flush=True)
+        with resultados_lock:
+            return disp, resultados_asignacion.get(clave, []) + resultados
 
-    try:
-        res = {
-            "facultad": facu,
-            "programa": programa["nombre"],
-            "salones_solicitados": programa["salones"],
-            "laboratorios_solicitados": programa["laboratorios"],
-            "salones_asignados": 0,
-            "laboratorios_asignados": 0,
-        }
-
-        salones_usados_labs = 0
-
-        # --- asignación de labs ---
-        if disp["laboratorios"] >= programa["laboratorios"]:
-            disp["laboratorios"] -= programa["laboratorios"]
-            res["laboratorios_asignados"] = programa["laboratorios"]
+    for res in resultados:
+        if res["laboratorios_asignados"]:
             print(f"[DTI-W] {res['programa']} ({facu}) → "
                   f"{res['laboratorios_asignados']} labs.", flush=True)
-
-        elif disp["salones"] >= programa["laboratorios"]:
-            disp["salones"] -= programa["laboratorios"]
-            res["salones_asignados"] += programa["laboratorios"]
-            salones_usados_labs = programa["laboratorios"]
+        elif "salones_como_laboratorios" in res:
             print(f"[DTI-W] {res['programa']} ({facu}) → "
-                  f"{salones_usados_labs} salones como labs.", flush=True)
-
-        # --- asignación de salones ---
-        if disp["salones"] >= programa["salones"]:
-            disp["salones"] -= programa["salones"]
-            res["salones_asignados"] += programa["salones"]
+                  f"{res['salones_como_laboratorios']} salones como labs.",
+                  flush=True)
+        salones = res["salones_asignados"] - res.get("salones_como_laboratorios", 0)
+        if salones:
             print(f"[DTI-W] {res['programa']} ({facu}) → "
-                  f"{programa['salones']} salones.", flush=True)
+                  f"{salones} salones.", flush=True)
+
+    # almacenar para la respuesta; la copia se toma en el mismo paso, así ningún otro hilo se
+    # interpone entre el historial y los resultados de este lote
+    with resultados_lock:
+        historial = resultados_asignacion.setdefault(clave, [])
+        resp = historial + resultados
+        historial.extend(resultados)
+    return disp, resp
 
-        if salones_usados_labs:
-            res["salones_como_laboratorios"] = salones_usados_labs
+def atender(msg, conn=None):
+    """Procesa un mensaje ya decodificado y devuelve el dict de respuesta."""
+    # Health-check del broker
+    if msg.get("tipo") == "ping":
+        return {"status": "ok"}
 
-        # 2️⃣ guardar nuevos saldos y soltar lock
-        guardar_y_desbloquear(lock, conn, semestre, disp)
+    solicitud = msg.get("id")
+    if solicitud:
+        respuesta = respuestas.obtener(solicitud)
+        if respuesta is not None:
+            print(f"[DTI-W] Solicitud {solicitud} repetida: se responde desde la caché", flush=True)
+            return respuesta
 
-        # 3️⃣ almacenar para la respuesta
-        clave = f"{facu}_{semestre}"
-        resultados_asignacion.setdefault(clave, []).append(res)
+    facu      = msg["facultad"]
+    semestre  = msg["semestre"]
+    programas = msg["programas"]
 
+    if WORKER_RETARDO:
+        time.sleep(WORKER_RETARDO)
+
+    # Procesar el lote completo (devuelve también el saldo final y los resultados a responder)
+    disp, resp = asignar_recursos(programas, facu, semestre, conn, solicitud)
+
+    respuesta = {
+        "resultado": resp,
+        "estado": {
+            "salones_disponibles": disp["salones"],
+            "laboratorios_disponibles": disp["laboratorios"]
+        }
+    }
+    if solicitud:
+        respuestas.guardar(solicitud, respuesta)
+    return respuesta
+
+def atender_bytes(datos, conn=None, etiqueta="DTI-W"):
+    """Decodifica, atiende y codifica en el formato de la solicitud; los errores van en JSON."""
+    try:
+        return formato.responder(datos, atender(formato.decodificar(datos), conn))
+    except formato.FormatoNoSoportado as e:
+        return formato.error(str(e), no_soportado=True)
     except Exception as e:
-        # ante error, liberar lock para no quedar bloqueado
-        try:
-            guardar_y_desbloquear(lock, conn, semestre, disp)
-        except Exception:
-            pass
-        raise e
+        print(f"[{etiqueta}] Error: {e}", flush=True)
+        return formato.error(str(e))
 
 # ------------------------------------------------------------------
 def manejar_dti_worker():
@@ -97,51 +149,105 @@ def manejar_dti_worker():
 
     while True:
         try:
-            msg = sock.recv_json()            # llegará de cualquiera de los brokers
-
-            # Health-check del broker
-            if msg.get("tipo") == "ping":
-                sock.send_json({"status": "ok"})
-                continue
-
-            facu      = msg["facultad"]
-            semestre  = msg["semestre"]
-            programas = msg["programas"]
-
-            # Procesar secuencialmente cada programa
-            for prog in programas:
-                asignar_recursos(prog, facu, semestre)
-
-            # Construir respuesta
-            clave = f"{facu}_{semestre}"
-            resp  = resultados_asignacion.get(clave, [])
-
-            # Leer saldo final
-            _, _, disp = obtener_y_bloquear(semestre, SALONES_ORIG, LABS_ORIG)
-            from filelock import FileLock
-            FileLock("recursos.db.lock").release()
-
-            sock.send_json({
-                "resultado": resp,
-                "estado": {
-                    "salones_disponibles": disp["salones"],
-                    "laboratorios_disponibles": disp["laboratorios"]
-                }
-            })
+            datos = sock.recv()               # llegará de cualquiera de los brokers
+            sock.send(atender_bytes(datos))
 
         except zmq.error.Again:
             # Timeout → el broker al que se envió no respondió.
             # ZeroMQ intentará la otra ruta en la próxima operación.
             continue
-        except Exception as e:
-            print(f"[DTI-W] Error: {e}", flush=True)
-            sock.send_json({"status": "error", "mensaje": str(e)})
 
 
+# ------------------------------------------------------------------
+def _hilo_pool(ctx, n):
+    """Hilo del pool: REP sobre inproc con su propia conexión a la BD."""
+    conn = abrir_conexion()
+    sock = ctx.socket(zmq.REP)
+    sock.connect(POOL_EP)
+    try:
+        while True:
+            sock.send(atender_bytes(sock.recv(), conn, f"DTI-W/{n}"))
+    except zmq.ContextTerminated:
+        pass
+    finally:
+        sock.close()
+        conn.close()
+
+def manejar_dti_worker_pool(hilos: int = WORKER_HILOS):
+    """
+    Un único frente ROUTER conectado a los dos brokers; el DEALER inproc
+    reparte las solicitudes entre `hilos` hilos REP y devuelve cada
+    respuesta al broker de origen por su identidad.
+    """
+    ctx   = zmq.Context()
+    front = ctx.socket(zmq.ROUTER)
+    front.setsockopt(zmq.LINGER, 0)
+    for ep in (PRIMARY_BACK, SECONDARY_BACK):
+        front.connect(ep)
+
+    back = ctx.socket(zmq.DEALER)
+    back.bind(POOL_EP)                  # bind antes de que conecten los hilos
+
+    for n in range(hilos):
+        threading.Thread(target=_hilo_pool, args=(ctx, n), daemon=True).start()
+    print(f"[DTI-W] Pool de {hilos} hilos conectado a "
+          f"{PRIMARY_BACK} y {SECONDARY_BACK}")
+
+    try:
+        zmq.proxy(front, back)
+    except zmq.ContextTerminated:
+        pass
+    finally:
+        front.close(); back.close(); ctx.term()
+
+# ------------------------------------------------------------------
+def _hilo_lru(ctx, n):
+    """
+    Worker LRU: un REQ por broker; READY al conectar y cada respuesta lo vuelve
+    a marcar libre. Libre, repite READY cada balanceo.LATIDO_S (REQ_RELAXED
+    permite enviar sin haber recibido) para que el broker no lo olvide y, si
+    el broker reinició, lo vuelva a conocer. La identidad fija hace que el
+    broker reconozca el latido como del mismo worker.
+    """
+    conn   = abrir_conexion()
+    poller = zmq.Poller()
+    ultimo = {}                         # socket → último envío (READY o respuesta)
+    for ep in (PRIMARY_BACK, SECONDARY_BACK):
+        sock = ctx.socket(zmq.REQ)
+        sock.setsockopt(zmq.LINGER, 0)
+        sock.setsockopt(zmq.REQ_RELAXED, 1)
+        sock.setsockopt(zmq.ROUTING_ID, f"w{n}-{uuid.uuid4().hex[:12]}".encode())
+        sock.connect(ep)
+        sock.send(balanceo.READY)
+        ultimo[sock] = time.monotonic()
+        poller.register(sock, zmq.POLLIN)
+
+    while True:
+        eventos = dict(poller.poll(int(balanceo.LATIDO_S * 1000)))
+        for sock in ultimo:
+            if sock in eventos:
+                cliente, _, cuerpo = sock.recv_multipart()
+                sock.send_multipart([cliente, b"", atender_bytes(cuerpo, conn, f"DTI-W/{n}")])
+                ultimo[sock] = time.monotonic()
+            elif time.monotonic() - ultimo[sock] >= balanceo.LATIDO_S:
+                sock.send(balanceo.READY)           # latido
+                ultimo[sock] = time.monotonic()
+
+def manejar_dti_worker_lru(hilos: int = WORKER_HILOS):
+    ctx = zmq.Context()
+    for n in range(hilos):
+        threading.Thread(target=_hilo_lru, args=(ctx, n), daemon=True).start()
+    print(f"[DTI-W] {hilos} worker(s) LRU conectados a "
+          f"{PRIMARY_BACK} y {SECONDARY_BACK}")
+
 # ------------------------------------------------------------------
 def iniciar_dti_worker():
     inicializar_bd()
-    threading.Thread(target=manejar_dti_worker, daemon=True).start()
+    if balanceo.MODO == "lru":
+        objetivo = manejar_dti_worker_lru
+    else:
+        objetivo = manejar_dti_worker_pool if WORKER_HILOS > 1 else manejar_dti_worker
+    threading.Thread(target=objetivo, daemon=True).start()
     print("[DTI-W] Worker listo…")
     while True:
         time.sleep(10)
@@ -1,8 +1,18 @@
 import zmq
+import circuito
+import config
+import formato
+import idempotencia
+import json
+import lotes
+import metricas
 import multiprocessing
+import os
 import signal
 import sys
+import threading
 import time  
+from concurrent.futures import ThreadPoolExecutor
 
 inicio_total = multiprocessing.Value('d', 0.0)   # 1.ª respuesta exitosa (epoch)
 fin_total    = multiprocessing.Value('d', 0.0)   # Última respuesta exitosa
@@ -10,6 +20,247 @@ time_lock    = multiprocessing.Lock()            # protege ambas variables
 # Señal de parada global para procesos hijos
 parar_evento = multiprocessing.Event()
 
+SERVIDORES_DTI = [
+    config.endpoint("DTI_PRIMARIO"),   # primario
+    config.endpoint("DTI_RESPALDO"),   # respaldo
+]
+# El HealthChecker publica aquí el DTI activo; sin anuncios en HEALTH_DTI_CACHE_S s se usa el orden fijo
+HEALTH_DTI_PUB_EP  = config.endpoint("HEALTH_DTI_PUB")
+HEALTH_DTI_CACHE_S = float(os.environ.get("HEALTH_DTI_CACHE_S", "3"))
+# Máximo de solicitudes en vuelo hacia el DTI por facultad (hilos emisores persistentes)
+FACULTAD_CONCURRENCIA = int(os.environ.get("FACULTAD_CONCURRENCIA", "8"))
+
+# Timeout de respuesta: FACTOR × p99 reciente, entre MIN_MS y el máximo (el fijo de antes)
+FACULTAD_TIMEOUT_MS     = int(os.environ.get("FACULTAD_TIMEOUT_MS", "55000"))
+FACULTAD_TIMEOUT_MIN_MS = int(os.environ.get("FACULTAD_TIMEOUT_MIN_MS", "250"))
+FACULTAD_TIMEOUT_FACTOR = float(os.environ.get("FACULTAD_TIMEOUT_FACTOR", "4"))
+# Si es 1, el respaldo recibe una copia cuando el primario pasa del percentil indicado
+FACULTAD_HEDGE           = os.environ.get("FACULTAD_HEDGE", "0") == "1"
+FACULTAD_HEDGE_PERCENTIL = float(os.environ.get("FACULTAD_HEDGE_PERCENTIL", "95"))
+
+_latencias = metricas.VentanaLatencias()   # latencias recientes hacia el DTI (de todos los hilos)
+# Estado de cada DTI compartido por todas las facultades (memoria compartida, creada antes del fork)
+_circuito = circuito.Interruptores(SERVIDORES_DTI)
+# Último anuncio del HealthChecker: índice en SERVIDORES_DTI del activo e instante (monotonic) en que llegó
+_dti_activo = multiprocessing.Array('d', [0, float("-inf")])
+_locales = threading.local()     # sockets REQ ya conectados, uno por servidor y por hilo
+_negociacion = formato.Negociacion()   # formato aceptado por cada DTI (WIRE_FORMATO)
+
+# Función: _socket_dti
+# Parámetros:
+#   - servidor (str): Endpoint del DTI.
+#
+# Funcionalidad:
+# Devuelve el socket REQ del hilo actual hacia `servidor`, creándolo y conectándolo solo la primera vez.
+# Así cada emisor reutiliza su conexión en lugar de pagar contexto + connect por programa.
+def _socket_dti(servidor, timeout_recv=55_000, timeout_send=3_000):
+    sockets = getattr(_locales, "sockets", None)
+    if sockets is None:
+        sockets = _locales.sockets = {}
+    sock = sockets.get(servidor)
+    if sock is None:
+        sock = zmq.Context.instance().socket(zmq.REQ)
+        # opciones que evitan bloqueos
+        sock.setsockopt(zmq.LINGER, 0)     # cierra sin esperar
+        sock.setsockopt(zmq.IMMEDIATE, 1)  # falla instantáneamente si no hay ruta
+        sock.RCVTIMEO = timeout_recv       # ms
+        sock.SNDTIMEO = timeout_send       # ms
+        sock.connect(servidor)
+        sockets[servidor] = sock
+    return sock
+
+# Función: _descartar_socket
+# Parámetros:
+#   - servidor (str): Endpoint del DTI.
+#
+# Funcionalidad:
+# Cierra y olvida el socket del hilo hacia `servidor`. Tras un timeout un REQ queda en estado inválido,
+# así que la siguiente solicitud debe usar uno nuevo.
+def _descartar_socket(servidor):
+    sock = getattr(_locales, "sockets", {}).pop(servidor, None)
+    if sock is not None:
+        sock.close()
+
+# Función: _preconectar
+# Funcionalidad:
+# Inicializador de cada hilo emisor: deja listos los sockets hacia todos los DTI.
+def _preconectar():
+    for servidor in SERVIDORES_DTI:
+        _socket_dti(servidor)
+
+# Función: _suscriptor_health
+# Parámetros:
+#   - evento_parar (multiprocessing.Event): Termina el hilo al activarse.
+#
+# Funcionalidad:
+# Hilo del proceso principal suscrito a los anuncios del HealthChecker. Guarda en memoria compartida cuál DTI
+# está activo, así todas las facultades lo prueban primero. Cuando el activo cambia abre el circuito del
+# anterior: las solicitudes que lo esperaban pasan al nuevo sin agotar su timeout.
+def _suscriptor_health(evento_parar):
+    sub = zmq.Context.instance().socket(zmq.SUB)
+    sub.setsockopt(zmq.RCVTIMEO, 1000)
+    sub.connect(HEALTH_DTI_PUB_EP)
+    sub.setsockopt(zmq.SUBSCRIBE, b"dti")
+    while not evento_parar.is_set():
+        try:
+            _, cuerpo = sub.recv_multipart()
+        except zmq.error.Again:
+            continue
+        activo = json.loads(cuerpo)["activo"]
+        if activo not in SERVIDORES_DTI:
+            continue
+        indice = SERVIDORES_DTI.index(activo)
+        with _dti_activo.get_lock():
+            anterior = int(_dti_activo[0])
+            _dti_activo[0] = indice
+            _dti_activo[1] = time.monotonic()
+        if indice != anterior:
+            print(f"[Cliente] DTI activo → {activo}")
+            _circuito.abrir(SERVIDORES_DTI[anterior])
+            _circuito.exito(activo)
+    sub.close()
+
+# Función: _servidores
+# Funcionalidad:
+# SERVIDORES_DTI con el activo anunciado por el HealthChecker primero; si no hay un anuncio reciente, el orden
+# fijo (primario y luego respaldo).
+def _servidores():
+    with _dti_activo.get_lock():
+        indice, instante = int(_dti_activo[0]), _dti_activo[1]
+    if time.monotonic() - instante > HEALTH_DTI_CACHE_S:
+        return list(SERVIDORES_DTI)
+    return [SERVIDORES_DTI[indice]] + [ep for ep in SERVIDORES_DTI if ep != SERVIDORES_DTI[indice]]
+
+# Función: _timeout_ms
+# Parámetros:
+#   - ultimo (bool): True si es el último servidor que queda por intentar.
+#
+# Funcionalidad:
+# Timeout de respuesta adaptativo: FACULTAD_TIMEOUT_FACTOR × p99 de las latencias recientes, acotado entre
+# FACULTAD_TIMEOUT_MIN_MS y FACULTAD_TIMEOUT_MS. Sin muestras suficientes, o para el último servidor
+# (que ya no tiene a quién pasar la solicitud), se usa el máximo de siempre.
+def _timeout_ms(ultimo=False):
+    p99 = _latencias.percentil(99)
+    if ultimo or p99 is None:
+        return FACULTAD_TIMEOUT_MS
+    return int(min(FACULTAD_TIMEOUT_MS, max(FACULTAD_TIMEOUT_MIN_MS,
+                                            FACULTAD_TIMEOUT_FACTOR * p99 * 1000)))
+
+# Función: _intercambio_secuencial
+# Parámetros:
+#   - data (dict): Lote a enviar.
+#   - errores (list): Se agregan aquí los fallos de cada servidor.
+#
+# Funcionalidad:
+# Prueba los DTI en orden, cada uno con el timeout adaptativo; devuelve (servidor, respuesta) del primero que
+# contesta o (None, None). Solo las respuestas cuentan como muestras; si todo el sistema se vuelve lento, el
+# último servidor conserva el timeout máximo y el lote no se pierde. Los DTI con el circuito abierto
+# (`circuito.py`) se saltan sin esperar, y cada éxito o fallo se informa al interruptor compartido.
+def _intercambio_secuencial(data, errores, timeout_send):
+    servidores = _circuito.candidatos(_servidores())
+    for n, servidor in enumerate(servidores):
+        ultimo = n == len(servidores) - 1
+        if not ultimo and not _circuito.permitir(servidor):
+            continue                      # otra solicitud se quedó con la sonda
+        timeout = _timeout_ms(ultimo)
+        try:
+            sock = _socket_dti(servidor, timeout, timeout_send)
+            sock.RCVTIMEO = timeout
+            # con IMMEDIATE un servidor colgado deja el envío esperando conexión: también se acota
+            sock.SNDTIMEO = timeout_send if ultimo else min(timeout_send, timeout)
+            t0 = time.perf_counter()
+            # puede lanzar zmq.Again si pasa SNDTIMEO o RCVTIMEO
+            # si otra solicitud abre el circuito de este DTI mientras se espera, se pasa al siguiente
+            respuesta = _negociacion.intercambiar(sock, servidor, data,
+                                                  _circuito.esperador(servidor, timeout))
+            _latencias.registrar(time.perf_counter() - t0)
+            _circuito.exito(servidor)
+            return servidor, respuesta
+        except zmq.error.Again:
+            errores.append(f"{servidor}: timeout ({timeout} ms)")
+            _circuito.fallo(servidor)
+            _descartar_socket(servidor)
+        except Exception as e:
+            errores.append(f"{servidor}: {e}")
+            _circuito.fallo(servidor)
+            _descartar_socket(servidor)
+    return None, None
+
+# Función: _intercambio_cubierto
+# Parámetros:
+#   - data (dict): Lote a enviar.
+#   - errores (list): Se agregan aquí los fallos de cada servidor.
+#
+# Funcionalidad:
+# Solicitud con cobertura ("hedged"): se envía al primario y, si no contesta dentro del percentil
+# FACULTAD_HEDGE_PERCENTIL de las latencias recientes, se envía también al respaldo; gana la primera respuesta.
+# El socket REQ que queda esperando se descarta (un REQ no puede volver a enviar sin recibir). Perder la
+# carrera no cuenta como fallo para el circuito de ese DTI (solo era más lento); sí cuentan no poder enviar
+# y no contestar antes del timeout. Devuelve (servidor, respuesta) o (None, None).
+#
+# Uso de recursos:
+# - Un `zmq.Poller` sobre los REQ del hilo; como mucho dos solicitudes en vuelo por lote.
+def _intercambio_cubierto(data, errores, timeout_send):
+    espera = _latencias.percentil(FACULTAD_HEDGE_PERCENTIL)
+    espera_ms = FACULTAD_TIMEOUT_MS if espera is None else max(1, int(espera * 1000))
+    t0 = time.perf_counter()
+    limite = t0 + FACULTAD_TIMEOUT_MS / 1000
+    poller = zmq.Poller()
+    enviados = {}                        # socket → (servidor, bytes enviados)
+    pendientes = _circuito.candidatos(_servidores())
+
+    def enviar_siguiente():
+        while pendientes:
+            servidor = pendientes.pop(0)
+            if pendientes and not _circuito.permitir(servidor):
+                continue                  # otra solicitud se quedó con la sonda
+            try:
+                sock = _socket_dti(servidor, FACULTAD_TIMEOUT_MS, timeout_send)
+                # si aún hay a quién cubrir, no se espera conexión más que el plazo de cobertura
+                sock.SNDTIMEO = min(timeout_send, espera_ms) if pendientes else timeout_send
+                datos = formato.codificar(data, _negociacion.formato_para(servidor))
+                sock.send(datos)                 # puede lanzar zmq.Again si pasa SNDTIMEO
+                enviados[sock] = (servidor, datos)
+                poller.register(sock, zmq.POLLIN)
+                return
+            except zmq.error.Again:
+                errores.append(f"{servidor}: sin conexión")
+                _circuito.fallo(servidor)
+                _descartar_socket(servidor)
+
+    def descartar_resto(ganador=None, fallo=False):
+        for servidor, _ in enviados.values():
+            if servidor != ganador:
+                if fallo:
+                    _circuito.fallo(servidor)
+                _descartar_socket(servidor)
+
+    enviar_siguiente()
+    proximo = t0 + espera_ms / 1000      # cuándo cubrir con el siguiente servidor
+    while enviados:
+        ahora = time.perf_counter()
+        if ahora >= limite:
+            break
+        plazo = min(limite, proximo) if pendientes else limite
+        for sock, _ in poller.poll(max(0, int((plazo - ahora) * 1000))):
+            servidor, datos = enviados[sock]
+            recibido = sock.recv()
+            if _negociacion.rechazado(servidor, datos, recibido):
+                enviados[sock] = (servidor, formato.codificar(data, "json"))
+                sock.send(enviados[sock][1])     # reintento en JSON por el mismo socket
+                continue
+            _latencias.registrar(time.perf_counter() - t0)
+            _circuito.exito(servidor)
+            descartar_resto(servidor)
+            return servidor, formato.decodificar(recibido)
+        if pendientes and time.perf_counter() >= proximo:
+            enviar_siguiente()
+            proximo = time.perf_counter() + espera_ms / 1000
+
+    errores.extend(f"{servidor}: timeout" for servidor, _ in enviados.values())
+    descartar_resto(fallo=True)
+    return None, None
+
 # Función: enviar_a_dti
 # Parámetros:
 #   - data (dict): Datos a enviar al DTI, que incluyen el semestre, facultad y los programas.
@@ -18,59 +269,45 @@ parar_evento = multiprocessing.Event()
 # Esta función se encarga de enviar los datos de la facultad al servidor DTI. Utiliza ZeroMQ para la comunicación
 # con el servidor DTI y espera recibir una respuesta con los resultados de la asignación de recursos.
 # Imprime la respuesta de DTI en consola y si los resultados están disponibles, los imprime detalladamente.
+# Con FACULTAD_HEDGE=1 el respaldo recibe una copia si el primario tarda más que el percentil configurado;
+# si no, los servidores se prueban en orden con un timeout adaptado a las latencias observadas.
 #
 # Uso de recursos:
 # - Utiliza ZeroMQ para enviar y recibir mensajes con el servidor DTI.
-# - Maneja errores de comunicación y cierra el socket y contexto al finalizar.
-def enviar_a_dti(data, *, timeout_recv=55_000, timeout_send=3_000):
+# - Reutiliza los sockets del hilo (`_socket_dti`); solo los cierra si hubo un error.
+# - Codifica según WIRE_FORMATO (`formato.py`); si un DTI no entiende el formato compacto se reenvía en JSON.
+def enviar_a_dti(data, *, timeout_send=3_000):
     """Envía `data` a la primera instancia DTI que responda.
     Solo imprime errores si todas fallan.
     """
-    servidores = [
-        "tcp://10.43.103.197:5556",  # primario
-        "tcp://10.43.96.74:5556",    # respaldo
-    ]
-
-    ctx = zmq.Context.instance()
     errores = []                      # guardamos los fallos para mostrarlos solo si nadie respondió
+    # el mismo id en la copia de cobertura y al pasar al respaldo: el DTI no asigna dos veces
+    data = {**data, "id": data.get("id") or idempotencia.nuevo_id()}
 
-    for servidor in servidores:
-        sock = ctx.socket(zmq.REQ)
-        # opciones que evitan bloqueos
-        sock.setsockopt(zmq.LINGER, 0)     # cierra sin esperar
-        sock.setsockopt(zmq.IMMEDIATE, 1)  # falla instantáneamente si no hay ruta
-        sock.RCVTIMEO = timeout_recv       # ms
-        sock.SNDTIMEO = timeout_send       # ms
+    t0 = time.perf_counter()
+    if FACULTAD_HEDGE:
+        servidor, respuesta = _intercambio_cubierto(data, errores, timeout_send)
+    else:
+        servidor, respuesta = _intercambio_secuencial(data, errores, timeout_send)
 
-        try:
-            sock.connect(servidor)
-            t0 = time.perf_counter()   
-            sock.send_json(data)           # puede lanzar zmq.Again si pasa SNDTIMEO
-            respuesta = sock.recv_json() 
-            t1 = time.perf_counter()  # idem con RCVTIMEO
-
-            now = time.time()              # epoch en segundos
-            with time_lock:
-                if inicio_total.value == 0:  # primera vez
-                    inicio_total.value = now
-                fin_total.value = now    
-
-            # ÉXITO ───────────────────────────────────────────────────────────
-            print(f"\n[{data['facultad']}] Respuesta de {servidor}:")
-            for r in respuesta.get("resultado", []):
-                print(f"  → {r['programa']}: "
-                      f"{r['salones_asignados']}/{r['salones_solicitados']} salones, "
-                      f"{r['laboratorios_asignados']}/{r['laboratorios_solicitados']} labs")
-            sock.close()
-            return                         # salimos: ya recibimos una respuesta válida
+    if respuesta is not None:
+        t1 = time.perf_counter()
+        metricas.registrar_latencia("facultad", t1 - t0, len(data["programas"]))
 
-        except zmq.error.Again:
-            errores.append(f"{servidor}: timeout")
-        except Exception as e:
-            errores.append(f"{servidor}: {e}")
+        now = time.time()              # epoch en segundos
+        with time_lock:
+            if inicio_total.value == 0:  # primera vez
+                inicio_total.value = now
+            fin_total.value = now
 
-        finally:
-            sock.close()
+        # ÉXITO ───────────────────────────────────────────────────────────
+        print(f"\n[{data['facultad']}] Respuesta de {servidor}:")
+        # un resultado por cada programa del lote
+        for r in lotes.resultados_del_lote(respuesta.get("resultado", []), data["programas"]):
+            print(f"  → {r['programa']}: "
+                  f"{r['salones_asignados']}/{r['salones_solicitados']} salones, "
+                  f"{r['laboratorios_asignados']}/{r['laboratorios_solicitados']} labs")
+        return                         # ya recibimos una respuesta válida
 
     # NINGÚN DTI RESPONDIÓ ────────────────────────────────────────────────────
     print(f"[Facultad {data['facultad']}] No se pudo conectar a ningún servidor DTI.")
@@ -87,22 +324,49 @@ def enviar_a_dti(data, *, timeout_recv=55_000, timeout_send=3_000):
 # Funcionalidad:
 # Esta función se encarga de manejar las solicitudes que llegan a la facultad en el puerto especificado. 
 # Recibe los datos de los programas a través de un socket de tipo REP (reply) y procesa cada programa.
-# Si los datos del programa son válidos, envía la solicitud a DTI usando `enviar_a_dti` en un proceso hijo.
-# La función se ejecuta en un bucle hasta que se reciba una señal de parada.
+# Si los datos del programa son válidos, lo acumula con los demás programas del mismo semestre (`lotes.py`)
+# y, al llenarse el lote o vencer su ventana, entrega una sola solicitud a un pool persistente de hilos
+# emisores que llaman a `enviar_a_dti` con sockets ya conectados. La función se ejecuta en un bucle hasta
+# que se reciba una señal de parada.
 #
 # Uso de recursos:
 # - Utiliza un socket de tipo REP para recibir las solicitudes.
-# - Cada solicitud procesada genera un nuevo proceso para llamar a `enviar_a_dti`.
+# - Un `ThreadPoolExecutor` de `FACULTAD_CONCURRENCIA` hilos; un semáforo limita las solicitudes en vuelo,
+#   de modo que una ráfaga espera turno en vez de crear procesos sin límite. Al parar, espera a que el pool
+#   termine de enviar los lotes ya aceptados.
 def manejar_programas_facultad(facultad, puerto, evento_parar):
     context = zmq.Context()  # Crear contexto de ZeroMQ
     socket = context.socket(zmq.REP)  # Crear socket de tipo REP
-    socket.bind(f"tcp://*:{puerto}")  # Vincular el socket al puerto
+    socket.bind(config.facultad(puerto, bind=True))  # Vincular el socket al puerto
+
+    emisores = ThreadPoolExecutor(max_workers=FACULTAD_CONCURRENCIA,
+                                  initializer=_preconectar)
+    cupos = threading.BoundedSemaphore(FACULTAD_CONCURRENCIA)
+
+    def enviar_con_cupo(data):
+        try:
+            enviar_a_dti(data)
+        finally:
+            cupos.release()
 
     print(f"[{facultad}] Esperando solicitudes en puerto {puerto}...")
 
+    pendientes = {}   # programas acumulados por semestre (ver lotes.py)
+
+    def despachar(semestre, programas):
+        # Preparar los datos para enviar a DTI (un lote de programas del mismo semestre)
+        data = {
+            "programas": programas,
+            "facultad": facultad,
+            "semestre": semestre
+        }
+        cupos.acquire()  # espera si ya hay FACULTAD_CONCURRENCIA en vuelo
+        emisores.submit(enviar_con_cupo, data)
+
     try:
         while not evento_parar.is_set():  # Mientras el evento de parada no esté activado
-            if socket.poll(timeout=1000):  # Esperar 1 segundo para nuevas solicitudes
+            # Esperar hasta 1 segundo, o menos si vence la ventana de algún lote
+            if socket.poll(timeout=lotes.espera_ms(pendientes, 1000)):
                 mensaje = socket.recv_json()  # Recibir mensaje de la facultad
                 semestre = mensaje.get('semestre')
                 programa = mensaje.get('programa')
@@ -117,17 +381,21 @@ def manejar_programas_facultad(facultad, puerto, evento_parar):
                     "mensaje": f"Programa '{programa.get('nombre')}' procesado en {facultad}"
                 })
 
-                # Preparar los datos para enviar a DTI
-                data = {
-                    "programas": [programa],
-                    "facultad": facultad,
-                    "semestre": semestre
-                }
-                p = multiprocessing.Process(target=enviar_a_dti, args=(data,))  # Crear proceso para enviar a DTI
-                p.start()
+                lote = lotes.agregar(pendientes, semestre, programa)
+                if lote:
+                    despachar(semestre, lote)
+
+            for semestre, lote in lotes.vencidos(pendientes):
+                despachar(semestre, lote)
+
+        for semestre, lote in lotes.vaciar(pendientes):   # lo que quedó al parar
+            despachar(semestre, lote)
     except Exception as e:
         print(f"[{facultad}] Error en el servidor: {e}")
     finally:
+        # los lotes ya aceptados (también los recién vaciados) se envían antes de cerrar;
+        # cada envío tiene su timeout, así que la espera está acotada
+        emisores.shutdown(wait=True)
         socket.close()  # Cerrar el socket
         context.term()  # Terminar el contexto de ZeroMQ
 
@@ -182,6 +450,9 @@ def main():
         p.start()  # Iniciar el proceso
         procesos.append(p)  # Agregar el proceso a la lista
 
+    # después del fork: los hijos no heredan el hilo; comparten lo que escribe en `_dti_activo`
+    threading.Thread(target=_suscriptor_health, args=(parar_evento,), daemon=True).start()
+
     # Esperar que todos los procesos terminen
     for p in procesos:
         p.join()
@@ -1,10 +1,19 @@
 import zmq
+import circuito
+import config
+import formato
+import idempotencia
+import lotes
+import metricas
 import multiprocessing
 import signal
 import sys
+import threading
 from filelock import FileLock
-import os, json
+import os, json, queue
+import random
 import time  
+import uuid
 
 # Señal de parada global para procesos hijos
 parar_evento = multiprocessing.Event()
@@ -25,11 +34,28 @@ parar_evento = multiprocessing.Event()
 ESTADO_FILE   = "resultados/estado_asignaciones.json"
 RESULTADOS_GLOB = "resultados/asignacion_completa_{semestre}.json"
 
-HEALTH_SERVICE_EP = "tcp://10.43.96.74:6000"
+HEALTH_SERVICE_EP = config.endpoint("HEALTH")
+HEALTH_PUB_EP     = config.endpoint("HEALTH_PUB")
+# Si la última publicación del health-service es más vieja que esto, se le pregunta por REQ
+HEALTH_CACHE_S    = float(os.environ.get("HEALTH_CACHE_S", "5"))
+RCVTIMEO_MS       = 30000       # espera máxima de la respuesta del DTI
+# Espera de conexión con el broker preferido cuando hay otro al cual pasar (IMMEDIATE)
+CONEXION_MS       = int(os.environ.get("CONEXION_MS", "250"))
+
+# Escritor único de resultados: se vacía al llegar a LOTE resultados o cada INTERVALO s
+ESCRITOR_LOTE      = int(os.environ.get("ESCRITOR_LOTE", "200"))
+ESCRITOR_INTERVALO = float(os.environ.get("ESCRITOR_INTERVALO", "1.0"))
+
+# Respuestas «ocupado» del broker (ver balanceo.py): cuántas veces reintentar y tope del backoff
+OCUPADO_REINTENTOS = int(os.environ.get("FACULTAD_OCUPADO_REINTENTOS", "20"))
+OCUPADO_ESPERA_MAX = float(os.environ.get("FACULTAD_OCUPADO_ESPERA_MAX", "2.0"))
+# Lotes en vuelo por facultad (0 = sin límite). Al llegar al tope la facultad deja de
+# aceptar programas hasta que termine alguno, y la presión llega hasta programas.py.
+FACULTAD_MAX_EN_VUELO = int(os.environ.get("FACULTAD_MAX_EN_VUELO", "0"))
 
 BROKERS_FRONT = [
-    "tcp://10.43.96.74:5555",   # primario
-    "tcp://10.43.103.30:5556",  # secundario
+    config.endpoint("BROKER_FRONT"),       # primario
+    config.endpoint("BROKER_SEC_FRONT"),   # secundario
 ]
 
 # Estructuras en memoria (se rellenan por cada respuesta del DTI)
@@ -42,6 +68,8 @@ end_time   = multiprocessing.Value('d', 0.0)   # Última respuesta exitosa
 time_lock  = multiprocessing.Lock()
 # ───────────────────────────────────────────────────────────────────────────────
 parar_evento = multiprocessing.Event()
+# Cola hacia el proceso escritor de resultados: (semestre, [resultados con "facultad"])
+cola_resultados = multiprocessing.Queue()
 
 
 def _ensure_dir():
@@ -92,13 +120,108 @@ def guardar_resultados_global(semestre: str) -> None:
         with open(fname, "w", encoding="utf-8") as f:
             json.dump(list(by_key.values()), f, ensure_ascii=False, indent=4)
 
+def _volcar(fname: str, datos) -> None:
+    temporal = fname + ".tmp"
+    with open(temporal, "w", encoding="utf-8") as f:
+        json.dump(datos, f, ensure_ascii=False, indent=4)
+    os.replace(temporal, fname)
+
+
+def escritor_resultados(cola, lote=ESCRITOR_LOTE, intervalo=ESCRITOR_INTERVALO):
+    """
+    Proceso único dueño de los archivos asignacion_completa_{semestre}.json.
+    Recibe resultados por `cola`, los fusiona en memoria (clave: facultad+programa)
+    y reescribe solo los semestres con cambios, por lote o por tiempo.
+    `None` en la cola indica vaciar y terminar.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)    # termina con el centinela
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    _ensure_dir()
+
+    por_semestre = {}           # { semestre: {(facultad, programa): resultado} }
+    sucios, pendientes = set(), 0
+    ultimo = time.monotonic()
+
+    def vaciar():
+        for sem in sucios:
+            _volcar(RESULTADOS_GLOB.format(semestre=sem),
+                    list(por_semestre[sem].values()))
+        sucios.clear()
+
+    while True:
+        espera = max(0.0, intervalo - (time.monotonic() - ultimo))
+        try:
+            item = cola.get(timeout=espera)
+        except queue.Empty:
+            item = ()
+
+        if item is None:
+            vaciar()
+            return
+
+        if item:
+            semestre, nuevos = item
+            if semestre not in por_semestre:
+                # primera vez: partir de lo que ya exista en disco
+                fname = RESULTADOS_GLOB.format(semestre=semestre)
+                acumulado = []
+                if os.path.exists(fname):
+                    with open(fname, "r", encoding="utf-8") as f:
+                        acumulado = json.load(f)
+                por_semestre[semestre] = {(r["facultad"], r["programa"]): r
+                                          for r in acumulado}
+            by_key = por_semestre[semestre]
+            for r in nuevos:
+                by_key[(r["facultad"], r["programa"])] = r
+            sucios.add(semestre)
+            pendientes += len(nuevos)
+
+        if pendientes >= lote or time.monotonic() - ultimo >= intervalo:
+            vaciar()
+            pendientes, ultimo = 0, time.monotonic()
+
+
+# Broker activo según el health-service, en caché local. Lo actualiza el hilo suscriptor
+# del proceso de cada facultad; los procesos emisores (fork) heredan el valor vigente.
+_activo = {"front": None, "t": 0.0}
+
+def _suscriptor_health(evento_parar):
+    ctx = zmq.Context.instance()
+    sub = ctx.socket(zmq.SUB)
+    sub.setsockopt(zmq.RCVTIMEO, 1000)
+    sub.connect(HEALTH_PUB_EP)
+    sub.setsockopt(zmq.SUBSCRIBE, b"activo")
+    while not evento_parar.is_set():
+        try:
+            _, cuerpo = sub.recv_multipart()
+        except zmq.error.Again:
+            continue
+        front = json.loads(cuerpo)["front"]
+        if front != _activo["front"]:
+            if front == BROKERS_FRONT[0]:
+                _circuito.exito(front)                   # el primario volvió
+            elif _activo["front"] == BROKERS_FRONT[0]:
+                # el health-service dejó el primario: se abre su circuito para todas las
+                # facultades y las solicitudes que lo esperaban reintentan sin agotar su timeout
+                _circuito.abrir(_activo["front"])
+        _activo["front"] = front
+        _activo["t"]     = time.monotonic()
+    sub.close()
+
+
 def _obtener_broker_front(ctx: zmq.Context) -> list[str]:
     """
     Devuelve una lista de endpoints front.
-    • Consulta al health-service: el que responda ‘vivo’ va primero.
+    • Si hay una publicación reciente del health-service, el activo va primero.
+    • Si no, consulta al health-service (responde desde su caché).
     • Si el health-service no contesta (timeout) se usa la lista fija.
     """
+    if _activo["front"] and time.monotonic() - _activo["t"] < HEALTH_CACHE_S:
+        activo = _activo["front"]
+        return [activo] + [ep for ep in BROKERS_FRONT if ep != activo]
+
     hs = ctx.socket(zmq.REQ)
+    hs.setsockopt(zmq.LINGER,      0)
     hs.setsockopt(zmq.RCVTIMEO, 1500)   # 1,5 s
     hs.setsockopt(zmq.SNDTIMEO,  500)
     hs.connect(HEALTH_SERVICE_EP)
@@ -114,29 +237,74 @@ def _obtener_broker_front(ctx: zmq.Context) -> list[str]:
         hs.close()
 
 
-def enviar_a_dti(data, start_time, end_time, time_lock):
+_negociacion = formato.Negociacion()   # formato aceptado por cada broker (WIRE_FORMATO)
+# Estado de cada broker compartido por todas las facultades (memoria compartida, creada antes del fork)
+_circuito = circuito.Interruptores(BROKERS_FRONT)
+
+
+def _espera_ocupado(rechazos: int, reintentar_ms: int) -> float:
+    """Backoff exponencial (con jitter) a partir de la sugerencia del broker."""
+    tope = min(OCUPADO_ESPERA_MAX, reintentar_ms / 1000 * 2 ** (rechazos - 1))
+    return random.uniform(tope / 2, tope)
+
+
+def enviar_a_dti(data, start_time, end_time, time_lock, cola_resultados=None):
     """
     Envía la solicitud al DTI por *todos* los brokers disponibles.
     Reintenta dos veces si nadie responde dentro del RCVTIMEO.
+    Si el broker contesta «ocupado» espera con backoff y vuelve a
+    intentar sin gastar esos dos intentos (hasta OCUPADO_REINTENTOS).
+    Si hay `cola_resultados`, los resultados se entregan al escritor único
+    en lugar de reescribir el archivo aquí.
+    Cada intento va a un solo broker: el primero de la lista cuyo circuito
+    (circuito.py) no esté abierto; un timeout lo marca para todas las
+    facultades y el reintento va directo al siguiente.
+    Todos los intentos llevan el mismo "id" (idempotencia.py): si el
+    primero sí llegó a un worker, el reintento no vuelve a descontar.
     """
+    data = {**data, "id": data.get("id") or idempotencia.nuevo_id()}
     ctx = zmq.Context.instance()
     respuesta_dti = None
-
-    for intento in (1, 2):                           # intento + reintento
-        broker_eps = _obtener_broker_front(ctx)      # ahora es LISTA
+    rechazos = 0
+    t0 = time.perf_counter()                         # incluye esperas y reintentos
+
+    fallidos = set()                                 # brokers que ya fallaron con este lote
+    intento = 0
+    while intento < 2:                               # intento + reintento
+        intento += 1
+        respuesta_dti = None
+        # el activo primero, saltando los que otra solicitud ya encontró caídos
+        candidatos = _circuito.candidatos(_obtener_broker_front(ctx))
+        candidatos = [ep for ep in candidatos if ep not in fallidos] or candidatos
+        broker = next((ep for ep in candidatos if _circuito.permitir(ep)), candidatos[-1])
 
         sock = ctx.socket(zmq.REQ)
+        # identidad «facultad#id»: el broker limita en vuelo por facultad
+        sock.setsockopt(zmq.ROUTING_ID,
+                        f"{data['facultad']}#{uuid.uuid4().hex[:8]}".encode("utf-8"))
         sock.setsockopt(zmq.LINGER,    0)            # cierra sin bloquear
         sock.setsockopt(zmq.IMMEDIATE, 1)            # falla rápido si no hay peer
-        sock.setsockopt(zmq.RCVTIMEO, 30000)         # 30 s espera respuesta DTI
-        sock.setsockopt(zmq.SNDTIMEO,  3000)         # 3 s envío
+        sock.setsockopt(zmq.RCVTIMEO, RCVTIMEO_MS)   # 30 s espera respuesta DTI
+        # 3 s envío; si hay otro broker, un peer que no completa la conexión se abandona antes
+        sock.setsockopt(zmq.SNDTIMEO, CONEXION_MS if len(candidatos) > 1 else 3000)
 
-        for ep in broker_eps:                        # 🔗 conecta a TODOS
-            sock.connect(ep)
+        sock.connect(broker)
 
         try:
-            sock.send_json(data)
-            respuesta_dti = sock.recv_json()         # puede lanzar Again
+            # puede lanzar Again; codifica según WIRE_FORMATO
+            respuesta_dti = _negociacion.intercambiar(sock, broker, data,
+                                                      _circuito.esperador(broker, RCVTIMEO_MS))
+            _circuito.exito(broker)                  # «ocupado» también prueba que está vivo
+
+            if respuesta_dti.get("status") == "ocupado":
+                if rechazos >= OCUPADO_REINTENTOS:
+                    break
+                rechazos += 1
+                intento -= 1                         # un rechazo no gasta intento
+                time.sleep(_espera_ocupado(rechazos, respuesta_dti.get("reintentar_ms", 100)))
+                continue
+            metricas.registrar_latencia("facultad_broker", time.perf_counter() - t0,
+                                        len(data["programas"]))
 
             # ─ cronómetro ───────────────────────────────────────────────
             with time_lock:
@@ -148,8 +316,10 @@ def enviar_a_dti(data, start_time, end_time, time_lock):
             break                                    # ✅ éxito
 
         except zmq.error.Again:
+            _circuito.fallo(broker)
+            fallidos.add(broker)
             print(f"[Facultad {data['facultad']}] "
-                  f"Ningún broker respondió (intento {intento}).")
+                  f"El broker {broker} no respondió (intento {intento}).")
         finally:
             sock.close()
 
@@ -157,18 +327,28 @@ def enviar_a_dti(data, start_time, end_time, time_lock):
         print(f"[Facultad {data['facultad']}] "
               f"No se obtuvo respuesta de ningún broker.")
         return                              # o raise, según convenga
+    if respuesta_dti.get("status") == "ocupado":
+        print(f"[Facultad {data['facultad']}] "
+              f"Broker ocupado tras {rechazos} reintentos; se descarta el lote.")
+        return
 
     # --------------- actualizar estructuras -----------------
     semestre = data["semestre"]
     clave    = f"{data['facultad']}_{semestre}"
-    resultados_asignacion.setdefault(clave, []).extend(respuesta_dti["resultado"])
+    # un resultado por cada programa del lote
+    del_lote = lotes.resultados_del_lote(respuesta_dti["resultado"], data["programas"])
+    resultados_asignacion.setdefault(clave, []).extend(del_lote)
     estado_asignaciones[semestre] = respuesta_dti["estado"]
-    guardar_resultados_global(semestre)
+    if cola_resultados is not None:
+        cola_resultados.put((semestre, [{**r, "facultad": data["facultad"]}
+                                        for r in del_lote]))
+    else:
+        guardar_resultados_global(semestre)
 
     respuesta_transformada = {
             "status": "ok",
             "mensaje": f"Asignación completada para {data['facultad']} - Semestre {data['semestre']}",
-            "resultados": respuesta_dti.get("resultado", []),
+            "resultados": del_lote,
             "estado": respuesta_dti.get("estado", {})
         }
 
@@ -185,6 +365,13 @@ def enviar_a_dti(data, start_time, end_time, time_lock):
 
 
 
+def _enviar_con_cupo(cupos, *args):
+    try:
+        enviar_a_dti(*args)
+    finally:
+        cupos.release()
+
+
 # Función: manejar_programas_facultad
 # Parámetros:
 #   - facultad (str): El nombre de la facultad.
@@ -194,22 +381,50 @@ def enviar_a_dti(data, start_time, end_time, time_lock):
 # Funcionalidad:
 # Esta función se encarga de manejar las solicitudes que llegan a la facultad en el puerto especificado. 
 # Recibe los datos de los programas a través de un socket de tipo REP (reply) y procesa cada programa.
-# Si los datos del programa son válidos, envía la solicitud a DTI usando `enviar_a_dti` en un proceso hijo.
+# Si los datos del programa son válidos, lo acumula con los demás programas del mismo semestre (`lotes.py`)
+# y, al llenarse el lote o vencer su ventana, envía una sola solicitud a DTI usando `enviar_a_dti` en un
+# proceso hijo.
 # La función se ejecuta en un bucle hasta que se reciba una señal de parada.
 #
 # Uso de recursos:
 # - Utiliza un socket de tipo REP para recibir las solicitudes.
-# - Cada solicitud procesada genera un nuevo proceso para llamar a `enviar_a_dti`.
+# - Cada solicitud procesada genera un nuevo proceso para llamar a `enviar_a_dti`; con
+#   FACULTAD_MAX_EN_VUELO > 0 un semáforo limita cuántos hay a la vez.
+# - Ignora SIGINT/SIGTERM (y así también sus emisores): el cierre lo coordina `main` con `evento_parar`,
+#   y el proceso no termina hasta que sus emisores entregan lo que llevan.
 def manejar_programas_facultad(facultad, puerto, evento_parar):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)     # solo el padre envía el centinela al escritor
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
     context = zmq.Context()  # Crear contexto de ZeroMQ
     socket = context.socket(zmq.REP)  # Crear socket de tipo REP
-    socket.bind(f"tcp://*:{puerto}")  # Vincular el socket al puerto
+    socket.bind(config.facultad(puerto, bind=True))  # Vincular el socket al puerto
 
     print(f"[{facultad}] Esperando solicitudes en puerto {puerto}...")
+    threading.Thread(target=_suscriptor_health, args=(evento_parar,), daemon=True).start()
+
+    pendientes = {}   # programas acumulados por semestre (ver lotes.py)
+    cupos = (multiprocessing.BoundedSemaphore(FACULTAD_MAX_EN_VUELO)
+             if FACULTAD_MAX_EN_VUELO > 0 else None)
+
+    def despachar(semestre, programas):
+        # Preparar los datos para enviar a DTI (un lote de programas del mismo semestre)
+        data = {
+            "programas": programas,
+            "facultad": facultad,
+            "semestre": semestre
+        }
+        args = (data, start_time, end_time, time_lock, cola_resultados)
+        if cupos is not None:
+            cupos.acquire()              # bloquea: no se aceptan más programas mientras tanto
+            p = multiprocessing.Process(target=_enviar_con_cupo, args=(cupos, *args))
+        else:
+            p = multiprocessing.Process(target=enviar_a_dti, args=args)
+        p.start()
 
     try:
         while not evento_parar.is_set():  # Mientras el evento de parada no esté activado
-            if socket.poll(timeout=1000):  # Esperar 1 segundo para nuevas solicitudes
+            # Esperar hasta 1 segundo, o menos si vence la ventana de algún lote
+            if socket.poll(timeout=lotes.espera_ms(pendientes, 1000)):
                 mensaje = socket.recv_json()  # Recibir mensaje de la facultad
                 semestre = mensaje.get('semestre')
                 programa = mensaje.get('programa')
@@ -224,17 +439,15 @@ def manejar_programas_facultad(facultad, puerto, evento_parar):
                     "mensaje": f"Programa '{programa.get('nombre')}' procesado en {facultad}"
                 })
 
-                # Preparar los datos para enviar a DTI
-                data = {
-                    "programas": [programa],
-                    "facultad": facultad,
-                    "semestre": semestre
-                }
-                p = multiprocessing.Process(
-                    target=enviar_a_dti,
-                    args=(data, start_time, end_time, time_lock)
-                )
-                p.start()
+                lote = lotes.agregar(pendientes, semestre, programa)
+                if lote:
+                    despachar(semestre, lote)
+
+            for semestre, lote in lotes.vencidos(pendientes):
+                despachar(semestre, lote)
+
+        for semestre, lote in lotes.vaciar(pendientes):   # lo que quedó al parar
+            despachar(semestre, lote)
     except Exception as e:
         print(f"[{facultad}] Error en el servidor: {e}")
     finally:
@@ -268,9 +481,15 @@ def main():
 
     procesos = []  # Lista de procesos que se van a ejecutar
 
+    escritor = multiprocessing.Process(target=escritor_resultados,
+                                       args=(cola_resultados,))
+    escritor.start()
+
     def cerrar_todo(sig, _):
         parar_evento.set()
         for p in procesos: p.join()
+        cola_resultados.put(None)          # vaciar lo pendiente y terminar
+        escritor.join()
         # ─── Mostrar duración total ─────────────────────────────────────────
         dur = end_time.value - start_time.value
         if start_time.value and dur >= 0:
@@ -288,6 +507,8 @@ def main():
         p.start(); procesos.append(p)
 
     for p in procesos: p.join()
+    cola_resultados.put(None)
+    escritor.join()
 
 
 if __name__ == "__main__":
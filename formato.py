@@ -0,0 +1,251 @@
+"""
+Formato compacto y versionado para los mensajes del camino caliente
+(solicitud de un lote al DTI y su respuesta), con JSON como respaldo.
+
+Cada mensaje compacto empieza con MAGIA y el número de versión; uno JSON
+empieza con "{", así que el receptor reconoce los dos sin configuración.
+El servidor contesta en el mismo formato en que le llegó la solicitud.
+El cliente elige con WIRE_FORMATO=json|compacto; si el servidor no
+entiende el compacto (versión vieja) contesta un error JSON, el cliente
+reenvía en JSON y recuerda ese endpoint como solo-JSON (ver `Negociacion`).
+
+Disposición por columnas (big-endian; cadena = u16 longitud + UTF-8,
+lista = u32 longitud + UTF-8 con las cadenas separadas por NUL):
+  cabecera   u8 magia | u8 versión | u8 tipo
+  SOLICITUD  facultad | semestre | u16 n | lista nombres | n × (u16 salones, u16 labs)
+  SOLICITUD_ID  id | lo mismo que SOLICITUD (lote con id de idempotencia, ver
+             idempotencia.py; un servidor que no conoce el tipo contesta el error
+             "no_soportado" y el cliente reenvía en JSON)
+  RESPUESTA  i32 salones_disp | i32 labs_disp | u8 modo_facultad [| facultad]
+             | u32 n | lista programas [| lista facultades] | n × 5 u16
+Los números van juntos en un solo bloque que se empaqueta y desempaqueta
+de una vez. Los 5 u16 son: salones_solicitados, laboratorios_solicitados,
+salones_asignados, laboratorios_asignados y salones_como_laboratorios
+(0xFFFF = ausente). La facultad, que antes se repetía en cada resultado,
+va una sola vez cuando es la misma para todos.
+"""
+
+import json, os, struct
+
+FORMATO = os.environ.get("WIRE_FORMATO", "json")    # json | compacto
+
+MAGIA   = 0xA5
+VERSION = 1
+SOLICITUD, RESPUESTA, SOLICITUD_ID = 1, 2, 3
+
+_CABECERA = struct.Struct(">BBB")
+_U16      = struct.Struct(">H")
+_U32      = struct.Struct(">I")
+_PROGRAMA = struct.Struct(">HH")
+_ESTADO   = struct.Struct(">iiB")
+_NUMEROS  = struct.Struct(">HHHHH")
+_AUSENTE  = 0xFFFF
+_SEP      = "\x00"
+
+SIN_FACULTAD, FACULTAD_COMUN, FACULTAD_POR_RESULTADO = 0, 1, 2
+
+_CLAVES_SOLICITUD = {"facultad", "semestre", "programas"}
+_CLAVES_SOLICITUD_ID = _CLAVES_SOLICITUD | {"id"}
+_CLAVES_RESPUESTA = {"resultado", "estado"}
+
+
+class FormatoNoSoportado(ValueError):
+    pass
+
+# ------------------------------------------------------------------ #
+def _cadena(partes, texto):
+    datos = texto.encode("utf-8")
+    partes.append(_U16.pack(len(datos)))
+    partes.append(datos)
+
+def _leer_cadena(datos, pos):
+    (n,) = _U16.unpack_from(datos, pos)
+    pos += 2
+    return datos[pos:pos + n].decode("utf-8"), pos + n
+
+def _lista(partes, textos):
+    """Varias cadenas en un solo bloque (u32 longitud + UTF-8 separadas por NUL)."""
+    datos = _SEP.join(textos).encode("utf-8")
+    partes.append(_U32.pack(len(datos)))
+    partes.append(datos)
+
+def _leer_lista(datos, pos, n):
+    (largo,) = _U32.unpack_from(datos, pos)
+    pos += 4
+    if not n:
+        return [], pos + largo
+    return datos[pos:pos + largo].decode("utf-8").split(_SEP), pos + largo
+
+def _codificar_solicitud(msg):
+    programas = msg["programas"]
+    if "id" in msg:
+        partes = [_CABECERA.pack(MAGIA, VERSION, SOLICITUD_ID)]
+        _cadena(partes, msg["id"])
+    else:
+        partes = [_CABECERA.pack(MAGIA, VERSION, SOLICITUD)]
+    _cadena(partes, msg["facultad"])
+    _cadena(partes, msg["semestre"])
+    partes.append(_U16.pack(len(programas)))
+    _lista(partes, [p["nombre"] for p in programas])
+    partes.append(struct.pack(f">{2 * len(programas)}H",
+                              *[v for p in programas for v in (p["salones"], p["laboratorios"])]))
+    return b"".join(partes)
+
+def _codificar_respuesta(msg):
+    resultados = msg["resultado"]
+    estado = msg["estado"]
+    facultades = {r.get("facultad") for r in resultados}
+    if facultades == {None} or not resultados:
+        modo = SIN_FACULTAD
+    elif len(facultades) == 1:
+        modo = FACULTAD_COMUN
+    else:
+        modo = FACULTAD_POR_RESULTADO
+
+    partes = [_CABECERA.pack(MAGIA, VERSION, RESPUESTA),
+              _ESTADO.pack(estado["salones_disponibles"],
+                           estado["laboratorios_disponibles"], modo)]
+    if modo == FACULTAD_COMUN:
+        _cadena(partes, resultados[0]["facultad"])
+    partes.append(_U32.pack(len(resultados)))
+    _lista(partes, [r["programa"] for r in resultados])
+    if modo == FACULTAD_POR_RESULTADO:
+        _lista(partes, [r.get("facultad") or "" for r in resultados])
+    partes.append(struct.pack(f">{5 * len(resultados)}H", *[
+        v for r in resultados for v in (
+            r["salones_solicitados"], r["laboratorios_solicitados"],
+            r["salones_asignados"], r["laboratorios_asignados"],
+            r.get("salones_como_laboratorios", _AUSENTE))]))
+    return b"".join(partes)
+
+def _decodificar_solicitud(datos, pos, con_id=False):
+    if con_id:
+        id_solicitud, pos = _leer_cadena(datos, pos)
+    facultad, pos = _leer_cadena(datos, pos)
+    semestre, pos = _leer_cadena(datos, pos)
+    (n,) = _U16.unpack_from(datos, pos)
+    nombres, pos = _leer_lista(datos, pos + 2, n)
+    numeros = _PROGRAMA.iter_unpack(datos[pos:pos + n * _PROGRAMA.size])
+    programas = [{"nombre": nombre, "salones": salones, "laboratorios": labs}
+                 for nombre, (salones, labs) in zip(nombres, numeros)]
+    msg = {"facultad": facultad, "semestre": semestre, "programas": programas}
+    if con_id:
+        msg["id"] = id_solicitud
+    return msg
+
+def _decodificar_respuesta(datos, pos):
+    salones, labs, modo = _ESTADO.unpack_from(datos, pos)
+    pos += _ESTADO.size
+    comun = None
+    if modo == FACULTAD_COMUN:
+        comun, pos = _leer_cadena(datos, pos)
+    (n,) = _U32.unpack_from(datos, pos)
+    programas, pos = _leer_lista(datos, pos + 4, n)
+    if modo == FACULTAD_POR_RESULTADO:
+        facultades, pos = _leer_lista(datos, pos, n)
+    else:
+        facultades = [comun] * n
+    numeros = _NUMEROS.iter_unpack(datos[pos:pos + n * _NUMEROS.size])
+
+    resultados = []
+    for programa, facultad, (ss, ls, sa, la, scl) in zip(programas, facultades, numeros):
+        r = {"programa": programa, "salones_solicitados": ss, "laboratorios_solicitados": ls,
+             "salones_asignados": sa, "laboratorios_asignados": la}
+        if facultad is not None:
+            r["facultad"] = facultad
+        if scl != _AUSENTE:
+            r["salones_como_laboratorios"] = scl
+        resultados.append(r)
+    return {"resultado": resultados,
+            "estado": {"salones_disponibles": salones, "laboratorios_disponibles": labs}}
+
+# ------------------------------------------------------------------ #
+def es_compacto(datos: bytes) -> bool:
+    return bool(datos) and datos[0] == MAGIA
+
+def codificar(msg: dict, formato: str = None) -> bytes:
+    """Serializa `msg`; en formato compacto solo los mensajes con disposición fija (el resto, JSON)."""
+    if (formato or FORMATO) == "compacto":
+        claves = set(msg)
+        if claves == _CLAVES_SOLICITUD or claves == _CLAVES_SOLICITUD_ID:
+            return _codificar_solicitud(msg)
+        if claves == _CLAVES_RESPUESTA:
+            return _codificar_respuesta(msg)
+    return json.dumps(msg).encode("utf-8")
+
+def decodificar(datos: bytes) -> dict:
+    """Acepta JSON o compacto; FormatoNoSoportado si la versión o el tipo no se conocen."""
+    if not es_compacto(datos):
+        return json.loads(datos)
+    _, version, tipo = _CABECERA.unpack_from(datos, 0)
+    if version != VERSION:
+        raise FormatoNoSoportado(f"versión de formato {version} no soportada (se habla {VERSION})")
+    if tipo == SOLICITUD:
+        return _decodificar_solicitud(datos, _CABECERA.size)
+    if tipo == SOLICITUD_ID:
+        return _decodificar_solicitud(datos, _CABECERA.size, con_id=True)
+    if tipo == RESPUESTA:
+        return _decodificar_respuesta(datos, _CABECERA.size)
+    raise FormatoNoSoportado(f"tipo de mensaje {tipo} desconocido")
+
+def responder(solicitud: bytes, respuesta: dict) -> bytes:
+    """Codifica `respuesta` en el mismo formato en que llegó `solicitud`."""
+    return codificar(respuesta, "compacto" if es_compacto(solicitud) else "json")
+
+def error(mensaje: str, no_soportado: bool = False) -> bytes:
+    """Los errores siempre viajan en JSON: los entiende cualquier versión."""
+    msg = {"status": "error", "mensaje": mensaje}
+    if no_soportado:
+        msg["formato"] = "no_soportado"
+        msg["versiones"] = [VERSION]
+    return json.dumps(msg).encode("utf-8")
+
+
+class Negociacion:
+    """
+    Recuerda por endpoint qué formato acepta el servidor. Se parte de
+    WIRE_FORMATO; si un servidor contesta un error JSON a una solicitud
+    compacta, ese endpoint pasa a JSON y el llamador reenvía.
+    """
+    def __init__(self, formato: str = None):
+        self.formato = formato or FORMATO
+        self.solo_json = set()
+        self.confirmados = set()     # ya contestaron en compacto: un error ahí es un error real
+
+    def formato_para(self, endpoint) -> str:
+        return "json" if endpoint in self.solo_json else self.formato
+
+    def rechazado(self, endpoint, enviado: bytes, recibido: bytes) -> bool:
+        """True si hay que reenviar en JSON (y desde ahora se usa JSON con `endpoint`)."""
+        if not es_compacto(enviado):
+            return False
+        if es_compacto(recibido):
+            self.confirmados.add(endpoint)
+            return False
+        try:
+            resp = json.loads(recibido)
+        except ValueError:
+            resp = {"status": "error"}
+        # un servidor que no conoce el formato (o esta versión) contesta un error JSON
+        if resp.get("status") == "error" and (resp.get("formato") == "no_soportado"
+                                              or endpoint not in self.confirmados):
+            self.solo_json.add(endpoint)
+            return True
+        return False
+
+    def intercambiar(self, sock, endpoint, msg: dict, esperar=None) -> dict:
+        """
+        Envía `msg` por un REQ ya conectado y devuelve la respuesta decodificada.
+        `esperar(sock)`, si se da, se llama antes de cada recv (puede lanzar zmq.Again).
+        """
+        datos = codificar(msg, self.formato_para(endpoint))
+        sock.send(datos)
+        if esperar:
+            esperar(sock)
+        recibido = sock.recv()
+        if self.rechazado(endpoint, datos, recibido):
+            sock.send(codificar(msg, "json"))
+            if esperar:
+                esperar(sock)
+            recibido = sock.recv()
+        return decodificar(recibido)
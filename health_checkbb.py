@@ -3,18 +3,31 @@
 Devuelve la dirección del broker activo.
    • recibe   "front"  → responde ep ROUTER  (clientes)
    • recibe   "back"   → responde ep DEALER  (workers DTI)
+
+Un hilo de heartbeat sondea al primario cada HEALTH_INTERVALO_MS y guarda
+el broker activo; las consultas REP se contestan desde ese estado sin
+esperar ningún ping. Cada cambio (y, como recordatorio, cada latido) se
+publica en HEALTH_PUB como [b"activo", {"front", "back", "version"}] para
+que los clientes se suscriban y no pregunten por solicitud.
 """
 
-import zmq, time
+import json, os, threading, time
+import zmq
+import config
 
 # --- direcciones fijas -------------------------------------------------------
-PRIMARY_HB   = "tcp://10.43.96.74:5570"   # puerto heartbeat broker primario
-PRIMARY_FRT  = "tcp://10.43.96.74:5555"
-PRIMARY_BCK  = "tcp://10.43.96.74:5560"
+PRIMARY_HB   = config.endpoint("BROKER_HB")       # heartbeat broker primario
+PRIMARY_FRT  = config.endpoint("BROKER_FRONT")
+PRIMARY_BCK  = config.endpoint("BROKER_BACK")
+
+SECONDARY_HB = config.endpoint("BROKER_SEC_HB")   # heartbeat broker respaldo
+SECONDARY_FRT= config.endpoint("BROKER_SEC_FRONT")
+SECONDARY_BCK= config.endpoint("BROKER_SEC_BACK")
 
-SECONDARY_HB = "tcp://10.43.103.30:5571"  # puerto heartbeat broker respaldo
-SECONDARY_FRT= "tcp://10.43.103.30:5556"
-SECONDARY_BCK= "tcp://10.43.103.30:5561"
+HEALTH_INTERVALO_MS = int(os.environ.get("HEALTH_INTERVALO_MS", "500"))
+HEALTH_TIMEOUT_MS   = int(os.environ.get("HEALTH_TIMEOUT_MS", "1000"))
+# Fallos seguidos del primario antes de pasar al secundario
+HEALTH_FALLOS       = int(os.environ.get("HEALTH_FALLOS", "2"))
 
 # --- helper: ping ------------------------------------------------------------
 def vivo(addr: str, timeout_ms: int = 1000) -> bool:
@@ -32,17 +45,52 @@ def vivo(addr: str, timeout_ms: int = 1000) -> bool:
     finally:
         s.close()
 
+# --- estado en caché ---------------------------------------------------------
+# (front, back, version); se reemplaza la tupla entera, así los lectores no necesitan candado
+activo = (PRIMARY_FRT, PRIMARY_BCK, 0)
+
+def heartbeat(pub, intervalo_ms: int = HEALTH_INTERVALO_MS, fallos: int = HEALTH_FALLOS):
+    """Sondea al primario, actualiza `activo` y lo publica."""
+    global activo
+    seguidos = 0
+    while True:
+        inicio = time.monotonic()
+        if vivo(PRIMARY_HB, HEALTH_TIMEOUT_MS):
+            seguidos = 0
+            front, back = PRIMARY_FRT, PRIMARY_BCK
+        else:
+            seguidos += 1
+            front, back = activo[:2]
+            if seguidos >= fallos:
+                front, back = SECONDARY_FRT, SECONDARY_BCK
+
+        if (front, back) != activo[:2]:
+            activo = (front, back, activo[2] + 1)
+            print(f"[Health] Broker activo → {front} (versión {activo[2]})", flush=True)
+        pub.send_multipart([b"activo", json.dumps(
+            {"front": activo[0], "back": activo[1], "version": activo[2]}).encode("utf-8")])
+
+        time.sleep(max(0.0, intervalo_ms / 1000 - (time.monotonic() - inicio)))
+
 # --- bucle REP ---------------------------------------------------------------
-ctx  = zmq.Context()
-rep  = ctx.socket(zmq.REP)
-rep.bind("tcp://*:6000")
-print("[Health] Servicio activo en tcp://*:6000")
-
-while True:
-    what = rep.recv_string()          # «front» o «back»
-    primary_ok = vivo(PRIMARY_HB)
-    if primary_ok:
-        front, back = PRIMARY_FRT, PRIMARY_BCK
-    else:
-        front, back = SECONDARY_FRT, SECONDARY_BCK
-    rep.send_string(front if what == "front" else back)
+HEALTH_BIND     = config.endpoint("HEALTH", bind=True)
+HEALTH_PUB_BIND = config.endpoint("HEALTH_PUB", bind=True)
+
+def servicio(bind: str = None, pub_bind: str = None):
+    bind     = bind or HEALTH_BIND
+    pub_bind = pub_bind or HEALTH_PUB_BIND
+    ctx  = zmq.Context()
+    rep  = ctx.socket(zmq.REP)
+    rep.bind(bind)
+    pub  = ctx.socket(zmq.PUB)
+    pub.bind(pub_bind)
+    threading.Thread(target=heartbeat, args=(pub,), daemon=True).start()
+    print(f"[Health] Servicio activo en {bind}, publicando en {pub_bind}")
+
+    while True:
+        what = rep.recv_string()          # «front» o «back»
+        front, back, _ = activo           # estado en caché: sin ping por consulta
+        rep.send_string(front if what == "front" else back)
+
+if __name__ == "__main__":
+    servicio()
@@ -0,0 +1,100 @@
+"""
+Solicitudes idempotentes: cada lote lleva un "id" generado por el cliente
+(facultades.py / facultades_broker.py) que se conserva en los reintentos,
+en la copia de cobertura y al pasar de un DTI o broker a otro. Quien lo
+atiende recuerda los ids ya aplicados y contesta los repetidos sin volver
+a descontar salones.
+
+CacheLRU acota lo recordado por cantidad (se descarta el usado hace más
+tiempo) y por edad (IDEMPOTENCIA_TTL_S); los reintentos llegan segundos
+después del original, así que basta con una ventana corta.
+  • IDEMPOTENCIA_CAPACIDAD  ids aplicados (valores pequeños)
+  • IDEMPOTENCIA_RESPUESTAS respuestas completas para contestar sin candado
+                            (crecen con la historia de la facultad: menos)
+  • IDEMPOTENCIA_BD=0       los dti_worker no registran los ids en recursos.db:
+                            solo se detecta el repetido que vuelve al mismo worker
+"""
+
+import collections, os, threading, time, uuid
+
+IDEMPOTENCIA_CAPACIDAD  = int(os.environ.get("IDEMPOTENCIA_CAPACIDAD", "100000"))
+IDEMPOTENCIA_RESPUESTAS = int(os.environ.get("IDEMPOTENCIA_RESPUESTAS", "1024"))
+IDEMPOTENCIA_TTL_S      = float(os.environ.get("IDEMPOTENCIA_TTL_S", "600"))
+IDEMPOTENCIA_BD         = os.environ.get("IDEMPOTENCIA_BD", "1") == "1"
+
+
+def nuevo_id() -> str:
+    return uuid.uuid4().hex
+
+
+class CacheLRU:
+    """Diccionario acotado por tamaño y edad, seguro entre hilos."""
+    def __init__(self, capacidad: int = IDEMPOTENCIA_CAPACIDAD,
+                 ttl_s: float = IDEMPOTENCIA_TTL_S):
+        self.capacidad = capacidad
+        self.ttl       = ttl_s
+        self.datos     = collections.OrderedDict()   # clave → (instante, valor), del más viejo al más nuevo
+        self.lock      = threading.Lock()
+
+    def _vigente(self, clave, ahora):
+        entrada = self.datos.get(clave)
+        if entrada is None:
+            return None
+        if ahora - entrada[0] > self.ttl:
+            del self.datos[clave]
+            return None
+        self.datos.move_to_end(clave)
+        return entrada
+
+    def _poner(self, clave, valor, ahora):
+        self.datos[clave] = (ahora, valor)
+        self.datos.move_to_end(clave)
+        while len(self.datos) > self.capacidad:
+            self.datos.popitem(last=False)
+
+    def obtener(self, clave, defecto=None):
+        with self.lock:
+            entrada = self._vigente(clave, time.monotonic())
+            return defecto if entrada is None else entrada[1]
+
+    def guardar(self, clave, valor=True):
+        with self.lock:
+            self._poner(clave, valor, time.monotonic())
+
+    def agregar_si_falta(self, clave, valor=True) -> bool:
+        """True si `clave` no estaba (y ahora sí); False si es un repetido vigente."""
+        with self.lock:
+            ahora = time.monotonic()
+            if self._vigente(clave, ahora) is not None:
+                return False
+            self._poner(clave, valor, ahora)
+            return True
+
+    def agregar_antiguos(self, pares):
+        """
+        Agrega los pares (clave, valor), dados del más viejo al más nuevo, como
+        los más viejos de la caché: no desplazan a las claves ya presentes y,
+        si no caben todos, se quedan los más nuevos. A una clave presente
+        solo con el valor por defecto (True) se le completa el valor sin moverla.
+        """
+        with self.lock:
+            ahora = time.monotonic()
+            for clave, valor in reversed(list(pares)):
+                entrada = self.datos.get(clave)
+                if entrada is not None:
+                    if entrada[1] is True:
+                        self.datos[clave] = (entrada[0], valor)
+                    continue
+                if len(self.datos) >= self.capacidad:
+                    continue
+                self.datos[clave] = (ahora, valor)
+                self.datos.move_to_end(clave, last=False)
+
+    def claves(self) -> list:
+        """Las claves vigentes, de la más vieja a la más nueva."""
+        with self.lock:
+            ahora = time.monotonic()
+            return [c for c, (t, _) in self.datos.items() if ahora - t <= self.ttl]
+
+    def __len__(self):
+        return len(self.datos)
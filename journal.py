@@ -0,0 +1,280 @@
+"""
+Diario (journal) de asignaciones del DTI, solo de anexado (JSONL).
+
+Cada evento es una línea JSON. Un hilo escritor agrupa los eventos
+pendientes, los escribe de una vez y hace un único fsync por grupo
+(group-commit), de modo que el costo por solicitud es O(1) sin
+importar cuánta historia lleve el DTI.
+
+Las posiciones son lógicas (bytes desde el primer evento de la vida del
+diario) y no cambian al recortarlo. Cuando un snapshot ya es durable,
+`truncar(posicion)` pasa los eventos anteriores a HISTORIAL_FILE, que
+solo se lee para reconstruir el historial de resultados, y deja en el
+diario solo la cola; así el diario no crece sin límite. El diario
+recortado empieza con una línea {"base": posicion}; cada traspaso al
+historial termina con una línea {"hasta": posicion}, y lo que quede
+después de la última (una caída a mitad del traspaso) se descarta.
+"""
+
+import json, os, threading, time
+
+JOURNAL_FILE   = "resultados/journal.jsonl"
+HISTORIAL_FILE = "resultados/journal.historial.jsonl"
+INTERVALO_MS   = int(os.environ.get("JOURNAL_INTERVALO_MS", "5"))
+# Máximo que `esperar` aguarda el fsync antes de rendirse (el disco o el escritor no responden)
+ESPERA_S       = float(os.environ.get("JOURNAL_ESPERA_S", "30"))
+
+_cond      = threading.Condition()
+_pendiente = []             # líneas aún no escritas y, entre ellas, pedidos de recorte
+_seq       = 0              # último número de secuencia asignado
+_durable   = 0              # último número de secuencia con fsync hecho
+_bytes     = 0              # posición lógica del final del diario (incluye pendientes)
+_archivo   = None
+_ruta      = JOURNAL_FILE
+_historial = HISTORIAL_FILE
+_base      = 0              # posición lógica del primer evento del archivo
+_inicio    = 0              # bytes de la cabecera {"base": …} (0 si no la tiene)
+_error     = None           # excepción con la que murió el hilo escritor
+
+class _Recorte:
+    def __init__(self, posicion):
+        self.posicion = posicion
+
+# ------------------------------------------------------------------ #
+def abrir(ruta: str = JOURNAL_FILE, truncar: bool = False,
+          historial: str = HISTORIAL_FILE):
+    """Abre el diario y arranca el hilo escritor (una vez por proceso)."""
+    global _archivo, _bytes, _ruta, _historial, _base, _inicio
+    os.makedirs(os.path.dirname(ruta) or ".", exist_ok=True)
+    with _cond:
+        if _archivo is not None:
+            return
+        _ruta, _historial = ruta, historial
+        if truncar:
+            if os.path.exists(historial):
+                os.remove(historial)
+        else:
+            reparar(ruta, historial)
+        _base, _inicio = (0, 0) if truncar else _cabecera(ruta)
+        _archivo = open(ruta, "wb" if truncar else "ab")
+        _bytes   = _base + _archivo.tell() - _inicio
+    threading.Thread(target=_escritor, daemon=True).start()
+
+def _fin_completo(f) -> int:
+    """Posición justo después del último salto de línea de `f` (0 si no hay)."""
+    pos = f.seek(0, os.SEEK_END)
+    while pos > 0:
+        paso = min(4096, pos)
+        f.seek(pos - paso)
+        bloque = f.read(paso)
+        i = bloque.rfind(b"\n")
+        if i >= 0:
+            return pos - paso + i + 1
+        pos -= paso
+    return 0
+
+def _inicio_ultima(f, fin: int) -> int:
+    """Posición donde empieza la línea que termina en `fin`."""
+    pos = fin - 1
+    while pos > 0:
+        paso = min(4096, pos)
+        f.seek(pos - paso)
+        bloque = f.read(paso)
+        i = bloque.rfind(b"\n")
+        if i >= 0:
+            return pos - paso + i + 1
+        pos -= paso
+    return 0
+
+def reparar(ruta: str = JOURNAL_FILE, historial: str = HISTORIAL_FILE):
+    """
+    Recorta una última línea incompleta (p. ej. tras una caída a mitad de
+    escritura) y, en el historial, lo escrito después de la última marca.
+    """
+    if os.path.exists(ruta):
+        with open(ruta, "rb+") as f:
+            fin = _fin_completo(f)
+            if fin != f.seek(0, os.SEEK_END):
+                f.truncate(fin)
+    if os.path.exists(historial):
+        with open(historial, "rb+") as f:
+            fin = _fin_completo(f)
+            while fin > 0:
+                inicio = _inicio_ultima(f, fin)
+                f.seek(inicio)
+                if "hasta" in json.loads(f.read(fin - inicio)):
+                    break
+                fin = inicio
+            if fin != f.seek(0, os.SEEK_END):
+                f.truncate(fin)
+
+def _cabecera(ruta: str) -> tuple:
+    """(base, bytes de cabecera) del diario en `ruta`; (0, 0) si no está recortado."""
+    if not os.path.exists(ruta):
+        return 0, 0
+    with open(ruta, "rb") as f:
+        linea = f.readline()
+    if linea.endswith(b"\n"):
+        cabecera = json.loads(linea)
+        if set(cabecera) == {"base"}:
+            return cabecera["base"], len(linea)
+    return 0, 0
+
+def leer(ruta: str = JOURNAL_FILE, desde: int = 0, hasta: int = None):
+    """Itera los eventos del diario entre las posiciones lógicas `desde` y `hasta`."""
+    if not os.path.exists(ruta):
+        return
+    base, inicio = _cabecera(ruta)
+    with open(ruta, "rb") as f:
+        pos = max(desde, base)          # lo anterior a `base` ya está en el historial
+        f.seek(inicio + pos - base)
+        for linea in f:
+            if hasta is not None and pos >= hasta:
+                break
+            if not linea.endswith(b"\n"):   # línea incompleta al final
+                break
+            pos += len(linea)
+            yield json.loads(linea)
+
+def leer_historial(ruta: str = HISTORIAL_FILE):
+    """Itera los eventos ya traspasados al historial (anteriores a `fin_historial()`)."""
+    if not os.path.exists(ruta):
+        return
+    with open(ruta, "rb") as f:
+        for linea in f:
+            if not linea.endswith(b"\n"):
+                break
+            evento = json.loads(linea)
+            if "hasta" not in evento:
+                yield evento
+
+def fin_historial(ruta: str = HISTORIAL_FILE) -> int:
+    """Posición lógica hasta la que llega el historial (0 si está vacío)."""
+    if not os.path.exists(ruta):
+        return 0
+    with open(ruta, "rb") as f:
+        fin = _fin_completo(f)
+        if fin == 0:
+            return 0
+        inicio = _inicio_ultima(f, fin)
+        f.seek(inicio)
+        return json.loads(f.read(fin - inicio)).get("hasta", 0)
+
+def posicion() -> tuple:
+    """(seq, bytes) del último evento encolado; sirve para marcar un snapshot."""
+    with _cond:
+        return _seq, _bytes
+
+def registrar(eventos: list) -> int:
+    """
+    Encola `eventos` (dicts) y devuelve su número de secuencia.
+    No bloquea: la escritura la hace el hilo escritor.
+    """
+    global _seq, _bytes
+    if _archivo is None or not eventos:
+        return _seq
+    lineas = [(json.dumps(e, ensure_ascii=False) + "\n").encode("utf-8")
+              for e in eventos]
+    with _cond:
+        _pendiente.extend(lineas)
+        _bytes += sum(len(l) for l in lineas)
+        _seq += 1
+        _cond.notify_all()
+        return _seq
+
+def truncar(posicion: int):
+    """
+    Pide al escritor pasar al historial todo lo anterior a `posicion`
+    (la de un snapshot ya durable). No bloquea.
+    """
+    if _archivo is None:
+        return
+    with _cond:
+        _pendiente.append(_Recorte(posicion))
+        _cond.notify_all()
+
+def esperar(seq: int, timeout: float = None) -> bool:
+    """
+    Bloquea hasta que el grupo que contiene `seq` esté en disco. Devuelve
+    False si pasan `timeout` segundos (ESPERA_S por defecto) y relanza la
+    excepción del escritor si este murió.
+    """
+    with _cond:
+        listo = _cond.wait_for(lambda: _durable >= seq or _error is not None,
+                               ESPERA_S if timeout is None else timeout)
+        if _error is not None:
+            raise _error
+        return listo
+
+# ------------------------------------------------------------------ #
+def _escritor():
+    global _durable, _error
+    try:
+        while True:
+            with _cond:
+                _cond.wait_for(lambda: _pendiente)
+            # deja que se acumulen más eventos en el mismo grupo
+            if INTERVALO_MS:
+                time.sleep(INTERVALO_MS / 1000)
+            with _cond:
+                lote = _pendiente[:]
+                _pendiente.clear()
+                hasta = _seq
+
+            lineas = []
+            for item in lote:
+                if isinstance(item, _Recorte):
+                    _escribir(lineas)
+                    lineas = []
+                    _recortar(item.posicion)
+                else:
+                    lineas.append(item)
+            _escribir(lineas)
+
+            with _cond:
+                _durable = hasta
+                _cond.notify_all()
+    except BaseException as e:
+        print(f"[Journal] El escritor se detuvo: {e!r}", flush=True)
+        with _cond:
+            _error = e
+            _cond.notify_all()
+
+def _escribir(lineas):
+    if not lineas:
+        return
+    _archivo.write(b"".join(lineas))
+    _archivo.flush()
+    os.fsync(_archivo.fileno())         # un fsync por grupo
+
+def _recortar(posicion):
+    """
+    Traspasa al historial lo anterior a `posicion` y reescribe el diario
+    con el resto. Cada paso es durable antes del siguiente: el historial
+    con su marca, después el diario nuevo (rename atómico).
+    """
+    global _archivo, _base, _inicio
+    if posicion <= _base:
+        return
+    with open(_ruta, "rb") as f:
+        f.seek(_inicio)
+        previos = f.read(posicion - _base)
+        cola = f.read()
+
+    with open(_historial, "ab") as h:
+        h.write(previos)
+        h.write((json.dumps({"hasta": posicion}) + "\n").encode("utf-8"))
+        h.flush()
+        os.fsync(h.fileno())
+
+    cabecera = (json.dumps({"base": posicion}) + "\n").encode("utf-8")
+    temporal = _ruta + ".tmp"
+    with open(temporal, "wb") as f:
+        f.write(cabecera)
+        f.write(cola)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporal, _ruta)
+    _archivo.close()
+    _archivo = open(_ruta, "ab")
+    _base, _inicio = posicion, len(cabecera)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Lanzador en una sola máquina: levanta todos los componentes de una
+topología como procesos hijos, cableados por ipc:// (sin pila TCP) o por
+tcp://127.0.0.1, según TRANSPORTE (ver config.py).
+
+  v1: DTI + DTI_Respaldo + HealtChecker + facultades
+  v2: broker + broker_sec + health_checkbb + dti_worker × N + facultades_broker
+
+    python lanzador.py --topologia v2 --transporte ipc --workers 4
+    TRANSPORTE=ipc IPC_DIR=<dir impreso> python programas.py --archivo carga.jsonl
+
+Cada componente corre en su propio subdirectorio (resultados/, recursos.db)
+y su salida queda en salida.log. Ctrl+C detiene todo.
+"""
+
+import argparse, importlib, multiprocessing, os, signal, sys, tempfile, time
+
+AQUI = os.path.dirname(os.path.abspath(__file__))
+
+# (etiqueta, módulo, función de arranque, subdirectorio de trabajo)
+TOPOLOGIAS = {
+    "v1": [
+        ("dti",          "DTI",          "iniciar_dti", "dti"),
+        ("dti_respaldo", "DTI_Respaldo", "iniciar_dti", "dti_respaldo"),
+        ("health_dti",   "HealtChecker", "health_check", "health_dti"),
+        ("facultades",   "facultades",   "main",        "facultades"),
+    ],
+    "v2": [
+        ("broker",       "broker",         "broker",   "broker"),
+        ("broker_sec",   "broker_sec",     "broker",   "broker_sec"),
+        ("health",       "health_checkbb", "servicio", "health"),
+        # los dti_worker se agregan según --workers (comparten recursos.db)
+        ("facultades_broker", "facultades_broker", "main", "facultades"),
+    ],
+}
+
+def _componente(modulo, funcion, cwd, env):
+    """Punto de entrada de cada proceso (contexto spawn: imports limpios, config desde env)."""
+    os.makedirs(cwd, exist_ok=True)
+    os.chdir(cwd)
+    os.environ.update(env)
+    sys.path.insert(0, AQUI)
+    log = open("salida.log", "ab")
+    os.dup2(log.fileno(), 1)
+    os.dup2(log.fileno(), 2)
+    # los componentes lanzan sus propios hijos con fork
+    multiprocessing.set_start_method("fork", force=True)
+    getattr(importlib.import_module(modulo), funcion)()
+
+def lanzar(topologia, base, workers=1, env=None, env_por_componente=None):
+    """
+    Arranca la topología bajo `base`; devuelve [(etiqueta, Process)] en orden de arranque.
+    `env_por_componente` agrega variables solo a ciertas etiquetas (p. ej. un worker lento).
+    """
+    env = {"PYTHONUNBUFFERED": "1", **(env or {})}
+    componentes = list(TOPOLOGIAS[topologia])
+    if topologia == "v2":
+        componentes[-1:-1] = [(f"dti_worker_{n}", "dti_worker", "iniciar_dti_worker", "workers")
+                              for n in range(workers)]
+
+    ctx = multiprocessing.get_context("spawn")
+    lanzados = []
+    for etiqueta, modulo, funcion, subdir in componentes:
+        p = ctx.Process(target=_componente,
+                        args=(modulo, funcion, os.path.join(base, subdir),
+                              {**env, **(env_por_componente or {}).get(etiqueta, {})}))
+        p.start()
+        lanzados.append((etiqueta, p))
+    return lanzados
+
+def detener(lanzados, espera=10):
+    """SIGTERM en orden inverso (facultades primero, para que vacíen lo pendiente)."""
+    for _, p in reversed(lanzados):
+        if p.is_alive():
+            os.kill(p.pid, signal.SIGTERM)
+            p.join(espera)
+        if p.is_alive():
+            p.kill()
+            p.join()
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--topologia", choices=sorted(TOPOLOGIAS), default="v2")
+    ap.add_argument("--transporte", choices=["ipc", "local"], default="ipc")
+    ap.add_argument("--workers", type=int, default=2, help="dti_worker en v2")
+    ap.add_argument("--broker-modo", choices=["proxy", "lru"], default="proxy")
+    ap.add_argument("--directorio", default=None, help="base de trabajo (por defecto, temporal)")
+    args = ap.parse_args()
+
+    base = args.directorio or tempfile.mkdtemp(prefix=f"aulas_{args.topologia}_")
+    env = {"TRANSPORTE": args.transporte, "IPC_DIR": os.path.join(base, "ipc"),
+           "BROKER_MODO": args.broker_modo}
+    lanzados = lanzar(args.topologia, base, args.workers, env)
+    print(f"[Lanzador] {args.topologia} por {args.transporte} en {base}")
+    print(f"[Lanzador] Clientes: TRANSPORTE={env['TRANSPORTE']} IPC_DIR={env['IPC_DIR']}")
+
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        while all(p.is_alive() for _, p in lanzados):
+            time.sleep(1)
+        print("[Lanzador] Un componente terminó; deteniendo el resto.")
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        detener(lanzados)
@@ -0,0 +1,53 @@
+"""
+Agrupación de programas por semestre en una sola solicitud al DTI.
+
+Cada facultad acumula los programas que le llegan para un mismo semestre
+y los envía juntos cuando se juntan LOTE_MAX programas o cuando el
+primero lleva LOTE_MS milisegundos esperando, lo que ocurra antes.
+"""
+
+import os, time
+
+LOTE_MAX = int(os.environ.get("FACULTAD_LOTE_MAX", "10"))
+LOTE_MS  = int(os.environ.get("FACULTAD_LOTE_MS", "50"))
+
+# pendientes: { semestre: (t_primero, [programas]) }
+
+def agregar(pendientes: dict, semestre: str, programa: dict):
+    """Agrega `programa`; si el lote del semestre se llenó lo devuelve (y lo saca)."""
+    t0, programas = pendientes.setdefault(semestre, (time.monotonic(), []))
+    programas.append(programa)
+    if len(programas) >= LOTE_MAX:
+        del pendientes[semestre]
+        return programas
+    return None
+
+def vencidos(pendientes: dict) -> list:
+    """Saca y devuelve [(semestre, programas)] cuya ventana ya expiró."""
+    ahora = time.monotonic()
+    listos = [sem for sem, (t0, _) in pendientes.items()
+              if (ahora - t0) * 1000 >= LOTE_MS]
+    return [(sem, pendientes.pop(sem)[1]) for sem in listos]
+
+def vaciar(pendientes: dict) -> list:
+    """Saca y devuelve todos los lotes pendientes."""
+    lotes = [(sem, programas) for sem, (_, programas) in pendientes.items()]
+    pendientes.clear()
+    return lotes
+
+def espera_ms(pendientes: dict, maximo: int) -> int:
+    """Cuánto puede esperar el poll sin pasarse de la ventana más próxima."""
+    if not pendientes:
+        return maximo
+    ahora = time.monotonic()
+    resto = min(LOTE_MS - (ahora - t0) * 1000 for t0, _ in pendientes.values())
+    return max(0, min(maximo, int(resto)))
+
+def resultados_del_lote(resultados: list, programas: list) -> list:
+    """
+    De la respuesta del DTI (que acumula todo lo de la facultad en el
+    semestre) separa el resultado de cada programa del lote, en orden.
+    El DTI pone los del lote al final y en el orden enviado, así que se
+    toman por posición: dos programas con el mismo nombre no se confunden.
+    """
+    return resultados[max(0, len(resultados) - len(programas)):]
@@ -0,0 +1,136 @@
+"""
+Histograma de latencias al estilo HDR: cubetas log-lineales con 64
+sub-cubetas por potencia de dos (error relativo < 1,6 %), memoria
+acotada y percentiles en O(cubetas).
+Los valores se registran en microsegundos enteros.
+"""
+
+import os, threading, time
+
+# Si está definido, las latencias extremo a extremo se anexan a archivos en este
+# directorio para que bench_e2e.py las agregue (sin costo si no lo está).
+METRICAS_DIR = os.environ.get("METRICAS_DIR")
+
+SUB = 64
+
+def _indice(v: int) -> int:
+    if v < 2 * SUB:
+        return v
+    corrimiento = v.bit_length() - 7          # deja v >> corrimiento en [64, 128)
+    return (corrimiento + 1) * SUB + ((v >> corrimiento) - SUB)
+
+def _valor(i: int) -> int:
+    """Límite inferior de la cubeta `i`."""
+    if i < 2 * SUB:
+        return i
+    corrimiento = i // SUB - 1
+    return (SUB + i % SUB) << corrimiento
+
+
+class Histograma:
+    def __init__(self):
+        self.cubetas = {}
+        self.total   = 0
+        self.suma    = 0
+        self.minimo  = None
+        self.maximo  = 0
+
+    def registrar(self, segundos: float):
+        v = max(0, int(segundos * 1_000_000))
+        i = _indice(v)
+        self.cubetas[i] = self.cubetas.get(i, 0) + 1
+        self.total += 1
+        self.suma  += v
+        self.maximo = max(self.maximo, v)
+        self.minimo = v if self.minimo is None else min(self.minimo, v)
+
+    def combinar(self, otro: "Histograma"):
+        for i, n in otro.cubetas.items():
+            self.cubetas[i] = self.cubetas.get(i, 0) + n
+        self.total += otro.total
+        self.suma  += otro.suma
+        self.maximo = max(self.maximo, otro.maximo)
+        if otro.minimo is not None:
+            self.minimo = otro.minimo if self.minimo is None else min(self.minimo, otro.minimo)
+
+    def percentil(self, p: float) -> float:
+        """Percentil `p` (0-100) en segundos."""
+        if not self.total:
+            return 0.0
+        objetivo = max(1, int(round(self.total * p / 100)))
+        acumulado = 0
+        for i in sorted(self.cubetas):
+            acumulado += self.cubetas[i]
+            if acumulado >= objetivo:
+                return min(_valor(i), self.maximo) / 1_000_000
+        return self.maximo / 1_000_000
+
+    def resumen(self) -> dict:
+        """Resumen en milisegundos, listo para imprimir o volcar a JSON."""
+        return {
+            "n": self.total,
+            "min_ms":  (self.minimo or 0) / 1000,
+            "p50_ms":  self.percentil(50) * 1000,
+            "p95_ms":  self.percentil(95) * 1000,
+            "p99_ms":  self.percentil(99) * 1000,
+            "max_ms":  self.maximo / 1000,
+            "media_ms": (self.suma / self.total / 1000) if self.total else 0.0,
+        }
+
+
+class VentanaLatencias:
+    """
+    Percentiles de las últimas muestras (entre `tamano` y 2×`tamano`) para
+    ajustar timeouts en caliente: al llenarse la ventana actual pasa a ser
+    la anterior y se empieza otra. Segura entre hilos.
+    """
+    def __init__(self, tamano: int = 1000, minimo: int = 20):
+        self.tamano   = tamano
+        self.minimo   = minimo
+        self.actual   = Histograma()
+        self.anterior = Histograma()
+        self.lock     = threading.Lock()
+
+    def registrar(self, segundos: float):
+        with self.lock:
+            self.actual.registrar(segundos)
+            if self.actual.total >= self.tamano:
+                self.anterior, self.actual = self.actual, Histograma()
+
+    def percentil(self, p: float):
+        """Percentil `p` en segundos, o None si aún no hay `minimo` muestras."""
+        with self.lock:
+            if self.actual.total + self.anterior.total < self.minimo:
+                return None
+            h = Histograma()
+            h.combinar(self.anterior)
+            h.combinar(self.actual)
+        return h.percentil(p)
+
+
+def registrar_latencia(etiqueta: str, segundos: float, n: int = 1, extension: str = "lat"):
+    """Anexa «fin latencia n_programas» a METRICAS_DIR/{etiqueta}-{pid}.{extension}."""
+    if not METRICAS_DIR:
+        return
+    ruta = os.path.join(METRICAS_DIR, f"{etiqueta}-{os.getpid()}.{extension}")
+    with open(ruta, "a", encoding="utf-8") as f:      # una línea corta: escritura atómica
+        f.write(f"{time.time():.6f} {segundos:.6f} {n}\n")
+
+def leer_latencias(directorio: str, extension: str = "lat"):
+    """Agrega los .{extension} de `directorio`: (histograma, programas, t_ultimo)."""
+    histograma, programas, ultimo = Histograma(), 0, 0.0
+    if not os.path.isdir(directorio):
+        return histograma, programas, ultimo
+    for nombre in os.listdir(directorio):
+        if not nombre.endswith(f".{extension}"):
+            continue
+        with open(os.path.join(directorio, nombre), encoding="utf-8") as f:
+            for linea in f:
+                partes = linea.split()
+                if len(partes) != 3:
+                    continue
+                fin, lat, n = float(partes[0]), float(partes[1]), int(partes[2])
+                histograma.registrar(lat)
+                programas += n
+                ultimo = max(ultimo, fin)
+    return histograma, programas, ultimo
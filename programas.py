@@ -1,6 +1,29 @@
 import zmq
+import zmq.asyncio
 import json
 import multiprocessing
+import argparse
+import asyncio
+import collections
+import itertools
+import time
+import zlib
+import config
+import metricas
+
+# Definir puertos de las facultades (de 6000 a 6090)
+FACULTADES = {
+    "Facultad de Ciencias Sociales": 6000,
+    "Facultad de Ciencias Naturales": 6010,
+    "Facultad de Ingeniería": 6020,
+    "Facultad de Medicina": 6030,
+    "Facultad de Derecho": 6040,
+    "Facultad de Artes": 6050,
+    "Facultad de Educación": 6060,
+    "Facultad de Ciencias Económicas": 6070,
+    "Facultad de Arquitectura": 6080,
+    "Facultad de Tecnología": 6090,
+}
 
 # Función: enviar_a_facultad
 # Parámetros:
@@ -22,7 +45,7 @@ def enviar_a_facultad(programa, semestre, facultad, puerto):
     try:
         context = zmq.Context()  # Crear contexto ZeroMQ
         socket = context.socket(zmq.REQ)  # Crear socket de tipo REQ (Request)
-        socket.connect(f"tcp://10.43.103.102:{puerto}")  # Conectar al puerto correspondiente
+        socket.connect(config.facultad(puerto))  # Conectar al puerto correspondiente
 
         # Preparar los datos para enviar
         data = {
@@ -73,55 +96,302 @@ def procesar_envio_programas(facultad_info, semestre, puerto):
     for p in procesos:
         p.join()
 
+# Función: generar_carga
+# Parámetros:
+#   - trabajos (list | callable): Tuplas (semestre, facultad, puerto, programa) que se envían en ciclo,
+#     o una función que devuelve un iterador nuevo de esas tuplas (p. ej. `leer_solicitudes`).
+#   - tasa (float): Solicitudes por segundo (lazo abierto). Si es None se usa `concurrencia`.
+#   - concurrencia (int): Solicitudes en vuelo constantes (lazo cerrado).
+#   - duracion (float): Segundos máximos de la corrida (None = sin límite de tiempo).
+#   - repeticiones (int): Pasadas completas sobre `trabajos` (None = sin límite de pasadas).
+#
+#   - ventana (int): En lazo abierto, máximo de solicitudes sin respuesta (None = sin límite).
+#   - timeout (float): Segundos que se espera cada respuesta; pasado ese tiempo la solicitud cuenta como
+#     `sin_respuesta` y libera su lugar en la ventana.
+#
+# Funcionalidad:
+# Generador de carga sobre `zmq.asyncio`. Usa un único socket DEALER por facultad (el REP de la facultad
+# responde en orden, así que cada respuesta corresponde a la solicitud más antigua pendiente). En lazo
+# abierto envía a ritmo fijo sin esperar respuestas; en lazo cerrado mantiene `concurrencia` solicitudes
+# en vuelo. Registra la latencia de cada solicitud en un histograma y devuelve el resumen. Ninguna espera
+# pasa de `timeout`, así una facultad que deja de responder no detiene la corrida y `duracion` la acota.
+#
+# Uso de recursos:
+# - Un contexto `zmq.asyncio` y un socket por facultad para toda la corrida, sin procesos hijos.
+async def generar_carga(trabajos, tasa=None, concurrencia=1, duracion=None, repeticiones=None,
+                        ventana=None, timeout=30.0):
+    ctx = zmq.asyncio.Context()
+    loop = asyncio.get_running_loop()
+    histograma = metricas.Histograma()
+    sockets = {}
+    receptores = []
+    en_vuelo = asyncio.Semaphore(ventana) if ventana and tasa else None   # solo en lazo abierto
+    en_curso = set()            # esperas del lazo abierto aún sin terminar
+
+    async def receptor(s, pendientes):
+        while True:
+            await s.recv_multipart()                 # [b"", respuesta]
+            t0, fut = pendientes.popleft()
+            if fut.done():                           # llegó después de su timeout: ya contó como perdida
+                continue
+            histograma.registrar(time.perf_counter() - t0)
+            fut.set_result(None)
+
+    async def esperar(fut):
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            pass                                     # cuenta en `sin_respuesta`
+        finally:
+            if en_vuelo:
+                en_vuelo.release()
+
+    def socket_de(puerto):
+        if puerto not in sockets:
+            s = ctx.socket(zmq.DEALER)
+            s.setsockopt(zmq.LINGER, 0)
+            s.connect(config.facultad(puerto))
+            sockets[puerto] = (s, collections.deque())
+            receptores.append(asyncio.create_task(receptor(*sockets[puerto])))
+        return sockets[puerto]
+
+    # `trabajos` puede ser una lista o una función que devuelve un iterador nuevo por pasada
+    # (así un archivo grande se relee en streaming en cada repetición)
+    nueva_pasada = trabajos if callable(trabajos) else (lambda: iter(trabajos))
+    if repeticiones is None and duracion is None:
+        repeticiones = 1
+    pasadas = range(repeticiones) if repeticiones else itertools.count()
+    fuente = itertools.chain.from_iterable(nueva_pasada() for _ in pasadas)
+    fin = time.perf_counter() + duracion if duracion else None
+    enviados = 0
+
+    def enviar(trabajo):
+        semestre, facultad, puerto, programa = trabajo
+        s, pendientes = socket_de(puerto)
+        fut = loop.create_future()
+        pendientes.append((time.perf_counter(), fut))
+        s.send_multipart([b"", json.dumps({
+            "semestre": semestre, "facultad": facultad, "programa": programa
+        }).encode("utf-8")])
+        return fut
+
+    t_inicio = time.perf_counter()
+    if tasa:
+        # Lazo abierto: la solicitud i sale en t_inicio + i / tasa, sin esperar respuestas
+        for trabajo in fuente:
+            if fin and time.perf_counter() >= fin:
+                break
+            if en_vuelo:
+                await en_vuelo.acquire()        # no más de `ventana` sin respuesta
+            retraso = t_inicio + enviados / tasa - time.perf_counter()
+            if retraso > 0:
+                await asyncio.sleep(retraso)
+            elif enviados % 100 == 0:
+                await asyncio.sleep(0)          # atrasados: dejar correr a los receptores
+            tarea = asyncio.create_task(esperar(enviar(trabajo)))
+            en_curso.add(tarea)
+            tarea.add_done_callback(en_curso.discard)
+            enviados += 1
+    else:
+        # Lazo cerrado: `concurrencia` clientes que envían apenas reciben respuesta
+        async def cliente():
+            nonlocal enviados
+            for trabajo in fuente:
+                if fin and time.perf_counter() >= fin:
+                    return
+                enviados += 1
+                await esperar(enviar(trabajo))
+        await asyncio.gather(*(cliente() for _ in range(concurrencia)))
+
+    # Esperar las respuestas que aún estén en vuelo (cada una, como mucho `timeout`)
+    if en_curso:
+        await asyncio.gather(*en_curso)
+    duracion_real = time.perf_counter() - t_inicio
+
+    for r in receptores:
+        r.cancel()
+    ctx.destroy(linger=0)
+
+    resumen = histograma.resumen()
+    resumen["enviados"] = enviados
+    resumen["sin_respuesta"] = enviados - histograma.total
+    resumen["duracion_s"] = duracion_real
+    resumen["throughput_rps"] = histograma.total / duracion_real if duracion_real else 0.0
+    return resumen
+
+# Función: puerto_de
+# Parámetros:
+#   - facultad (str): Nombre de la facultad.
+#   - fijo (bool): Si es False, una facultad desconocida se reparte de forma estable entre los puertos.
+#
+# Funcionalidad:
+# Devuelve el puerto del servidor de la facultad. Las cargas generadas pueden traer miles de facultades
+# que no tienen servidor propio; con `fijo=False` se asignan a uno de los existentes por hash del nombre.
+def puerto_de(facultad, fijo=True):
+    puerto = FACULTADES.get(facultad)
+    if puerto or fijo:
+        return puerto
+    puertos = list(FACULTADES.values())
+    return puertos[zlib.crc32(facultad.encode("utf-8")) % len(puertos)]
+
+# Función: _iterar_documento
+# Parámetros:
+#   - f (archivo de texto): `solicitudes.json` en el formato documentado (semestre antes que facultades).
+#
+# Funcionalidad:
+# Lee el documento por bloques y entrega (semestre, facultad_info) a medida que cada facultad termina de
+# llegar, sin cargar el archivo completo. La memoria usada es la de un bloque más una facultad.
+def _iterar_documento(f, tam_bloque=1 << 16):
+    decodificador = json.JSONDecoder()
+    buf, pos, eof = "", 0, False
+
+    def mas():
+        nonlocal buf, pos, eof
+        bloque = f.read(tam_bloque)
+        eof = not bloque
+        buf, pos = buf[pos:] + bloque, 0
+
+    def buscar(token):
+        nonlocal pos
+        while True:
+            i = buf.find(token, pos)
+            if i >= 0:
+                pos = i + len(token)
+                return
+            if eof:
+                raise json.JSONDecodeError(f"Falta {token}", buf, pos)
+            pos = max(pos, len(buf) - len(token) + 1)
+            mas()
+
+    def decodificar():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            try:
+                valor, fin = decodificador.raw_decode(buf, pos)
+                if fin < len(buf) or eof:       # si acaba justo en el borde, puede estar cortado
+                    pos = fin
+                    return valor
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            mas()
+
+    buscar('"semestre"'); buscar(':')
+    semestre = decodificar()
+    buscar('"facultades"'); buscar('[')
+    while True:
+        while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                return
+            mas()
+            continue
+        if buf[pos] == "]":
+            return
+        yield semestre, decodificar()
+
+# Función: leer_solicitudes
+# Parámetros:
+#   - ruta (str): `solicitudes.json` (documento) o un flujo `.jsonl` generado con `crearsolicitudes.py --jsonl`.
+#
+# Funcionalidad:
+# Generador de tuplas (semestre, facultad, puerto, programa). Entrega la primera solicitud en cuanto se
+# termina de leer, de modo que el envío empieza sin esperar a que se lea todo el archivo.
+def leer_solicitudes(ruta):
+    with open(ruta, 'r', encoding='utf-8') as f:
+        if ruta.endswith(".jsonl"):
+            for linea in f:
+                if not linea.strip():
+                    continue
+                r = json.loads(linea)
+                yield r["semestre"], r["facultad"], puerto_de(r["facultad"], fijo=False), r["programa"]
+            return
+
+        for semestre, facultad_info in _iterar_documento(f):
+            puerto = puerto_de(facultad_info["nombre"])
+            if not puerto:
+                print(f"Advertencia: No se encontró puerto para la facultad '{facultad_info['nombre']}'")
+                continue
+            for programa in facultad_info["programas"]:
+                yield semestre, facultad_info["nombre"], puerto, programa
+
 # Función principal: main
 #
 # Funcionalidad:
 # La función principal que se encarga de leer los datos de un archivo JSON que contiene la información de
 # los programas y facultades, y luego enviar esta información a cada facultad a través de la función
-# `procesar_envio_programas`. Además, gestiona la asignación de puertos y maneja excepciones relacionadas
-# con la apertura y lectura del archivo JSON.
+# `procesar_envio_programas`. El documento se lee de forma incremental: cada facultad se envía en cuanto
+# termina de leerse. Si el archivo es un flujo `.jsonl`, las solicitudes se envían con el generador
+# asíncrono manteniendo como máximo `ventana` en vuelo, así la memoria no depende del tamaño del archivo.
 #
 # Uso de recursos:
-# - Lee el archivo `solicitudes.json` para obtener los datos de los programas.
+# - Lee el archivo de solicitudes por bloques (`_iterar_documento`) o por líneas (`.jsonl`).
 # - Itera sobre las facultades y les asigna un puerto correspondiente.
 # - Llama a `procesar_envio_programas` para cada facultad con sus programas.
-def main():
+def main(archivo='solicitudes.json', ventana=32):
     try:
-        # Abre el archivo JSON que contiene los datos de los programas
-        with open('solicitudes.json', 'r', encoding='utf-8') as f:
-            programas_data = json.load(f)  # Cargar datos JSON desde el archivo
-
-        semestre = programas_data["semestre"]  # Extraer el semestre de los datos
-
-        # Definir puertos de las facultades (de 6000 a 6090)
-        FACULTADES = {
-            "Facultad de Ciencias Sociales": 6000,
-            "Facultad de Ciencias Naturales": 6010,
-            "Facultad de Ingeniería": 6020,
-            "Facultad de Medicina": 6030,
-            "Facultad de Derecho": 6040,
-            "Facultad de Artes": 6050,
-            "Facultad de Educación": 6060,
-            "Facultad de Ciencias Económicas": 6070,
-            "Facultad de Arquitectura": 6080,
-            "Facultad de Tecnología": 6090,
-        }
+        if archivo.endswith(".jsonl"):
+            resumen = asyncio.run(generar_carga(lambda: leer_solicitudes(archivo),
+                                                concurrencia=ventana, repeticiones=1))
+            print(f"[Programas] {resumen['n']}/{resumen['enviados']} solicitudes entregadas "
+                  f"en {resumen['duracion_s']:.2f}s")
+            return
 
-        # Iterar sobre las facultades y enviar los programas
-        for facultad_info in programas_data["facultades"]:
-            facultad = facultad_info["nombre"]  # Nombre de la facultad
-            puerto = FACULTADES.get(facultad)  # Obtener el puerto correspondiente
-            if puerto:
-                procesar_envio_programas(facultad_info, semestre, puerto)  # Enviar los programas
-            else:
-                print(f"Advertencia: No se encontró puerto para la facultad '{facultad}'")
+        # Abre el archivo JSON que contiene los datos de los programas y lo recorre por facultad
+        with open(archivo, 'r', encoding='utf-8') as f:
+            for semestre, facultad_info in _iterar_documento(f):
+                facultad = facultad_info["nombre"]  # Nombre de la facultad
+                puerto = FACULTADES.get(facultad)  # Obtener el puerto correspondiente
+                if puerto:
+                    procesar_envio_programas(facultad_info, semestre, puerto)  # Enviar los programas
+                else:
+                    print(f"Advertencia: No se encontró puerto para la facultad '{facultad}'")
 
     except FileNotFoundError:
-        print("Error: No se encontró el archivo 'solicitudes.json'")  # Manejar archivo no encontrado
+        print(f"Error: No se encontró el archivo '{archivo}'")  # Manejar archivo no encontrado
     except json.JSONDecodeError:
-        print("Error: El archivo 'solicitudes.json' no tiene un formato JSON válido")  # Manejar error de formato JSON
+        print(f"Error: El archivo '{archivo}' no tiene un formato JSON válido")  # Manejar error de formato JSON
     except Exception as e:
         print(f"Error inesperado: {e}")  # Manejar cualquier otro error inesperado
 
+# Función: main_carga
+# Funcionalidad:
+# Punto de entrada del modo generador de carga (`python programas.py --carga ...`). Imprime el
+# throughput y los percentiles p50/p95/p99 de latencia al terminar.
+def main_carga(args):
+    resumen = asyncio.run(generar_carga(
+        lambda: leer_solicitudes(args.archivo), tasa=args.tasa, concurrencia=args.concurrencia,
+        duracion=args.duracion, repeticiones=args.repeticiones, ventana=args.ventana,
+        timeout=args.timeout))
+    print(f"[Carga] {resumen['n']}/{resumen['enviados']} respuestas en {resumen['duracion_s']:.2f}s "
+          f"→ {resumen['throughput_rps']:.1f} sol/s")
+    print(f"[Carga] latencia p50={resumen['p50_ms']:.2f}ms p95={resumen['p95_ms']:.2f}ms "
+          f"p99={resumen['p99_ms']:.2f}ms max={resumen['max_ms']:.2f}ms")
+    print(json.dumps(resumen))
+
 if __name__ == "__main__":
-    main()  # Ejecutar la función principal
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--carga", action="store_true",
+                    help="modo generador de carga con zmq.asyncio")
+    ap.add_argument("--archivo", default="solicitudes.json",
+                    help="solicitudes.json o un flujo .jsonl")
+    ap.add_argument("--tasa", type=float, default=None,
+                    help="solicitudes por segundo (lazo abierto)")
+    ap.add_argument("--concurrencia", type=int, default=1,
+                    help="solicitudes en vuelo (lazo cerrado, si no hay --tasa)")
+    ap.add_argument("--duracion", type=float, default=None, help="segundos")
+    ap.add_argument("--repeticiones", type=int, default=None,
+                    help="pasadas completas sobre el archivo")
+    ap.add_argument("--ventana", type=int, default=None,
+                    help="máximo de solicitudes sin respuesta (lazo abierto / .jsonl)")
+    ap.add_argument("--timeout", type=float, default=30.0,
+                    help="segundos de espera por respuesta antes de darla por perdida")
+    args = ap.parse_args()
+
+    if args.carga:
+        main_carga(args)
+    else:
+        main(args.archivo, args.ventana or 32)  # Ejecutar la función principal
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Telemetría de los brokers sin costo por mensaje en el camino del proxy.
+
+  • Totales exactos (frames y bytes por lado) los lleva el propio libzmq:
+    el proxy corre con zmq.proxy_steerable y se le pide STATISTICS por su
+    socket de control solo cuando alguien consulta.
+  • Los mensajes por cliente se cuentan exactos desde un socket de captura
+    PUB sin tope de HWM (el PUB nunca frena el proxy; si el hilo contador se
+    atrasa, las copias esperan en memoria en lugar de descartarse). El
+    cliente es el de balanceo.cliente_de: todas las solicitudes de una
+    facultad suman juntas aunque cada intento use una identidad nueva.
+  • Con BROKER_MUESTREO=N (>0) además se mide el tamaño de 1 de cada N
+    mensajes para estimar los bytes por cliente.
+  • BROKER_TELEMETRIA=imprimir conserva la impresión por solicitud de antes.
+  • En modo LRU (balanceo.py) el mismo socket de control lo atiende el
+    balanceador, que agrega la profundidad de su cola.
+
+Consulta desde otra máquina:  python telemetria.py tcp://10.43.96.74:5580
+"""
+
+import json, os, struct, sys, threading, time
+import zmq
+
+import balanceo
+
+MODO     = os.environ.get("BROKER_TELEMETRIA", "contadores")   # contadores | imprimir
+MUESTREO = int(os.environ.get("BROKER_MUESTREO", "0"))         # 0 = sin estimar bytes por cliente
+
+_CAMPOS = ("frames_in", "bytes_in", "frames_out", "bytes_out")
+
+
+class Telemetria:
+    def __init__(self, ctx, etiqueta: str, stats_ep: str,
+                 muestreo: int = MUESTREO, modo: str = MODO):
+        self.ctx       = ctx
+        self.etiqueta  = etiqueta
+        self.muestreo  = muestreo
+        self.modo      = modo
+        self.inicio    = time.time()
+        self.clientes  = {}                 # cliente → mensajes (exacto)
+        self.bytes_clientes = {}            # cliente → bytes (estimados con el muestreo)
+        self.lock      = threading.Lock()
+        self._ultima   = (self.inicio, 0, 0)  # (t, frames_in front, bytes_in front)
+        self.extra     = None               # callable con datos del modo de ruteo (p. ej. cola LRU)
+
+        base = f"inproc://telemetria-{etiqueta.lower()}"
+        self._control_ep = base + "-control"
+        self.control = ctx.socket(zmq.REP)
+        self.control.bind(self._control_ep)
+
+        self.captura = ctx.socket(zmq.PUB)
+        self.captura.setsockopt(zmq.SNDHWM, 0)   # sin tope: ninguna copia se descarta
+        self.captura.bind(base + "-captura")
+        threading.Thread(target=self._capturador, args=(base + "-captura",),
+                         daemon=True).start()
+
+        threading.Thread(target=self._servidor, args=(stats_ep,), daemon=True).start()
+
+    # -------------------------------------------------------------- #
+    def _capturador(self, ep):
+        subs = self.ctx.socket(zmq.SUB)
+        subs.setsockopt(zmq.RCVHWM, 0)
+        subs.connect(ep)
+        subs.setsockopt(zmq.SUBSCRIBE, b"")
+        n = 0
+        while True:
+            frames = subs.recv_multipart(copy=False)
+            n += 1
+            if len(frames) < 2:
+                continue
+            origen = _cliente(frames[0].bytes)
+            if self.modo == "imprimir":
+                print(f"[{self.etiqueta}] Solicitud #{n} de {origen}")
+            muestra = self.muestreo > 0 and n % self.muestreo == 0
+            with self.lock:
+                self.clientes[origen] = self.clientes.get(origen, 0) + 1
+                if muestra:
+                    tam = sum(len(f.buffer) for f in frames)
+                    self.bytes_clientes[origen] = (self.bytes_clientes.get(origen, 0)
+                                                   + tam * self.muestreo)
+
+    def _servidor(self, ep):
+        rep = self.ctx.socket(zmq.REP)
+        rep.bind(ep)
+        req = self.ctx.socket(zmq.REQ)
+        req.connect(self._control_ep)
+        while True:
+            rep.recv()
+            rep.send_json(self.estadisticas(req))
+
+    def estadisticas(self, req) -> dict:
+        """Pide STATISTICS al proxy y arma el resumen (tasas desde la consulta anterior)."""
+        req.send(b"STATISTICS")
+        valores = [struct.unpack("=Q", f)[0] for f in req.recv_multipart()]
+        front = dict(zip(_CAMPOS, valores[:4]))
+        back  = dict(zip(_CAMPOS, valores[4:]))
+
+        ahora = time.time()
+        t0, frames0, bytes0 = self._ultima
+        dt = max(ahora - t0, 1e-9)
+        self._ultima = (ahora, front["frames_in"], front["bytes_in"])
+        with self.lock:
+            clientes = dict(self.clientes)
+            bytes_clientes = dict(self.bytes_clientes)
+        extra = self.extra() if self.extra else {}
+        return {
+            "broker": self.etiqueta,
+            "uptime_s": ahora - self.inicio,
+            "frontend": front,
+            "backend": back,
+            "frames_s": (front["frames_in"] - frames0) / dt,
+            "bytes_s": (front["bytes_in"] - bytes0) / dt,
+            "muestreo": self.muestreo,
+            "clientes": clientes,           # solicitudes + respuestas por cliente
+            **({"bytes_clientes": bytes_clientes} if self.muestreo else {}),
+            **extra,
+        }
+
+
+def _cliente(identidad: bytes) -> str:
+    """Nombre del cliente (balanceo.cliente_de); en hex si la identidad la generó ZeroMQ."""
+    cliente = balanceo.cliente_de(identidad)
+    try:
+        return cliente.decode("utf-8") if cliente and cliente[0] != 0 else cliente.hex()
+    except UnicodeDecodeError:
+        return cliente.hex()
+
+def consultar(ep: str, timeout_ms: int = 2000) -> dict:
+    ctx = zmq.Context.instance()
+    s = ctx.socket(zmq.REQ)
+    s.setsockopt(zmq.LINGER, 0)
+    s.setsockopt(zmq.RCVTIMEO, timeout_ms)
+    s.connect(ep)
+    try:
+        s.send(b"stats")
+        return s.recv_json()
+    finally:
+        s.close()
+
+if __name__ == "__main__":
+    import config
+    ep = sys.argv[1] if len(sys.argv) > 1 else config.endpoint("BROKER_STATS")
+    print(json.dumps(consultar(ep), indent=2, ensure_ascii=False))